@@ -0,0 +1,116 @@
+"""
+Benchmark d'escalabilitat del pipeline de visualització sobre datasets sintètics
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import pandas as pd
+
+import generate_synthetic_data as sintetic
+import instrumentacio
+import pagina
+
+# Mides dels datasets sintètics (en files)
+MIDES = {'1M': 1_000_000, '10M': 10_000_000, '100M': 100_000_000}
+
+DIRECTORI_DADES = 'benchmark_data'
+FITXER_RESULTATS = 'benchmark_results.jsonl'
+
+
+def _versio():
+    """Commit actual del repositori, si n'hi ha."""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def executar(ruta, mode='memoria', processos=None, binari=False):
+    """Genera l'informe complet d'un CSV amb generate_visualization.Informe i retorna les mesures de cada etapa.
+
+    Les etapes són les que registra el mateix pipeline amb instrumentacio.perfil.
+    En mode memòria, l'informe es genera amb una cache del dataset buida (en un
+    directori temporal, al costat del CSV), de manera que cada execució mesura
+    la lectura del CSV i l'escriptura de la cache (etapes carrega i
+    desa_cache); després es mesura a part la càrrega des d'aquesta cache
+    (etapa carrega_cache).
+    """
+    import dades
+    from generate_visualization import Informe
+
+    perfil = instrumentacio.perfil
+    perfil.etapes = []
+    perfil.activar()
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(ruta))) as directori:
+        informe = Informe(ruta=ruta, streaming=mode == 'streaming',
+                          processos=(processos or 0) if mode == 'paralel' else 1, binari=binari,
+                          processos_canvis=processos or 0, cau_dades=os.path.join(directori, dades.DIRECTORI_CACHE))
+        informe.desar(os.path.join(directori, pagina.FITXER_SORTIDA))
+        if mode == 'memoria':
+            dades.carregar_dataset_amb_cache(ruta, informe.cau_dades)
+
+    perfil.resum()
+    return perfil.etapes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--mides', nargs='+', choices=list(MIDES), default=['1M', '10M'],
+                        help='mides dels datasets a mesurar (per defecte: 1M 10M)')
+    parser.add_argument('--mode', choices=['memoria', 'streaming', 'paralel'], default='memoria',
+                        help='camí de càrrega i agregació a mesurar (per defecte: memoria)')
+    parser.add_argument('--processos', type=int, default=None, help='processos per al mode paral·lel')
+    parser.add_argument('--binari', action='store_true',
+                        help='serialitza els gràfics amb typed arrays en base64')
+    parser.add_argument('--directori-dades', default=DIRECTORI_DADES,
+                        help=f'on es generen i es reutilitzen els CSV sintètics (per defecte: {DIRECTORI_DADES})')
+    parser.add_argument('--sortida', default=FITXER_RESULTATS,
+                        help=f"fitxer JSON Lines on s'afegeixen els resultats (per defecte: {FITXER_RESULTATS})")
+    args = parser.parse_args()
+
+    os.makedirs(args.directori_dades, exist_ok=True)
+    resultat = {
+        'versio': _versio(),
+        'data': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'plataforma': platform.platform(),
+        'mode': args.mode,
+        'binari': args.binari,
+        'datasets': [],
+    }
+
+    for mida in args.mides:
+        ruta = os.path.join(args.directori_dades, f'sintetic_{mida}.csv')
+        if not os.path.exists(ruta):
+            print(f"Generant dataset sintètic de {mida} files...")
+            sintetic.generar_csv(ruta, MIDES[mida])
+        print(f"Dataset {mida}:")
+        inici = time.perf_counter()
+        etapes = executar(ruta, args.mode, args.processos, args.binari)
+        resultat['datasets'].append({
+            'dataset': mida,
+            'files': MIDES[mida],
+            'segons_total': round(time.perf_counter() - inici, 4),
+            'etapes': etapes,
+        })
+
+    # El pic de memòria resident és del procés sencer, no de cada dataset
+    pic = instrumentacio.pic_memoria_bytes()
+    resultat['pic_memoria_mb'] = None if pic is None else round(pic / (1 << 20), 2)
+    with open(args.sortida, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(resultat, ensure_ascii=False) + '\n')
+    print(f"Resultats afegits a {args.sortida}")
+
+
+if __name__ == '__main__':
+    main()
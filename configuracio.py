@@ -0,0 +1,23 @@
+"""
+Constants compartides per la línia d'ordres, la càrrega de dades i els gràfics
+
+Aquest mòdul no importa pandas, NumPy ni Plotly, perquè la línia d'ordres
+(--help, validació dels arguments) i les claus del graf d'etapes no els
+necessiten.
+"""
+
+# CSV d'entrada per defecte
+FITXER_DADES = 'Avaluació_de_sisè_d\'educació_primària_20251201_mod.csv'
+
+# Fitxer per defecte on es desa l'estat del cub
+FITXER_ESTAT = 'estat_cub.npz'
+
+# Fitxer per defecte del magatzem SQLite
+FITXER_MAGATZEM = 'dades.sqlite'
+
+# Motors d'agregació disponibles per construir el cub (dades.construir_cub)
+MOTORS_AGREGACIO = ('pandas', 'bincount')
+
+# Dades que rep l'agregació de cada gràfic (abans dels territoris): el cub d'agregats,
+# els punts de canvi de les sèries anuals (canvis.detectar_canvis) o la densitat PLING × PMAT
+FONTS_VISUALITZACIONS = [('cub', 'canvis'), ('cub',), ('cub',), ('cub', 'canvis'), ('densitat',)]
@@ -0,0 +1,1220 @@
+"""
+Càrrega, neteja i agregació de les avaluacions de sisè d'educació primària
+"""
+
+import bz2
+import gzip
+import hashlib
+import inspect
+import io
+import json
+import lzma
+import os
+import shutil
+import sqlite3
+import warnings
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from configuracio import FITXER_DADES, FITXER_ESTAT, FITXER_MAGATZEM, MOTORS_AGREGACIO
+from etapes import clau_fitxer
+from instrumentacio import perfil
+
+# Esquema de les úniques columnes que fan servir les visualitzacions.
+# Les dimensions de text es llegeixen com a categòriques, l'any i l'edat relativa
+# com a enters petits (Int8 admet valors nuls) i les puntuacions com a float32.
+ESQUEMA_COLUMNES = {
+    'ANY': 'int16',
+    'GENERE': 'category',
+    'AREA_TERRITORIAL': 'category',
+    'NATURALESA': 'category',
+    'Edat_Relativa': 'Int8',
+    'PLING': 'float32',
+    'PMAT': 'float32',
+    'Mitjana_Global': 'float32',
+    'LING_MAT': 'float32',
+    'Nivell_Assoliment': 'category',
+}
+
+# Competències principals: les files amb algun valor nul aquí es descarten
+COLUMNES_COMPETENCIES = ['PLING', 'PMAT', 'Mitjana_Global', 'LING_MAT']
+
+# Columnes que es calculen en el pipeline quan l'export en brut de Transparència
+# Catalunya no les porta (el _mod.csv preparat a mà ja les inclou). Les regles
+# són aproximacions a partir de PLING i PMAT, no les definicions de l'export (la
+# Mitjana_Global publicada promitja més competències): quan el CSV porta la
+# columna, sempre es fa servir la del CSV
+COLUMNES_DERIVADES = ['Mitjana_Global', 'LING_MAT', 'Edat_Relativa', 'Nivell_Assoliment']
+
+# Mes de naixement (1-12) de l'export en brut; l'edat relativa dins del curs és
+# 12 - mes (0 per als nascuts al desembre, 11 per als nascuts al gener)
+COLUMNA_MES_NAIXEMENT = 'MES_NAIXEMENT'
+
+# Llindars de Mitjana_Global de cada nivell d'assoliment, de més alt a més baix
+LLINDARS_NIVELL = [(80, 'Alt'), (65, 'Mitja'), (-np.inf, 'Baix')]
+
+# Nivell de confiança dels intervals que es mostren als gràfics
+NIVELL_CONFIANCA = 0.95
+
+# Dimensions que defineixen els estrats de la mostra de previsualització
+ESTRATS_MOSTRA = ['ANY', 'AREA_TERRITORIAL', 'GENERE', 'NATURALESA']
+
+# Directori on es desa la còpia binària (memory-mappable) del dataset net
+DIRECTORI_CACHE = '.cache_dades'
+
+# Versió del format de la cache; si canvia, les caches antigues es tornen a crear
+VERSIO_CACHE = 1
+
+# Dimensions del cub d'agregats del qual surten tots els gràfics
+DIMENSIONS_CUB = ['ANY', 'AREA_TERRITORIAL', 'NATURALESA', 'GENERE', 'Edat_Relativa', 'Nivell_Assoliment']
+
+# Columnes del cub: recompte, sumes i sumes de quadrats de cada competència
+COLUMNES_CUB = (['n'] + [f'{c}_sum' for c in COLUMNES_COMPETENCIES]
+                + [f'{c}_sumsq' for c in COLUMNES_COMPETENCIES])
+
+# Nombre màxim de cel·les del producte de dimensions per indexar bincount directament
+MAX_CELLES_BINCOUNT = 1 << 24
+
+
+def netejar_dataset(df):
+    """Elimina in situ les files amb competències nul·les i les categories que queden sense ús."""
+    # Eliminem files amb valors nuls en les competències principals sense
+    # mantenir viva una segona còpia completa del dataset
+    df.dropna(subset=COLUMNES_COMPETENCIES, inplace=True)
+    df.reset_index(drop=True, inplace=True)
+
+    # Les categories que només apareixien en files descartades no s'han de mostrar
+    for columna, tipus in ESQUEMA_COLUMNES.items():
+        if tipus == 'category':
+            df[columna] = df[columna].cat.remove_unused_categories()
+    return df
+
+
+# Signatures (primers bytes) dels formats comprimits que es poden llegir directament
+SIGNATURES_COMPRESSIO = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+    (b"7z\xbc\xaf\x27\x1c", '7z'),
+]
+
+
+def format_compressio(ruta):
+    """Format de compressió del fitxer segons els seus primers bytes (None si és text pla)."""
+    with open(ruta, 'rb') as f:
+        capcalera = f.read(8)
+    for signatura, format_ in SIGNATURES_COMPRESSIO:
+        if capcalera.startswith(signatura):
+            return format_
+    return None
+
+
+def _obrir_zstd(ruta):
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Per llegir {ruta} (zstd) cal Python 3.14 o el paquet zstandard") from None
+        # El lector de zstandard no té readline(), que fan servir columnes_csv i el mode paral·lel
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(ruta, 'rb'), closefd=True))
+    return zstd.open(ruta, 'rb')
+
+
+def obrir_dades(ruta):
+    """Obre el CSV de dades com a flux binari, descomprimint-lo al vol si cal.
+
+    El format es detecta pel contingut (gzip, bz2, xz, zip amb un sol CSV o
+    zstd), no per l'extensió, i el CSV pla no s'escriu mai a disc.
+    """
+    format_ = format_compressio(ruta)
+    if format_ is None:
+        return open(ruta, 'rb')
+    if format_ == 'gzip':
+        return gzip.open(ruta, 'rb')
+    if format_ == 'bz2':
+        return bz2.open(ruta, 'rb')
+    if format_ == 'xz':
+        return lzma.open(ruta, 'rb')
+    if format_ == 'zstd':
+        return _obrir_zstd(ruta)
+    if format_ == 'zip':
+        arxiu = zipfile.ZipFile(ruta)
+        membres = [nom for nom in arxiu.namelist() if not nom.endswith('/')]
+        csvs = [nom for nom in membres if nom.lower().endswith('.csv')] or membres
+        if len(csvs) != 1:
+            raise ValueError(f"{ruta} ha de contenir un sol CSV (en conté {len(csvs)})")
+        return arxiu.open(csvs[0])
+    raise ValueError(f"{ruta} és un arxiu {format_}, que no es pot llegir en streaming: "
+                     f"cal recomprimir-lo en gzip, xz, bz2, zip o zstd")
+
+
+def columnes_csv(ruta):
+    """Noms de les columnes de la capçalera del CSV (pla o comprimit)."""
+    with obrir_dades(ruta) as f:
+        return list(pd.read_csv(io.BytesIO(f.readline()), nrows=0).columns)
+
+
+def esquema_lectura(columnes):
+    """Tipus de les columnes a llegir d'un CSV amb capçalera `columnes` i columnes derivades que hi falten.
+
+    Si cal derivar columnes de les puntuacions, PLING i PMAT es llegeixen en
+    float64 perquè els llindars dels nivells es comparin sense errors d'arrodoniment.
+    """
+    derivades = [columna for columna in COLUMNES_DERIVADES if columna not in columnes]
+    esquema = {columna: tipus for columna, tipus in ESQUEMA_COLUMNES.items() if columna not in derivades}
+    if set(derivades) - {'Edat_Relativa'}:
+        esquema.update(PLING='float64', PMAT='float64')
+    if 'Edat_Relativa' in derivades:
+        esquema[COLUMNA_MES_NAIXEMENT] = 'Int8'
+    absents = [columna for columna in esquema if columna not in columnes]
+    if absents:
+        raise ValueError(f"Al CSV hi falten les columnes: {', '.join(absents)}")
+    return esquema, derivades
+
+
+def avisar_derivades(ruta, derivades):
+    """Avisa que les columnes que falten al CSV es calcularan amb regles aproximades."""
+    if derivades:
+        warnings.warn(f"{ruta} no porta les columnes {', '.join(derivades)}: es calculen amb regles aproximades "
+                      f"(derivar_columnes) i poden no coincidir amb les publicades", stacklevel=3)
+
+
+def derivar_columnes(df, derivades):
+    """Calcula in situ, amb operacions vectoritzades, les columnes derivades indicades."""
+    if not derivades:
+        return df
+    pling = df['PLING'].to_numpy(np.float64)
+    pmat = df['PMAT'].to_numpy(np.float64)
+    mitjana = (pling + pmat) / 2
+    if 'Mitjana_Global' in derivades:
+        df['Mitjana_Global'] = mitjana.astype(np.float32)
+    if 'LING_MAT' in derivades:
+        df['LING_MAT'] = (pling - pmat).astype(np.float32)
+    if 'Edat_Relativa' in derivades:
+        df['Edat_Relativa'] = (12 - df.pop(COLUMNA_MES_NAIXEMENT)).astype('Int8')
+    if 'Nivell_Assoliment' in derivades:
+        # Categories en ordre alfabètic, com les que dedueix read_csv del _mod.csv
+        etiquetes = sorted(etiqueta for _, etiqueta in LLINDARS_NIVELL)
+        codis = np.select([mitjana >= llindar for llindar, _ in LLINDARS_NIVELL],
+                          [etiquetes.index(etiqueta) for _, etiqueta in LLINDARS_NIVELL], -1)
+        df['Nivell_Assoliment'] = pd.Categorical.from_codes(codis, etiquetes)
+    df['PLING'] = df['PLING'].astype(ESQUEMA_COLUMNES['PLING'])
+    df['PMAT'] = df['PMAT'].astype(ESQUEMA_COLUMNES['PMAT'])
+    return df
+
+
+def carregar_dataset(ruta=FITXER_DADES):
+    """Llegeix només les columnes necessàries amb tipus explícits i elimina les files nul·les.
+
+    Les columnes derivades que no porti el CSV (export en brut) es calculen en llegir-lo.
+    """
+    esquema, derivades = esquema_lectura(columnes_csv(ruta))
+    avisar_derivades(ruta, derivades)
+    with perfil.etapa('carrega') as etapa, obrir_dades(ruta) as f:
+        df = pd.read_csv(f, usecols=list(esquema), dtype=esquema)
+        derivar_columnes(df, derivades)
+        etapa['files'] = len(df)
+    with perfil.etapa('neteja') as etapa:
+        etapa['files'] = len(df)
+        netejar_dataset(df)
+        etapa['files_netes'] = len(df)
+    return df
+
+
+# ==============================================================================
+# Cache columnar del dataset net
+# ==============================================================================
+# Cada CSV d'origen té el seu directori, amb un nom que inclou el hash de la
+# ruta absoluta, i dins hi ha una entrada per contingut (hash i mida): cada
+# columna s'hi desa com a fitxer .npy. El nom de l'entrada inclou també l'empremta
+# de l'esquema i de les regles de neteja i derivació, de manera que canviar-les
+# invalida la cache. La clau del CSV (mida, mtime i hash del contingut,
+# etapes.clau_fitxer) es desa a clau.json; mentre la mida i el mtime no canvien,
+# el hash no es torna a calcular i obrir la cache no llegeix el CSV. Les puntuacions es desen
+# juntes en un sol bloc float32 amb la mateixa disposició que fa servir pandas,
+# de manera que es poden obrir amb mmap sense cap còpia i diversos processos
+# comparteixen la mateixa page cache del sistema operatiu.
+
+def _directori_font(ruta, directori_cache):
+    """Directori de cache d'un fitxer: el nom i el hash de la ruta absoluta, perquè dos fitxers no el comparteixin."""
+    ruta = os.path.abspath(ruta)
+    return os.path.join(directori_cache,
+                        f"{os.path.basename(ruta)}-{hashlib.sha256(ruta.encode('utf-8')).hexdigest()[:16]}")
+
+
+def _empremta_esquema():
+    """Hash de l'esquema de columnes i del codi que neteja i deriva el dataset (el que desa la cache)."""
+    parts = [ESQUEMA_COLUMNES, COLUMNES_DERIVADES, COLUMNA_MES_NAIXEMENT, LLINDARS_NIVELL,
+             *(inspect.getsource(funcio) for funcio in (esquema_lectura, derivar_columnes, netejar_dataset))]
+    text = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _nom_directori_cache(clau):
+    return f"{clau['sha256'][:32]}-{clau['mida']}-v{VERSIO_CACHE}-{_empremta_esquema()[:12]}"
+
+
+def _desar_json(dades, ruta):
+    """Escriu un JSON de manera atòmica."""
+    temporal = f'{ruta}.tmp-{os.getpid()}'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(dades, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _desar_cache(df, directori, clau):
+    """Escriu el dataset net com a columnes .npy i un manifest.json al directori indicat."""
+    os.makedirs(directori)
+    # Bloc (n_competencies, n_files) en ordre C: el transposat és el que pandas guarda internament
+    np.save(os.path.join(directori, 'competencies.npy'),
+            np.ascontiguousarray(df[COLUMNES_COMPETENCIES].to_numpy(dtype='float32').T))
+
+    categories = {}
+    for columna, tipus in ESQUEMA_COLUMNES.items():
+        if columna in COLUMNES_COMPETENCIES:
+            continue
+        if tipus == 'category':
+            np.save(os.path.join(directori, f'{columna}.npy'), df[columna].cat.codes.to_numpy())
+            categories[columna] = [str(c) for c in df[columna].cat.categories]
+        elif tipus == 'Int8':
+            np.save(os.path.join(directori, f'{columna}.npy'),
+                    df[columna].to_numpy(dtype='int8', na_value=0))
+            np.save(os.path.join(directori, f'{columna}.mask.npy'), df[columna].isna().to_numpy())
+        else:
+            np.save(os.path.join(directori, f'{columna}.npy'), df[columna].to_numpy(dtype=tipus))
+
+    # El manifest s'escriu l'últim: la seva presència indica que la cache és completa
+    manifest = {'clau': clau, 'files': len(df), 'categories': categories}
+    with open(os.path.join(directori, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+
+def _carregar_cache(directori):
+    """Obre una cache existent amb mmap i reconstrueix el DataFrame sense copiar les columnes."""
+    with open(os.path.join(directori, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    competencies = np.load(os.path.join(directori, 'competencies.npy'), mmap_mode='r')
+    df = pd.DataFrame(competencies.T, columns=COLUMNES_COMPETENCIES, copy=False)
+
+    # La resta de columnes s'insereixen una a una, a la seva posició de l'esquema,
+    # perquè pandas no consolidi (i per tant copiï) el bloc de puntuacions
+    for posicio, (columna, tipus) in enumerate(ESQUEMA_COLUMNES.items()):
+        if columna in COLUMNES_COMPETENCIES:
+            continue
+        valors = np.load(os.path.join(directori, f'{columna}.npy'), mmap_mode='r')
+        if tipus == 'category':
+            valors = pd.Categorical.from_codes(valors, categories=manifest['categories'][columna])
+        elif tipus == 'Int8':
+            mascara = np.load(os.path.join(directori, f'{columna}.mask.npy'), mmap_mode='r')
+            valors = pd.arrays.IntegerArray(valors, mascara)
+        df.insert(posicio, columna, valors)
+    return df
+
+
+def carregar_dataset_amb_cache(ruta=FITXER_DADES, directori_cache=DIRECTORI_CACHE):
+    """Carrega el dataset net des de la cache si és vigent; si no, llegeix el CSV i la reconstrueix.
+
+    La cache es publica amb un rename atòmic, de manera que diversos processos
+    que s'executin alhora mai veuen una cache a mitges.
+    """
+    directori_font = _directori_font(ruta, directori_cache)
+    ruta_clau = os.path.join(directori_font, 'clau.json')
+    with perfil.etapa('clau_cache'):
+        try:
+            with open(ruta_clau, encoding='utf-8') as f:
+                clau_anterior = json.load(f)
+        except (OSError, ValueError):
+            clau_anterior = None
+        clau = clau_fitxer(ruta, clau_anterior)
+    directori = os.path.join(directori_font, _nom_directori_cache(clau))
+
+    if os.path.exists(os.path.join(directori, 'manifest.json')):
+        try:
+            with perfil.etapa('carrega_cache') as etapa:
+                df = _carregar_cache(directori)
+                etapa['files'] = len(df)
+        except (OSError, KeyError, ValueError):
+            # Una cache incompleta o malmesa es tracta com si no hi fos i es torna a crear
+            shutil.rmtree(directori, ignore_errors=True)
+        else:
+            # El contingut no ha canviat però el mtime sí: es desa perquè la propera vegada no calgui el hash
+            if clau != clau_anterior:
+                _desar_json(clau, ruta_clau)
+            return df
+
+    df = carregar_dataset(ruta)
+    temporal = os.path.join(directori_font, f'.tmp-{os.getpid()}')
+    shutil.rmtree(temporal, ignore_errors=True)
+    with perfil.etapa('desa_cache'):
+        _desar_cache(df, temporal, clau)
+    try:
+        os.replace(temporal, directori)
+    except OSError:
+        # Un altre procés ha publicat la mateixa cache abans que nosaltres
+        shutil.rmtree(temporal, ignore_errors=True)
+    _desar_json(clau, ruta_clau)
+
+    # Eliminem les caches antigues del mateix fitxer (si algun procés encara
+    # les té obertes, es deixen per a la propera execució)
+    for nom in os.listdir(directori_font):
+        if nom not in (os.path.basename(directori), 'clau.json') and not nom.startswith(('.tmp-', 'clau.json.tmp-')):
+            shutil.rmtree(os.path.join(directori_font, nom), ignore_errors=True)
+    return df
+
+
+# ==============================================================================
+# Cub d'agregats
+# ==============================================================================
+# Una sola passada sobre les dades calcula, per a cada combinació de les
+# dimensions, el nombre d'alumnes i la suma i la suma de quadrats de cada
+# competència. Tots els gràfics i totes les opcions dels desplegables
+# (inclòs "Tots") s'obtenen després agregant aquest cub, que té uns pocs
+# milers de cel·les en lloc de centenars de milers de files.
+
+def _codificar_dimensio(serie):
+    """Codifica una dimensió com a enters (els nuls reben el codi -1) i retorna també les etiquetes."""
+    if serie.dtype.name != 'category':
+        if pd.api.types.is_extension_array_dtype(serie.dtype):
+            serie = serie.astype('float64')
+        serie = serie.astype('category')
+    return serie.cat.codes.to_numpy(), serie.cat.categories
+
+
+def mostra_estratificada(df, fraccio=None, max_files=None, estrats=ESTRATS_MOSTRA, llavor=0):
+    """Mostra aleatòria amb la mateixa fracció de files de cada estrat (i almenys una per estrat).
+
+    La fracció es pot donar directament o com a pressupost de files; com que
+    cada estrat no buit conserva com a mínim una fila, la mostra pot superar
+    lleugerament el pressupost.
+    """
+    if max_files is not None:
+        fraccio = max_files / max(len(df), 1)
+    if fraccio is None or fraccio >= 1:
+        return df
+
+    # Identificador d'estrat a partir dels codis de cada dimensió (-1 per als nuls)
+    codis, mides = [], []
+    for columna in estrats:
+        codi, etiquetes = _codificar_dimensio(df[columna])
+        codis.append(codi.astype(np.int64) + 1)
+        mides.append(len(etiquetes) + 1)
+    estrat = np.ravel_multi_index(codis, mides)
+
+    # Ordre aleatori dins de cada estrat; es queden les primeres files fins a la quota
+    ordre = np.lexsort((np.random.default_rng(llavor).random(len(df)), estrat))
+    estrat_ordenat = estrat[ordre]
+    inicis = np.flatnonzero(np.r_[True, estrat_ordenat[1:] != estrat_ordenat[:-1]])
+    mides_estrats = np.diff(np.r_[inicis, len(df)])
+    quotes = np.maximum(1, np.rint(mides_estrats * fraccio)).astype(np.int64)
+    posicio = np.arange(len(df)) - np.repeat(inicis, mides_estrats)
+    seleccio = np.sort(ordre[posicio < np.repeat(quotes, mides_estrats)])
+    return df.iloc[seleccio].reset_index(drop=True)
+
+
+def _cub_pandas(codis, mides, valors):
+    """Motor pandas: groupby sobre els codis enters de les dimensions."""
+    mesures = pd.DataFrame(np.hstack([valors, valors * valors]), columns=COLUMNES_CUB[1:])
+
+    # Agrupem pels codis enters (sense nuls) perquè les files amb alguna
+    # dimensió buida també comptin en els totals
+    grups = mesures.groupby(list(codis), sort=True)
+    cub = grups.sum()
+    cub.insert(0, 'n', grups.size())
+    codis_celles = [cub.index.get_level_values(i).to_numpy() for i in range(len(codis))]
+    return codis_celles, cub.reset_index(drop=True)
+
+
+def _cub_bincount(codis, mides, valors):
+    """Motor NumPy: una clau combinada per fila i np.bincount per als recomptes i les sumes."""
+    # Desplacem els codis una posició perquè el -1 dels nuls sigui un índex vàlid
+    forma = tuple(m + 1 for m in mides)
+    clau = np.ravel_multi_index([c.astype(np.int64) + 1 for c in codis], forma)
+
+    # Si el producte de cardinalitats és massa gran, compactem les claus observades
+    claus_observades = None
+    if np.prod(forma, dtype=np.float64) > MAX_CELLES_BINCOUNT:
+        claus_observades, clau = np.unique(clau, return_inverse=True)
+    mida = len(claus_observades) if claus_observades is not None else int(np.prod(forma))
+
+    n = np.bincount(clau, minlength=mida)
+    presents = np.flatnonzero(n)
+    columnes = {'n': n[presents]}
+    for j, columna in enumerate(COLUMNES_COMPETENCIES):
+        columnes[f'{columna}_sum'] = np.bincount(clau, weights=valors[:, j], minlength=mida)[presents]
+    for j, columna in enumerate(COLUMNES_COMPETENCIES):
+        columnes[f'{columna}_sumsq'] = np.bincount(clau, weights=valors[:, j] ** 2, minlength=mida)[presents]
+
+    celles = claus_observades[presents] if claus_observades is not None else presents
+    codis_celles = [c - 1 for c in np.unravel_index(celles, forma)]
+    return codis_celles, pd.DataFrame(columnes)
+
+
+# Funció de cada motor d'agregació (configuracio.MOTORS_AGREGACIO)
+FUNCIONS_MOTOR = dict(zip(MOTORS_AGREGACIO, (_cub_pandas, _cub_bincount)))
+
+
+def construir_cub(df, motor='bincount'):
+    """Construeix el cub n / suma / suma de quadrats indexat per DIMENSIONS_CUB.
+
+    Les dimensions es codifiquen a enters una sola vegada i el motor indicat
+    ('pandas' o 'bincount') calcula els agregats; tots dos donen el mateix cub.
+    """
+    codis, etiquetes = zip(*(_codificar_dimensio(df[d]) for d in DIMENSIONS_CUB))
+    valors = df[COLUMNES_COMPETENCIES].to_numpy(dtype='float64')
+
+    codis_celles, cub = FUNCIONS_MOTOR[motor](codis, [len(e) for e in etiquetes], valors)
+    cub.index = pd.MultiIndex(levels=list(etiquetes), codes=codis_celles, names=DIMENSIONS_CUB)
+    return cub
+
+
+def agregar_cub(cub, dimensions, **filtres):
+    """Agrega el cub sobre les dimensions indicades, filtrant opcionalment per valor d'altres dimensions.
+
+    Els grups amb un valor nul en alguna de les dimensions s'exclouen, igual
+    que fa groupby sobre les dades originals.
+    """
+    if filtres:
+        mascara = np.ones(len(cub), dtype=bool)
+        for dimensio, valor in filtres.items():
+            mascara &= cub.index.get_level_values(dimensio) == valor
+        cub = cub[mascara]
+    if not dimensions:
+        # La suma per columnes passa per una Series float: els recomptes tornen a ser enters
+        return cub.sum().to_frame().T.astype(cub.dtypes.to_dict())
+    return cub.groupby(level=dimensions, sort=True).sum()
+
+
+def mitjanes_cub(cub, dimensions, mesura, **filtres):
+    """Mitjana d'una competència per a cada grup de les dimensions indicades."""
+    agregat = agregar_cub(cub, dimensions, **filtres)
+    return agregat[f'{mesura}_sum'] / agregat['n']
+
+
+def valor_critic(nivell=NIVELL_CONFIANCA):
+    """Quantil de la normal per a un interval de confiança bilateral del nivell indicat."""
+    return NormalDist().inv_cdf(0.5 + nivell / 2)
+
+
+def interval_cub(cub, dimensions, mesura, nivell=NIVELL_CONFIANCA, **filtres):
+    """Mitjana d'una competència per grup amb el seu interval de confiança (aproximació normal).
+
+    L'error estàndard surt directament de les sumes i les sumes de quadrats del
+    cub, per a tots els grups alhora. Retorna les columnes mitjana, error (la
+    semiamplada de l'interval), inferior i superior; els grups d'un sol alumne
+    no tenen interval (NaN).
+    """
+    agregat = agregar_cub(cub, dimensions, **filtres)
+    agregat = agregat[agregat['n'] > 0]
+    n = agregat['n'].to_numpy(dtype=float)
+    suma = agregat[f'{mesura}_sum'].to_numpy()
+    mitjana = suma / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variancia = np.clip((agregat[f'{mesura}_sumsq'].to_numpy() - suma * mitjana) / (n - 1), 0, None)
+        error = valor_critic(nivell) * np.sqrt(variancia / n)
+    error[n < 2] = np.nan
+    return pd.DataFrame({'mitjana': mitjana, 'error': error, 'inferior': mitjana - error, 'superior': mitjana + error},
+                        index=agregat.index)
+
+
+def filtrar_cub(cub, **filtres):
+    """Subcub amb només els grups que compleixen els filtres (un valor o una llista de valors per dimensió).
+
+    El resultat és un cub complet: les estadístiques i els gràfics s'hi poden
+    calcular igual que sobre el cub de tot el dataset.
+    """
+    mascara = np.ones(len(cub), dtype=bool)
+    for dimensio, valors in filtres.items():
+        if not isinstance(valors, (list, tuple, set)):
+            valors = [valors]
+        mascara &= cub.index.get_level_values(dimensio).isin(list(valors))
+    cub = cub[mascara]
+    cub.index = cub.index.remove_unused_levels()
+    return cub
+
+
+def consultar_cub(cub, dimensions, mesura=None, **filtres):
+    """Recompte (i mitjana de `mesura`, si s'indica) per a cada grup de les dimensions, amb filtres opcionals.
+
+    Els filtres admeten un valor o una llista de valors per dimensió, com a
+    filtrar_cub(). Només es retornen els grups amb algun alumne.
+    """
+    desconegudes = [dimensio for dimensio in list(dimensions) + list(filtres) if dimensio not in DIMENSIONS_CUB]
+    if desconegudes:
+        raise ValueError(f"Dimensions desconegudes: {', '.join(desconegudes)} (disponibles: {', '.join(DIMENSIONS_CUB)})")
+    if mesura is not None and mesura not in COLUMNES_COMPETENCIES:
+        raise ValueError(f"Mesura desconeguda: {mesura} (disponibles: {', '.join(COLUMNES_COMPETENCIES)})")
+    if filtres:
+        cub = filtrar_cub(cub, **filtres)
+    agregat = agregar_cub(cub, list(dimensions))
+    agregat = agregat[agregat['n'] > 0]
+    resultat = agregat[['n']].copy()
+    if mesura is not None:
+        resultat['mitjana'] = agregat[f'{mesura}_sum'] / agregat['n']
+    return resultat
+
+
+# ==============================================================================
+# Densitat conjunta de PLING i PMAT (gràfic 5)
+# ==============================================================================
+# Els alumnes es compten sobre una graella fixa de caselles de 0 a 100 per a
+# cada combinació de dimensions (un np.histogram2d per grup, calculat amb un
+# sol bincount), de manera que la mida del resultat no depèn del nombre de
+# files. Com el cub, els recomptes de diversos blocs se sumen.
+
+# Dimensions per les quals es pot filtrar la densitat: les dels filtres de l'informe i el gènere
+DIMENSIONS_DENSITAT = ['ANY', 'AREA_TERRITORIAL', 'NATURALESA', 'GENERE']
+
+# Caselles de la graella per eix (cada casella fa 100 / CASELLES_DENSITAT punts)
+CASELLES_DENSITAT = 25
+
+# Nombre de blocs parcials que s'acumulen abans de fusionar-los
+MAX_PARCIALS_DENSITAT = 8
+
+# Dimensions dins de les quals es limita la mostra de punts (les del desplegable i els botons del gràfic 5)
+GRUPS_PUNTS = ['AREA_TERRITORIAL', 'GENERE']
+
+
+def caselles_puntuacio(valors, caselles=CASELLES_DENSITAT):
+    """Casella (0 a caselles - 1) de cada puntuació; el 100 cau a l'última, com a np.histogram2d."""
+    return np.clip((np.asarray(valors, dtype=np.float64) * (caselles / 100)).astype(np.int64), 0, caselles - 1)
+
+
+def densitat_bloc(df, caselles=CASELLES_DENSITAT):
+    """Recompte d'alumnes per DIMENSIONS_DENSITAT i casella de PLING × PMAT (només les caselles no buides)."""
+    codis, etiquetes = zip(*(_codificar_dimensio(df[d]) for d in DIMENSIONS_DENSITAT))
+    forma = tuple(len(e) + 1 for e in etiquetes) + (caselles, caselles)
+    clau = np.ravel_multi_index([c.astype(np.int64) + 1 for c in codis]
+                                + [caselles_puntuacio(df['PLING'], caselles),
+                                   caselles_puntuacio(df['PMAT'], caselles)], forma)
+
+    claus_observades = None
+    if np.prod(forma, dtype=np.float64) > MAX_CELLES_BINCOUNT:
+        claus_observades, clau = np.unique(clau, return_inverse=True)
+    n = np.bincount(clau, minlength=len(claus_observades) if claus_observades is not None else int(np.prod(forma)))
+    presents = np.flatnonzero(n)
+    celles = np.unravel_index(claus_observades[presents] if claus_observades is not None else presents, forma)
+    index = pd.MultiIndex(levels=list(etiquetes) + [pd.RangeIndex(caselles)] * 2,
+                          codes=[c - 1 for c in celles[:-2]] + list(celles[-2:]),
+                          names=DIMENSIONS_DENSITAT + ['casella_PLING', 'casella_PMAT'])
+    return pd.DataFrame({'n': n[presents]}, index=index)
+
+
+def _menors_per_grup(taula, clau, punts):
+    """Posicions de les `punts` files amb la clau més petita de cada grup de GRUPS_PUNTS, ordenades per clau.
+
+    Els grups poden ser columnes o nivells de l'índex de `taula`.
+    """
+    ordre = np.argsort(clau, kind='stable')
+    rang = taula.iloc[ordre].groupby(GRUPS_PUNTS, sort=False, observed=True, dropna=False).cumcount().to_numpy()
+    return ordre[rang < punts]
+
+
+def mostra_punts(df, punts):
+    """Els `punts` alumnes de cada territori i gènere amb el hash de fila més petit, indexats per DIMENSIONS_DENSITAT.
+
+    El hash depèn només del contingut de la fila, de manera que la mostra de
+    cada grup és uniforme i no canvia segons com es parteixin les dades en
+    blocs o processos. Els `punts` primers per hash d'una unió de grups són
+    també una mostra uniforme de la unió.
+    """
+    if not punts:
+        return None
+    columnes = DIMENSIONS_DENSITAT + ['PLING', 'PMAT']
+    clau = pd.util.hash_pandas_object(df[columnes], index=False).to_numpy()
+    seleccio = _menors_per_grup(df, clau, punts)
+    mostra = df[columnes].iloc[seleccio].reset_index(drop=True)
+    mostra['clau'] = clau[seleccio]
+    return mostra.set_index(DIMENSIONS_DENSITAT)
+
+
+class AcumuladorDensitat:
+    """Acumulador fusionable de la densitat PLING × PMAT i, opcionalment, d'una mostra acotada d'alumnes."""
+
+    def __init__(self, punts=0, caselles=CASELLES_DENSITAT):
+        self.punts = punts
+        self.caselles = caselles
+        self._recomptes = []
+        self._mostres = []
+
+    def afegir_bloc(self, df):
+        """Afegeix un bloc de dades netes."""
+        self.afegir(densitat_bloc(df, self.caselles), mostra_punts(df, self.punts))
+
+    def afegir(self, recomptes, mostra=None):
+        """Afegeix els recomptes (de densitat_bloc) i la mostra (de mostra_punts) d'un bloc; tots dos poden ser None."""
+        if recomptes is not None:
+            self._recomptes.append(recomptes)
+        if mostra is not None:
+            self._mostres.append(mostra)
+        if max(len(self._recomptes), len(self._mostres)) > MAX_PARCIALS_DENSITAT:
+            self._fusionar()
+
+    def _fusionar(self):
+        if len(self._recomptes) > 1:
+            recomptes = pd.concat(self._recomptes)
+            self._recomptes = [recomptes.groupby(level=list(range(recomptes.index.nlevels)),
+                                                 sort=True, dropna=False).sum()]
+        if len(self._mostres) > 1:
+            mostra = pd.concat(self._mostres)
+            self._mostres = [mostra.iloc[_menors_per_grup(mostra, mostra['clau'].to_numpy(), self.punts)]]
+
+    def resultat(self):
+        """Densitat acumulada ({'recomptes', 'punts' o None, 'punts_per_grup', 'caselles'}); None si no hi ha res."""
+        if not self._recomptes:
+            return None
+        self._fusionar()
+        punts = self._mostres[0] if self._mostres else None
+        if punts is not None:
+            punts = punts.iloc[np.argsort(punts['clau'].to_numpy(), kind='stable')]
+        return {'recomptes': self._recomptes[0], 'punts': punts, 'punts_per_grup': self.punts,
+                'caselles': self.caselles}
+
+
+def filtrar_densitat(densitat, **filtres):
+    """Densitat restringida als filtres (com filtrar_cub); None si no n'hi ha."""
+    if densitat is None or not filtres:
+        return densitat
+    punts = densitat['punts']
+    return {
+        'recomptes': filtrar_cub(densitat['recomptes'], **filtres),
+        'punts': None if punts is None else filtrar_cub(punts, **filtres),
+        'punts_per_grup': densitat['punts_per_grup'],
+        'caselles': densitat['caselles'],
+    }
+
+
+# ==============================================================================
+# Mode streaming (fitxers més grans que la memòria)
+# ==============================================================================
+# El CSV es llegeix per blocs de mida acotada; cada bloc es neteja, es redueix
+# al seu cub i es fusiona en un acumulador. Com que el cub només conté
+# recomptes i sumes, el resultat és el mateix que el del camí en memòria.
+
+def _etiquetes_json(etiquetes):
+    """Etiquetes amb els escalars de NumPy passats a tipus de Python, perquè siguin serialitzables en JSON."""
+    return [e.item() if isinstance(e, np.generic) else e for e in etiquetes]
+
+
+class AcumuladorCub:
+    """Acumulador fusionable del cub: es pot alimentar amb cubs parcials i combinar amb altres acumuladors."""
+
+    def __init__(self):
+        # Per a cada dimensió, etiqueta -> codi global (en ordre d'aparició)
+        self.etiquetes = [{} for _ in DIMENSIONS_CUB]
+        self.tipus = [None] * len(DIMENSIONS_CUB)
+        self.codis = np.empty((0, len(DIMENSIONS_CUB)), dtype=np.int64)
+        self.valors = np.empty((0, len(COLUMNES_CUB)), dtype=np.float64)
+        # Densitat PLING × PMAT (AcumuladorDensitat sense mostra de punts), si l'estat la inclou
+        self.densitat = None
+
+    def afegir_cub(self, cub):
+        """Fusiona un cub parcial (amb l'índex d'etiquetes de construir_cub)."""
+        codis = []
+        for i, nivell in enumerate(cub.index.levels):
+            mapa = self.etiquetes[i]
+            if self.tipus[i] is None:
+                self.tipus[i] = nivell.dtype
+            # L'últim element fa que el codi -1 (nul) continuï sent -1
+            traduccio = np.array([mapa.setdefault(etiqueta, len(mapa)) for etiqueta in nivell] + [-1],
+                                 dtype=np.int64)
+            codis.append(traduccio[cub.index.codes[i]])
+        self._fusionar(np.column_stack(codis), cub[COLUMNES_CUB].to_numpy(dtype=np.float64))
+
+    def fusionar(self, altre):
+        """Fusiona un altre acumulador en aquest."""
+        codis = []
+        for i, mapa_altre in enumerate(altre.etiquetes):
+            mapa = self.etiquetes[i]
+            if self.tipus[i] is None:
+                self.tipus[i] = altre.tipus[i]
+            traduccio = np.array([mapa.setdefault(etiqueta, len(mapa)) for etiqueta in mapa_altre] + [-1],
+                                 dtype=np.int64)
+            codis.append(traduccio[altre.codis[:, i]])
+        self._fusionar(np.column_stack(codis) if codis else altre.codis, altre.valors)
+
+    def afegir_densitat(self, recomptes, caselles=CASELLES_DENSITAT):
+        """Fusiona uns recomptes de densitat (de densitat_bloc) als de l'estat."""
+        if self.densitat is None:
+            self.densitat = AcumuladorDensitat(caselles=caselles)
+        elif caselles != self.densitat.caselles:
+            raise ValueError(f"La densitat té {caselles} caselles per eix i la de l'estat, {self.densitat.caselles}")
+        self.densitat.afegir(recomptes)
+
+    def resultat_densitat(self):
+        """Densitat de l'estat (AcumuladorDensitat.resultat(), sense mostra de punts); None si no n'hi ha."""
+        return None if self.densitat is None else self.densitat.resultat()
+
+    def _fusionar(self, codis, valors):
+        codis = np.concatenate([self.codis, codis])
+        valors = np.concatenate([self.valors, valors])
+        self.codis, inversa = np.unique(codis, axis=0, return_inverse=True)
+        self.valors = np.zeros((len(self.codis), valors.shape[1]))
+        np.add.at(self.valors, inversa.ravel(), valors)
+
+    def cub(self):
+        """Retorna el cub acumulat amb les etiquetes ordenades, igual que construir_cub."""
+        nivells = []
+        codis = []
+        for i, mapa in enumerate(self.etiquetes):
+            etiquetes = list(mapa)
+            ordre = np.argsort(np.array(etiquetes, dtype=object), kind='stable')
+            rang = np.empty(len(etiquetes) + 1, dtype=np.int64)
+            rang[ordre] = np.arange(len(etiquetes))
+            rang[-1] = -1
+            nivells.append(pd.Index([etiquetes[j] for j in ordre], dtype=self.tipus[i]))
+            codis.append(rang[self.codis[:, i]])
+
+        files = np.lexsort(codis[::-1])
+        cub = pd.DataFrame(self.valors[files], columns=COLUMNES_CUB)
+        cub['n'] = cub['n'].astype(np.int64)
+        cub.index = pd.MultiIndex(levels=nivells, codes=[c[files] for c in codis], names=DIMENSIONS_CUB)
+        return cub
+
+    def desar(self, ruta):
+        """Desa l'acumulador (codis, valors, etiquetes i densitat) en un fitxer .npz de manera atòmica."""
+        metadades = {
+            'dimensions': DIMENSIONS_CUB,
+            'columnes': COLUMNES_CUB,
+            'etiquetes': [_etiquetes_json(mapa) for mapa in self.etiquetes],
+            'tipus': [None if t is None else str(t) for t in self.tipus],
+        }
+        arrays = {'codis': self.codis, 'valors': self.valors}
+        densitat = self.resultat_densitat()
+        if densitat is not None:
+            # Codis de les dimensions i número de casella de cada eix, una fila per casella no buida
+            index = densitat['recomptes'].index
+            metadades['densitat'] = {
+                'dimensions': DIMENSIONS_DENSITAT,
+                'caselles': densitat['caselles'],
+                'etiquetes': [_etiquetes_json(nivell) for nivell in index.levels[:-2]],
+                'tipus': [str(nivell.dtype) for nivell in index.levels[:-2]],
+            }
+            arrays['densitat_codis'] = np.column_stack(
+                list(index.codes[:-2]) + [index.get_level_values(nivell) for nivell in (-2, -1)]).astype(np.int64)
+            arrays['densitat_n'] = densitat['recomptes']['n'].to_numpy()
+        temporal = f'{ruta}.tmp-{os.getpid()}'
+        with open(temporal, 'wb') as f:
+            np.savez(f, **arrays, metadades=np.array(json.dumps(metadades, ensure_ascii=False)))
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def carregar(cls, ruta):
+        """Recupera un acumulador desat amb desar()."""
+        with np.load(ruta) as fitxer:
+            metadades = json.loads(str(fitxer['metadades']))
+            if metadades['dimensions'] != DIMENSIONS_CUB or metadades['columnes'] != COLUMNES_CUB:
+                raise ValueError(f"L'estat {ruta} no correspon a l'estructura actual del cub")
+            acumulador = cls()
+            acumulador.codis = fitxer['codis']
+            acumulador.valors = fitxer['valors']
+            # Els estats desats abans que s'hi inclogués la densitat no la porten
+            densitat = metadades.get('densitat')
+            if densitat is not None and densitat['dimensions'] == DIMENSIONS_DENSITAT:
+                caselles = pd.RangeIndex(densitat['caselles'])
+                nivells = [pd.Index(etiquetes, dtype=tipus)
+                           for etiquetes, tipus in zip(densitat['etiquetes'], densitat['tipus'])]
+                index = pd.MultiIndex(levels=nivells + [caselles, caselles], codes=list(fitxer['densitat_codis'].T),
+                                      names=DIMENSIONS_DENSITAT + ['casella_PLING', 'casella_PMAT'])
+                acumulador.afegir_densitat(pd.DataFrame({'n': fitxer['densitat_n']}, index=index),
+                                           densitat['caselles'])
+        acumulador.etiquetes = [{e: i for i, e in enumerate(etiquetes)} for etiquetes in metadades['etiquetes']]
+        acumulador.tipus = [None if t is None else np.dtype(t) for t in metadades['tipus']]
+        return acumulador
+
+
+def _files_per_bloc(ruta, memoria_max_mb):
+    """Estima quantes files caben en un bloc perquè el pic de memòria no superi el pressupost."""
+    with obrir_dades(ruta) as f:
+        mostra = f.read(1 << 20)
+    mida_linia = len(mostra) / max(mostra.count(b'\n'), 1)
+    # Text del bloc i camps tokenitzats, columnes tipades i temporals del cub
+    bytes_per_fila = 2 * mida_linia + 200
+    return max(1000, int(memoria_max_mb * (1 << 20) / bytes_per_fila))
+
+
+def construir_cub_per_blocs(ruta=FITXER_DADES, memoria_max_mb=512, motor='bincount', densitat=None):
+    """Construeix el cub llegint el CSV per blocs, amb un pic de memòria independent de la mida del fitxer.
+
+    Si es passa un AcumuladorDensitat, s'alimenta amb els mateixos blocs.
+    """
+    esquema, derivades = esquema_lectura(columnes_csv(ruta))
+    avisar_derivades(ruta, derivades)
+    acumulador = AcumuladorCub()
+    with obrir_dades(ruta) as f:
+        lector = pd.read_csv(f, usecols=list(esquema), dtype=esquema,
+                             chunksize=_files_per_bloc(ruta, memoria_max_mb))
+        for bloc in lector:
+            derivar_columnes(bloc, derivades)
+            netejar_dataset(bloc)
+            if len(bloc):
+                acumulador.afegir_cub(construir_cub(bloc, motor=motor))
+                if densitat is not None:
+                    densitat.afegir_bloc(bloc)
+    return acumulador.cub()
+
+# ==============================================================================
+# Estat persistent i ingestió incremental d'un any nou
+# ==============================================================================
+# El cub conté els estadístics suficients de tots els gràfics i KPI (recomptes,
+# sumes i recomptes per nivell d'assoliment). Es desa a disc, juntament amb els
+# recomptes de la densitat del gràfic 5, que es fusionen de la mateixa manera, i,
+# quan es publica un any nou, només cal agregar-ne les files i fusionar-les. La
+# mostra de punts del gràfic 5 no es desa.
+
+
+def afegir_any(ruta_any, ruta_estat=FITXER_ESTAT, motor='bincount'):
+    """Fusiona les files d'un CSV amb un o més anys nous a l'estat desat.
+
+    Retorna el cub resultant i la densitat (sense mostra de punts; None si
+    l'estat no la inclou).
+    """
+    acumulador = AcumuladorCub.carregar(ruta_estat)
+    df = carregar_dataset(ruta_any)
+    nou = construir_cub(df, motor=motor)
+
+    anys_estat = set(acumulador.etiquetes[DIMENSIONS_CUB.index('ANY')])
+    repetits = sorted(anys_estat & set(agregar_cub(nou, ['ANY']).index))
+    if repetits:
+        raise ValueError(f"Els anys {repetits} ja són a l'estat {ruta_estat}")
+
+    acumulador.afegir_cub(nou)
+    if acumulador.densitat is not None:
+        acumulador.afegir_densitat(densitat_bloc(df, acumulador.densitat.caselles), acumulador.densitat.caselles)
+    acumulador.desar(ruta_estat)
+    return acumulador.cub(), acumulador.resultat_densitat()
+
+
+# ==============================================================================
+# Mode paral·lel (diversos processos)
+# ==============================================================================
+# El CSV es divideix en rangs de bytes alineats a línies; cada procés llegeix
+# i agrega el seu rang en un cub parcial i els parcials es fusionen. Els rangs
+# tenen una mida fixa que no depèn del nombre de processos i es fusionen
+# sempre en el mateix ordre, de manera que el resultat és idèntic tant si
+# s'executa amb un procés com amb trenta-dos.
+
+# Mida de cada rang de bytes que processa un worker
+MIDA_RANG_PARALLEL = 64 << 20
+
+
+def _rangs_de_linies(ruta, mida_rang=MIDA_RANG_PARALLEL):
+    """Divideix el fitxer (sense la capçalera) en rangs de bytes que acaben just després d'un salt de línia."""
+    rangs = []
+    with open(ruta, 'rb') as f:
+        f.readline()
+        inici = f.tell()
+        total = os.fstat(f.fileno()).st_size
+        while inici < total:
+            f.seek(min(inici + mida_rang, total))
+            f.readline()
+            fi = f.tell()
+            rangs.append((inici, fi))
+            inici = fi
+    return rangs
+
+
+def _cub_bytes(dades, columnes, motor, punts=None):
+    """Neteja i agrega un tros de CSV sense capçalera (s'executa en un procés del pool).
+
+    Retorna el cub i, si `punts` no és None, els recomptes de densitat i la
+    mostra de punts del tros.
+    """
+    esquema, derivades = esquema_lectura(columnes)
+    bloc = pd.read_csv(io.BytesIO(dades), header=None, names=columnes, usecols=list(esquema), dtype=esquema)
+    del dades
+    derivar_columnes(bloc, derivades)
+    netejar_dataset(bloc)
+    if not len(bloc):
+        return None, None
+    parcial_densitat = None if punts is None else (densitat_bloc(bloc), mostra_punts(bloc, punts))
+    return construir_cub(bloc, motor=motor), parcial_densitat
+
+
+def _cub_rang(ruta, columnes, inici, fi, motor, punts=None):
+    """Llegeix, neteja i agrega un rang de bytes del CSV (s'executa en un procés del pool)."""
+    with open(ruta, 'rb') as f:
+        f.seek(inici)
+        dades = f.read(fi - inici)
+    return _cub_bytes(dades, columnes, motor, punts)
+
+
+def _blocs_de_linies(f, mida_rang=MIDA_RANG_PARALLEL):
+    """Llegeix un flux per blocs d'uns `mida_rang` bytes que acaben just després d'un salt de línia."""
+    resta = b''
+    while True:
+        bloc = f.read(mida_rang)
+        if not bloc:
+            if resta:
+                yield resta
+            return
+        bloc = resta + bloc
+        tall = bloc.rfind(b'\n') + 1
+        if tall:
+            yield bloc[:tall]
+        resta = bloc[tall:]
+
+
+def construir_cub_en_paralel(ruta=FITXER_DADES, processos=None, motor='bincount', mida_rang=MIDA_RANG_PARALLEL,
+                             densitat=None):
+    """Construeix el cub repartint la lectura i l'agregació del CSV entre diversos processos.
+
+    Un CSV pla es reparteix en rangs de bytes que cada procés llegeix pel seu
+    compte. Un fitxer comprimit no es pot llegir a partir d'un desplaçament, de
+    manera que el procés principal el descomprimeix en streaming i envia els
+    blocs als processos, amb un màxim de blocs pendents per acotar la memòria.
+    Si es passa un AcumuladorDensitat, cada procés en calcula també la part del seu bloc.
+    """
+    columnes = columnes_csv(ruta)
+    # Valida la capçalera abans de repartir la feina entre els processos
+    avisar_derivades(ruta, esquema_lectura(columnes)[1])
+    acumulador = AcumuladorCub()
+
+    punts = None if densitat is None else densitat.punts
+
+    def fusionar(parcial):
+        cub, parcial_densitat = parcial.result()
+        if cub is not None:
+            acumulador.afegir_cub(cub)
+        if parcial_densitat is not None:
+            densitat.afegir(*parcial_densitat)
+
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        if format_compressio(ruta) is None:
+            parcials = [executor.submit(_cub_rang, ruta, columnes, inici, fi, motor, punts)
+                        for inici, fi in _rangs_de_linies(ruta, mida_rang)]
+            for parcial in parcials:
+                fusionar(parcial)
+        else:
+            pendents = deque()
+            with obrir_dades(ruta) as f:
+                f.readline()
+                for bloc in _blocs_de_linies(f, mida_rang):
+                    pendents.append(executor.submit(_cub_bytes, bloc, columnes, motor, punts))
+                    # Els blocs es fusionen en ordre, igual que els rangs d'un CSV pla
+                    if len(pendents) > 2 * executor._max_workers:
+                        fusionar(pendents.popleft())
+            while pendents:
+                fusionar(pendents.popleft())
+    return acumulador.cub()
+
+
+# ==============================================================================
+# Magatzem SQLite
+# ==============================================================================
+# El dataset net es carrega una sola vegada en una taula SQLite amb un índex per
+# a cada dimensió de filtre. El cub i la densitat surten de consultes GROUP BY
+# amb els filtres al WHERE: un informe d'un sol territori només llegeix les
+# files del territori, sense tenir mai tot el dataset a memòria, i diversos
+# processos poden compartir el mateix fitxer (que obren només de lectura).
+
+# Taula del magatzem, amb una fila per alumne
+TAULA_MAGATZEM = 'alumnes'
+
+# Columnes indexades: les dels filtres dels informes
+COLUMNES_INDEX_MAGATZEM = ['ANY', 'AREA_TERRITORIAL', 'NATURALESA', 'GENERE']
+
+# Versió del format del magatzem; si canvia, els magatzems antics es tornen a crear
+VERSIO_MAGATZEM = 1
+
+# Tipus SQLite de cada tipus de l'esquema
+TIPUS_SQL = {'int16': 'INTEGER', 'Int8': 'INTEGER', 'category': 'TEXT', 'float32': 'REAL'}
+
+# Files per lectura quan cal recórrer les files del magatzem (mostra de punts de la densitat)
+FILES_LECTURA_MAGATZEM = 100_000
+
+
+def _nom_sql(columna):
+    return f'"{columna}"'
+
+
+def _clau_magatzem(ruta, clau_desada=None):
+    """Clau d'origen que es desa al magatzem: versió del format, empremta de l'esquema i clau del CSV.
+
+    El hash del CSV es reutilitza de `clau_desada` si la mida i el mtime no han canviat.
+    """
+    anterior = json.loads(clau_desada) if clau_desada else None
+    return json.dumps({'versio': VERSIO_MAGATZEM, 'esquema': _empremta_esquema(), **clau_fitxer(ruta, anterior)},
+                      sort_keys=True)
+
+
+def _obrir_magatzem(ruta_magatzem):
+    """Connexió només de lectura al magatzem."""
+    return sqlite3.connect(f'{Path(ruta_magatzem).absolute().as_uri()}?mode=ro', uri=True)
+
+
+def _clau_desada_magatzem(ruta_magatzem):
+    """Clau d'origen d'un magatzem existent (None si no existeix o no és vàlid)."""
+    if not os.path.exists(ruta_magatzem):
+        return None
+    try:
+        with closing(_obrir_magatzem(ruta_magatzem)) as connexio:
+            fila = connexio.execute("SELECT valor FROM metadades WHERE clau = 'origen'").fetchone()
+    except sqlite3.Error:
+        return None
+    return fila[0] if fila else None
+
+
+def preparar_magatzem(ruta=FITXER_DADES, ruta_magatzem=FITXER_MAGATZEM, memoria_max_mb=512):
+    """Crea el magatzem SQLite del CSV si no existeix o si el CSV ha canviat.
+
+    El CSV es llegeix per blocs (amb el mateix pressupost de memòria que el
+    mode streaming) i els índexs es creen després de la càrrega. El magatzem es
+    publica amb un rename atòmic, de manera que els processos que el fan servir
+    alhora mai en veuen un a mitges. Si el CSV no hi és, es fa servir el
+    magatzem tal com està.
+    """
+    if not os.path.exists(ruta) and os.path.exists(ruta_magatzem):
+        return ruta_magatzem
+    with perfil.etapa('clau_magatzem'):
+        clau_desada = _clau_desada_magatzem(ruta_magatzem)
+        clau = _clau_magatzem(ruta, clau_desada)
+    if clau_desada == clau:
+        return ruta_magatzem
+
+    temporal = f'{ruta_magatzem}.tmp-{os.getpid()}'
+    if os.path.exists(temporal):
+        os.remove(temporal)
+    esquema, derivades = esquema_lectura(columnes_csv(ruta))
+    avisar_derivades(ruta, derivades)
+    with perfil.etapa('carrega_magatzem') as etapa, closing(sqlite3.connect(temporal)) as connexio:
+        # El fitxer temporal no necessita diari: si la càrrega falla, es torna a començar
+        connexio.execute('PRAGMA journal_mode = OFF')
+        connexio.execute('PRAGMA synchronous = OFF')
+        columnes = ', '.join(f'{_nom_sql(columna)} {TIPUS_SQL[tipus]}' for columna, tipus in ESQUEMA_COLUMNES.items())
+        connexio.execute(f'CREATE TABLE {TAULA_MAGATZEM} ({columnes})')
+        files = 0
+        with obrir_dades(ruta) as f:
+            lector = pd.read_csv(f, usecols=list(esquema), dtype=esquema,
+                                 chunksize=_files_per_bloc(ruta, memoria_max_mb))
+            for bloc in lector:
+                derivar_columnes(bloc, derivades)
+                netejar_dataset(bloc)
+                bloc[list(ESQUEMA_COLUMNES)].to_sql(TAULA_MAGATZEM, connexio, if_exists='append', index=False)
+                files += len(bloc)
+        for columna in COLUMNES_INDEX_MAGATZEM:
+            connexio.execute(f'CREATE INDEX "idx_{columna}" ON {TAULA_MAGATZEM} ({_nom_sql(columna)})')
+        connexio.execute('CREATE TABLE metadades (clau TEXT PRIMARY KEY, valor TEXT)')
+        connexio.execute("INSERT INTO metadades VALUES ('origen', ?)", (clau,))
+        connexio.commit()
+        etapa['files'] = files
+    os.replace(temporal, ruta_magatzem)
+    return ruta_magatzem
+
+
+def _condicio_sql(filtres):
+    """Clàusula WHERE (amb els paràmetres) dels filtres: un valor o una llista de valors per dimensió."""
+    condicions, parametres = [], []
+    for dimensio, valors in filtres.items():
+        if dimensio not in DIMENSIONS_CUB:
+            raise ValueError(f"Filtre desconegut: {dimensio}")
+        if not isinstance(valors, (list, tuple, set)):
+            valors = [valors]
+        valors = [valor.item() if isinstance(valor, np.generic) else valor for valor in valors]
+        condicions.append(f'{_nom_sql(dimensio)} IN ({", ".join("?" * len(valors))})')
+        parametres.extend(valors)
+    return (f' WHERE {" AND ".join(condicions)}' if condicions else ''), parametres
+
+
+def _index_grups(grups, dimensions, caselles=()):
+    """Ordre de les files i MultiIndex d'una taula de grups llegida del magatzem.
+
+    Les dimensions reben els tipus de l'esquema i es codifiquen com ho fa
+    construir_cub, de manera que el resultat és el mateix que el dels altres
+    camins (amb les files en el mateix ordre); `caselles` són columnes de
+    caselles de 0 a CASELLES_DENSITAT - 1 que s'afegeixen al final de l'índex.
+    """
+    grups = grups.astype({dimensio: ESQUEMA_COLUMNES[dimensio] for dimensio in dimensions})
+    codis, etiquetes = zip(*(_codificar_dimensio(grups[dimensio]) for dimensio in dimensions))
+    codis = list(codis) + [grups[columna].to_numpy(np.int64) for columna in caselles]
+    ordre = np.lexsort(codis[::-1])
+    index = pd.MultiIndex(levels=list(etiquetes) + [pd.RangeIndex(CASELLES_DENSITAT)] * len(caselles),
+                          codes=[codi[ordre] for codi in codis], names=list(dimensions) + list(caselles))
+    return ordre, index
+
+
+def construir_cub_magatzem(ruta_magatzem=FITXER_MAGATZEM, densitat=None, **filtres):
+    """Construeix el cub amb un GROUP BY sobre les files del magatzem que compleixen els filtres.
+
+    Si es passa un AcumuladorDensitat, la densitat es calcula amb una altra
+    consulta GROUP BY (i, si en vol una mostra, recorrent les mateixes files).
+    """
+    on, parametres = _condicio_sql(filtres)
+    dimensions = ', '.join(_nom_sql(dimensio) for dimensio in DIMENSIONS_CUB)
+    sumes = ', '.join([f'SUM({_nom_sql(c)}) AS "{c}_sum"' for c in COLUMNES_COMPETENCIES]
+                      + [f'SUM({_nom_sql(c)} * {_nom_sql(c)}) AS "{c}_sumsq"' for c in COLUMNES_COMPETENCIES])
+    with closing(_obrir_magatzem(ruta_magatzem)) as connexio:
+        grups = pd.read_sql_query(f'SELECT {dimensions}, COUNT(*) AS n, {sumes} FROM {TAULA_MAGATZEM}{on} '
+                                  f'GROUP BY {dimensions}', connexio, params=parametres)
+        ordre, index = _index_grups(grups, DIMENSIONS_CUB)
+        cub = grups[COLUMNES_CUB].iloc[ordre].reset_index(drop=True)
+        cub.index = index
+
+        if densitat is not None and len(grups):
+            # Mateixes caselles que caselles_puntuacio: CAST trunca cap a zero, com astype(int64)
+            dimensions = ', '.join(_nom_sql(dimensio) for dimensio in DIMENSIONS_DENSITAT)
+            caselles = ', '.join(f'MIN(MAX(CAST({_nom_sql(c)} * {densitat.caselles / 100!r} AS INTEGER), 0), '
+                                 f'{densitat.caselles - 1}) AS "casella_{c}"' for c in ('PLING', 'PMAT'))
+            recomptes = pd.read_sql_query(f'SELECT {dimensions}, {caselles}, COUNT(*) AS n FROM {TAULA_MAGATZEM}{on} '
+                                          f'GROUP BY {dimensions}, "casella_PLING", "casella_PMAT"',
+                                          connexio, params=parametres)
+            ordre, index = _index_grups(recomptes, DIMENSIONS_DENSITAT, ['casella_PLING', 'casella_PMAT'])
+            densitat.afegir(pd.DataFrame({'n': recomptes['n'].to_numpy()[ordre]}, index=index), None)
+
+            if densitat.punts:
+                columnes = DIMENSIONS_DENSITAT + ['PLING', 'PMAT']
+                for bloc in pd.read_sql_query(f'SELECT {", ".join(map(_nom_sql, columnes))} FROM {TAULA_MAGATZEM}{on}',
+                                              connexio, params=parametres, chunksize=FILES_LECTURA_MAGATZEM):
+                    bloc = bloc.astype({columna: ESQUEMA_COLUMNES[columna] for columna in columnes})
+                    densitat.afegir(None, mostra_punts(bloc, densitat.punts))
+    return cub
+
+
+# ==============================================================================
+# Càlcul d'estadístiques bàsiques
+# ==============================================================================
+def calcular_estadistiques(cub):
+    """Estadístiques clau de la capçalera, calculades a partir del cub."""
+    total_students = int(cub['n'].sum())
+    territories = list(agregar_cub(cub, ['AREA_TERRITORIAL']).index)
+    num_territories = len(territories)
+    mitjana_global = cub['Mitjana_Global_sum'].sum() / total_students
+
+    # Calcular creixement percentual respecte l'any anterior
+    # Agrupem per any i calculem la mitjana global
+    yearly_avg = mitjanes_cub(cub, ['ANY'], 'Mitjana_Global').sort_index()
+
+    current_year = yearly_avg.index[-1]
+    previous_year = yearly_avg.index[-2]
+    creixement_percentual = ((yearly_avg[current_year] - yearly_avg[previous_year]) / yearly_avg[previous_year]) * 100
+
+    # Semiamplada dels intervals de confiança de la mitjana i del creixement (propagació de l'error del quocient)
+    error_mitjana_global = interval_cub(cub, [], 'Mitjana_Global')['error'].iloc[0]
+    error_anual = interval_cub(cub, ['ANY'], 'Mitjana_Global')['error']
+    quocient = yearly_avg[current_year] / yearly_avg[previous_year]
+    error_creixement = 100 * np.hypot(error_anual[current_year], quocient * error_anual[previous_year]) \
+        / yearly_avg[previous_year]
+
+    return {
+        'total_students': total_students,
+        'territories': territories,
+        'num_territories': num_territories,
+        'mitjana_global': mitjana_global,
+        'creixement_percentual': creixement_percentual,
+        'error_mitjana_global': error_mitjana_global,
+        'error_creixement': error_creixement,
+        # Període que cobreixen les dades de l'informe (el subtítol de la pàgina)
+        'primer_any': int(yearly_avg.index[0]),
+        'darrer_any': int(current_year),
+    }
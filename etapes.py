@@ -0,0 +1,183 @@
+"""
+Graf d'etapes de l'informe amb memòria cau a disc adreçada pel contingut
+"""
+
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+
+from instrumentacio import perfil
+
+# Directori on es desen els resultats de les etapes, un subdirectori per etapa
+DIRECTORI_ETAPES = '.cache_etapes'
+
+# Resultats que es conserven per etapa (un per configuració): en desar-ne un de
+# nou s'eliminen els que fa més temps que no es fan servir
+MAX_ENTRADES_ETAPA = 16
+
+# Fitxer del directori de la cau amb l'última clau (mida, mtime i hash) de cada fitxer d'entrada
+FITXER_CLAUS = 'fitxers.json'
+
+
+def empremta(*parts):
+    """Hash SHA-256 d'uns valors serialitzables en JSON."""
+    text = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def empremta_fitxer(ruta):
+    """Hash SHA-256 del contingut d'un fitxer."""
+    resum = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloc in iter(lambda: f.read(1 << 20), b''):
+            resum.update(bloc)
+    return resum.hexdigest()
+
+
+def clau_fitxer(ruta, clau_anterior=None):
+    """Clau d'un fitxer: mida, mtime i hash SHA-256 del contingut.
+
+    Si la mida i el mtime coincideixen amb els de `clau_anterior`, se'n
+    reutilitza el hash sense tornar a llegir el fitxer.
+    """
+    info = os.stat(ruta)
+    clau = {'mida': info.st_size, 'mtime_ns': info.st_mtime_ns}
+    if clau_anterior and all(clau_anterior.get(camp) == valor for camp, valor in clau.items()):
+        return {**clau, 'sha256': clau_anterior['sha256']}
+    return {**clau, 'sha256': empremta_fitxer(ruta)}
+
+
+def ruta_modul(nom):
+    """Fitxer font d'un mòdul, sense importar-lo."""
+    return importlib.util.find_spec(nom).origin
+
+
+def empremta_cub(cub):
+    """Hash SHA-256 del contingut d'un cub d'agregats (índex i valors)."""
+    import pandas as pd
+
+    return hashlib.sha256(pd.util.hash_pandas_object(cub, index=True).to_numpy().tobytes()).hexdigest()
+
+
+def fonts_modul(ruta, noms):
+    """Codi font de les funcions `noms` d'un mòdul i de la resta del mòdul.
+
+    Retorna (funcions, comuna): `funcions` és nom → codi i `comuna` és el codi
+    de tots els altres nodes de nivell superior (imports, constants, funcions
+    auxiliars...), que qualsevol de les funcions pot fer servir.
+    """
+    with open(ruta, encoding='utf-8') as f:
+        codi = f.read()
+    nodes = ast.parse(codi).body
+    funcions = {node.name: ast.get_source_segment(codi, node) for node in nodes
+                if isinstance(node, ast.FunctionDef) and node.name in noms}
+    comuna = ''.join(ast.get_source_segment(codi, node) for node in nodes
+                     if getattr(node, 'name', None) not in funcions)
+    return funcions, comuna
+
+
+class GrafEtapes:
+    """Graf de dependències d'etapes amb els resultats desats a disc sota un hash de les seves entrades.
+
+    La clau d'una etapa combina el nom, l'empremta del seu codi, la
+    configuració i les claus de les etapes de què depèn, de manera que canviar
+    qualsevol entrada invalida l'etapa i totes les posteriors. Les claus es
+    calculen sense executar res: una etapa només s'executa (i només se'n
+    demanen les dependències) si el seu resultat no és a disc.
+    """
+
+    def __init__(self, directori=DIRECTORI_ETAPES, max_entrades=MAX_ENTRADES_ETAPA):
+        self.directori = directori
+        self.max_entrades = max_entrades
+        self.etapes = {}
+        self.calculades = []
+        self.reutilitzades = []
+        self._claus = {}
+        self._valors = {}
+
+    def afegir(self, nom, calcular, dependencies=(), codi='', config=None, persistent=True):
+        """Afegeix l'etapa `nom`, que es calcula amb calcular(*valors de les dependències).
+
+        Les etapes no persistents (resultats grans i barats de refer) només es
+        conserven a memòria durant l'execució.
+        """
+        self.etapes[nom] = (calcular, list(dependencies), codi, config, persistent)
+
+    def clau(self, nom):
+        """Clau de contingut de l'etapa."""
+        if nom not in self._claus:
+            _, dependencies, codi, config, _ = self.etapes[nom]
+            self._claus[nom] = empremta(nom, codi, config, [self.clau(dependencia) for dependencia in dependencies])
+        return self._claus[nom]
+
+    def empremta_entrada(self, ruta):
+        """Hash del contingut d'un fitxer d'entrada, que només es torna a calcular si en canvien la mida o el mtime."""
+        ruta_claus = os.path.join(self.directori, FITXER_CLAUS)
+        try:
+            with open(ruta_claus, encoding='utf-8') as f:
+                claus = json.load(f)
+        except (OSError, ValueError):
+            claus = {}
+        absoluta = os.path.abspath(ruta)
+        clau = clau_fitxer(ruta, claus.get(absoluta))
+        if clau != claus.get(absoluta):
+            claus[absoluta] = clau
+            os.makedirs(self.directori, exist_ok=True)
+            temporal = f'{ruta_claus}.tmp-{os.getpid()}'
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump(claus, f, ensure_ascii=False)
+            os.replace(temporal, ruta_claus)
+        return clau['sha256']
+
+    def _ruta(self, nom):
+        return os.path.join(self.directori, nom, f'{self.clau(nom)[:40]}.pkl')
+
+    def valor(self, nom):
+        """Resultat de l'etapa: de memòria, de disc o calculat (i desat) si cal."""
+        if nom in self._valors:
+            return self._valors[nom]
+        calcular, dependencies, _, _, persistent = self.etapes[nom]
+        ruta = self._ruta(nom)
+        if persistent and os.path.exists(ruta):
+            try:
+                with open(ruta, 'rb') as f:
+                    self._valors[nom] = pickle.load(f)
+                # El mtime marca l'últim ús, que decideix quines entrades es conserven en podar
+                os.utime(ruta)
+                self.reutilitzades.append(nom)
+                return self._valors[nom]
+            except Exception:
+                # Un fitxer truncat o d'una versió incompatible es torna a calcular
+                pass
+
+        valor = calcular(*[self.valor(dependencia) for dependencia in dependencies])
+        self.calculades.append(nom)
+        if persistent:
+            with perfil.etapa(f'desar_{nom}'):
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                temporal = f'{ruta}.tmp-{os.getpid()}'
+                with open(temporal, 'wb') as f:
+                    pickle.dump(valor, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temporal, ruta)
+                self._podar(os.path.dirname(ruta))
+        self._valors[nom] = valor
+        return valor
+
+    def _podar(self, directori):
+        """Elimina els resultats d'una etapa que fa més temps que no es fan servir, fins a deixar-ne max_entrades."""
+        entrades = []
+        for entrada in os.scandir(directori):
+            if entrada.name.endswith('.pkl'):
+                try:
+                    entrades.append((entrada.stat().st_mtime_ns, entrada.path))
+                except OSError:
+                    pass
+        for _, ruta in sorted(entrades, reverse=True)[self.max_entrades:]:
+            try:
+                os.remove(ruta)
+            except OSError:
+                # Un altre procés ja l'ha eliminat
+                pass
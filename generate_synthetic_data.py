@@ -0,0 +1,83 @@
+"""
+Generació de datasets sintètics compatibles amb el CSV de les avaluacions de sisè
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+# Cardinalitats semblants a les del dataset real
+TERRITORIS = [
+    'Baix Llobregat', 'Barcelona Comarques', 'Catalunya Central', "Consorci d'Educació de Barcelona",
+    'Girona', 'Lleida', 'Maresme - Vallès Oriental', 'Tarragona', "Terres de l'Ebre", 'Vallès Occidental',
+]
+ANYS = list(range(2009, 2024))
+NATURALESES = ['Public', 'Privat']
+GENERES = ['Dona', 'Home']
+EDATS_RELATIVES = list(range(12))
+
+# Ordre de les columnes tal com apareixen a l'export
+COLUMNES = ['ANY', 'CODI_CENTRE', 'NATURALESA', 'AREA_TERRITORIAL', 'GENERE', 'Edat_Relativa',
+            'PLING', 'PMAT', 'Mitjana_Global', 'LING_MAT', 'Nivell_Assoliment']
+
+# Proporció de files amb alguna competència nul·la (alumnes no presentats)
+PROPORCIO_NULS = 0.03
+
+
+def generar_bloc(rng, files):
+    """Genera un bloc de files sintètiques amb efectes de territori, centre, gènere i edat relativa."""
+    territori = rng.integers(0, len(TERRITORIS), files)
+    privat = rng.random(files) < 0.33
+    dona = rng.random(files) < 0.49
+    edat = rng.integers(0, len(EDATS_RELATIVES), files)
+
+    base = 72 + (territori - 4.5) * 0.4 + privat * 3.5 + edat * 0.35
+    pling = np.clip(base + dona * 2.5 + rng.normal(0, 12, files), 0, 100).round(2)
+    pmat = np.clip(base - dona * 3.0 + rng.normal(0, 14, files), 0, 100).round(2)
+    nuls = rng.random(files) < PROPORCIO_NULS
+    pling[nuls & (rng.random(files) < 0.5)] = np.nan
+    pmat[nuls & np.isfinite(pling)] = np.nan
+
+    mitjana = (pling + pmat) / 2
+    nivell = np.where(mitjana >= 80, 'Alt', np.where(mitjana >= 65, 'Mitja', 'Baix')).astype(object)
+    nivell[np.isnan(mitjana)] = None
+
+    return pd.DataFrame({
+        'ANY': rng.choice(ANYS, files),
+        'CODI_CENTRE': rng.integers(8000000, 8099999, files),
+        'NATURALESA': np.where(privat, 'Privat', 'Public'),
+        'AREA_TERRITORIAL': np.array(TERRITORIS, dtype=object)[territori],
+        'GENERE': np.where(dona, 'Dona', 'Home'),
+        'Edat_Relativa': edat.astype(float),
+        'PLING': pling,
+        'PMAT': pmat,
+        'Mitjana_Global': mitjana.round(3),
+        'LING_MAT': (pling - pmat).round(2),
+        'Nivell_Assoliment': nivell,
+    }, columns=COLUMNES)
+
+
+def generar_csv(ruta, files, llavor=0, mida_bloc=1_000_000):
+    """Escriu un CSV sintètic de `files` files per blocs, sense tenir-lo mai sencer a memòria."""
+    rng = np.random.default_rng(llavor)
+    escrites = 0
+    with open(ruta, 'w', encoding='utf-8', newline='') as f:
+        while escrites < files:
+            bloc = generar_bloc(rng, min(mida_bloc, files - escrites))
+            bloc.to_csv(f, header=escrites == 0, index=False)
+            escrites += len(bloc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('sortida', help='ruta del CSV a generar')
+    parser.add_argument('--files', type=int, default=1_000_000, help='nombre de files (per defecte: 1000000)')
+    parser.add_argument('--llavor', type=int, default=0, help='llavor del generador aleatori (per defecte: 0)')
+    args = parser.parse_args()
+
+    print(f"Generant {args.files:,} files a {args.sortida}...")
+    generar_csv(args.sortida, args.files, llavor=args.llavor)
+
+
+if __name__ == '__main__':
+    main()
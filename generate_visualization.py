@@ -2,781 +2,704 @@
 Generació HTML de la Visualització de les avaluacions de sisè d'educació primària
 """
 
-import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
-import plotly.io as pio
-from plotly.utils import PlotlyJSONEncoder
+import argparse
+import copy
 import json
-import numpy as np
-
-# Carreguem el dataset final amb les noves columnes incloses
-print("Carregant dataset...")
-df = pd.read_csv('Avaluació_de_sisè_d\'educació_primària_20251201_mod.csv', low_memory=False)
-
-# Eliminem files amb valors nuls en les competències principals
-df_clean = df.dropna(subset=['PLING', 'PMAT', 'Mitjana_Global', 'LING_MAT'])
-
-print(f"Total d'alumnes: {len(df_clean):,}")
-print(f"Anys disponibles: {sorted(df_clean['ANY'].unique())}")
-
-# ==============================================================================
-# Càlcul d'estadístiques bàsiques
-# ==============================================================================
-total_students = len(df_clean)
-num_territories = df_clean['AREA_TERRITORIAL'].nunique()
-mitjana_global = df_clean['Mitjana_Global'].mean()
-
-# Calcular creixement percentual respecte l'any anterior
-# Agrupem per any i calculem la mitjana global
-yearly_avg = df_clean.groupby('ANY')['Mitjana_Global'].mean().sort_index()
-
-current_year = yearly_avg.index[-1]
-previous_year = yearly_avg.index[-2]
-creixement_percentual = ((yearly_avg[current_year] - yearly_avg[previous_year]) / yearly_avg[previous_year]) * 100
-
-print(f"Mitjana global: {mitjana_global:.2f}")
-print(f"Creixement percentual respecte any anterior: {creixement_percentual:.2f}%")
-
-# ==============================================================================
-# Visualització 1: Gràfic de barres - Evolució de LING_MAT al llarg dels anys per gènere
-# ==============================================================================
-print("Visualització 1: Evolució LING_MAT per anys i gènere")
-
-# Calcular mitjana de LING_MAT per any i gènere
-ling_mat_gender = df_clean.groupby(['ANY', 'GENERE'])['LING_MAT'].mean().reset_index()
-ling_mat_gender = ling_mat_gender.sort_values('ANY')
-
-# Separar dades per gènere
-ling_mat_dones = ling_mat_gender[ling_mat_gender['GENERE'] == 'Dona'].sort_values('ANY')
-ling_mat_homes = ling_mat_gender[ling_mat_gender['GENERE'] == 'Home'].sort_values('ANY')
-
-# Colors per gènere i valor positiu/negatiu
-colors_dones = ['#C8A2E0' if x >= 0 else '#8B5CF6' for x in ling_mat_dones['LING_MAT']]
-colors_homes = ['#A8E6A3' if x >= 0 else '#4CAF50' for x in ling_mat_homes['LING_MAT']]
-
-fig1 = go.Figure()
-
-# Barres per Dones
-fig1.add_trace(go.Bar(
-    x=ling_mat_dones['ANY'],
-    y=ling_mat_dones['LING_MAT'],
-    name='Dones',
-    marker_color=colors_dones,
-    hovertemplate='<b>Any: %{x}</b><br>' +
-                  'Dones<br>' +
-                  'LING_MAT: %{y:.2f}<br>' +
-                  '<extra></extra>'
-))
-
-# Barres per Homes
-fig1.add_trace(go.Bar(
-    x=ling_mat_homes['ANY'],
-    y=ling_mat_homes['LING_MAT'],
-    name='Homes',
-    marker_color=colors_homes,
-    hovertemplate='<b>Any: %{x}</b><br>' +
-                  'Homes<br>' +
-                  'LING_MAT: %{y:.2f}<br>' +
-                  '<extra></extra>'
-))
-
-# Anotació per zona positiva (millor en llengües) - dalt del gràfic
-fig1.add_annotation(
-    xref="paper",
-    yref="paper",
-    x=0.5,
-    y=0.98,
-    text="Millor en llengües",
-    showarrow=False,
-    bgcolor="#4A4949",
-    font=dict(color="white", size=11, family="Arial"),
-    bordercolor="#4A4949",
-    borderwidth=2,
-    borderpad=6,
-    opacity=0.9
-)
-
-# Anotació per zona negativa (millor en matemàtiques) - baix del gràfic
-fig1.add_annotation(
-    xref="paper",
-    yref="paper",
-    x=0.5,
-    y=0.02,
-    text="Millor en matemàtiques",
-    showarrow=False,
-    bgcolor="#4A4949",
-    font=dict(color="white", size=11, family="Arial"),
-    bordercolor="#4A4949",
-    borderwidth=2,
-    borderpad=6,
-    opacity=0.9
-)
-
-# Afegir línia de referència en y=0
-fig1.add_hline(y=0, line_dash="dash", line_color="gray", 
-               annotation_text="Equilibri", annotation_position="right")
-
-fig1.update_layout(
-    xaxis_title='Any',
-    yaxis_title='Diferència Llengües - Matemàtiques',
-    height=550,
-    margin=dict(l=80, r=50, t=80, b=80),
-    paper_bgcolor='rgba(0,0,0,0)',
-    plot_bgcolor='rgba(0, 0, 0, 0)',
-    yaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', zeroline=True, zerolinecolor='gray'),
-    xaxis=dict(dtick=1),
-    barmode='group',  # Barres agrupades per any
-    legend=dict(
-        orientation='h',
-        yanchor='bottom',
-        y=1.02,
-        xanchor='right',
-        x=1,
-        bgcolor='rgba(255, 255, 255, 0.9)',
-        bordercolor='gray',
-        borderwidth=1
-    )
-)
-
-# Convertir a diccionari JSON per generar HTML
-chart1_json = json.dumps(fig1.to_plotly_json(), cls=PlotlyJSONEncoder)
-
-# ==============================================================================
-# Visualització 2: Gràfic de línies - Mitjana Global per territori en funció de l'edat relativa
-# ==============================================================================
-print("Visualització 2: Mitjana Global per territori i edat relativa")
-
-# Calcular mitjana per territori i edat relativa
-territory_age_data = df_clean.groupby(['AREA_TERRITORIAL', 'Edat_Relativa'])['Mitjana_Global'].mean().reset_index()
-
-fig2 = go.Figure()
-
-colors_territories = px.colors.qualitative.Set3[:10]
-
-for i, territory in enumerate(sorted(df_clean['AREA_TERRITORIAL'].unique())):
-    territory_data = territory_age_data[territory_age_data['AREA_TERRITORIAL'] == territory]
-    territory_data = territory_data.sort_values('Edat_Relativa')
-    
-    fig2.add_trace(go.Scatter(
-        x=territory_data['Edat_Relativa'],
-        y=territory_data['Mitjana_Global'],
-        name=territory,
-        mode='lines+markers',
-        line=dict(width=2.5, color=colors_territories[i]),
-        marker=dict(size=6),
-        hovertemplate='<b>%{fullData.name}</b><br>' +
-                      'Edat Relativa: %{x}<br>' +
-                      'Mitjana Global: %{y:.2f}<br>' +
-                      '<extra></extra>'
-    ))
-
-fig2.update_layout(
-    xaxis_title='Edat Relativa',
-    yaxis_title='Mitjana Global',
-    height=550,
-    margin=dict(l=80, r=50, t=30, b=80),
-    legend=dict(
-        orientation="v",
-        yanchor="middle",
-        y=0.5,
-        xanchor="left",
-        x=1.02,
-        bgcolor="rgba(255, 255, 255, 0.9)",
-        bordercolor="gray",
-        borderwidth=1
-    ),
-    paper_bgcolor='rgba(0,0,0,0)',
-    plot_bgcolor='rgba(0, 0, 0, 0)',
-    yaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', range=[65, 85]),
-    xaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', dtick=1)
-)
-
-chart2_json = json.dumps(fig2.to_plotly_json(), cls=PlotlyJSONEncoder)
-
-# ==============================================================================
-# Visualització 3: Heatmap doble amb dropdown per territori - PLING
-# ==============================================================================
-print("Visualització 3: Heatmaps interactius per territori")
-
-territories = sorted(df_clean['AREA_TERRITORIAL'].unique())
-
-# Preparar dades per Llengües (PLING)
-pling_naturalesa_data = []
-for territory in territories:
-    territory_df = df_clean[df_clean['AREA_TERRITORIAL'] == territory]
-    
-    for naturalesa in ['Public', 'Privat']:
-        naturalesa_label = 'Públic' if naturalesa == 'Public' else 'Privat'
-        for gender in ['Home', 'Dona']:
-            subset = territory_df[(territory_df['NATURALESA'] == naturalesa) & 
-                                  (territory_df['GENERE'] == gender)]
-            if len(subset) > 0:
-                mean_val = subset['PLING'].mean()
-                pling_naturalesa_data.append({
-                    'AREA_TERRITORIAL': territory,
-                    'Categoria': naturalesa_label,
-                    'Gènere': gender,
-                    'Valor': mean_val
-                })
-
-df_pling_nat = pd.DataFrame(pling_naturalesa_data)
-
-# Preparar dades per Matemàtiques (PMAT)
-pmat_naturalesa_data = []
-for territory in territories:
-    territory_df = df_clean[df_clean['AREA_TERRITORIAL'] == territory]
-    
-    for naturalesa in ['Public', 'Privat']:
-        naturalesa_label = 'Públic' if naturalesa == 'Public' else 'Privat'
-        for gender in ['Home', 'Dona']:
-            subset = territory_df[(territory_df['NATURALESA'] == naturalesa) & 
-                                  (territory_df['GENERE'] == gender)]
-            if len(subset) > 0:
-                mean_val = subset['PMAT'].mean()
-                pmat_naturalesa_data.append({
-                    'AREA_TERRITORIAL': territory,
-                    'Categoria': naturalesa_label,
-                    'Gènere': gender,
-                    'Valor': mean_val
-                })
-
-df_pmat_nat = pd.DataFrame(pmat_naturalesa_data)
-
-# Calcular escala comuna per als dos heatmaps
-min_val = min(df_pling_nat['Valor'].min(), df_pmat_nat['Valor'].min())
-max_val = max(df_pling_nat['Valor'].max(), df_pmat_nat['Valor'].max())
-# Arrodonim valors de l'escala (múltiples de 5)
-min_val = np.floor(min_val / 5) * 5
-max_val = np.ceil(max_val / 5) * 5
-
-# Calculem mitjana de tots els territoris per a l'opció "Tots"
-pling_tots_data = []
-pmat_tots_data = []
-
-for naturalesa in ['Public', 'Privat']:
-    naturalesa_label = 'Públic' if naturalesa == 'Public' else 'Privat'
-    for gender in ['Home', 'Dona']:
-        subset = df_clean[(df_clean['NATURALESA'] == naturalesa) & 
-                          (df_clean['GENERE'] == gender)]
-        if len(subset) > 0:
-            pling_tots_data.append({
-                'AREA_TERRITORIAL': 'Tots',
-                'Categoria': naturalesa_label,
-                'Gènere': gender,
-                'Valor': subset['PLING'].mean()
-            })
-            pmat_tots_data.append({
-                'AREA_TERRITORIAL': 'Tots',
-                'Categoria': naturalesa_label,
-                'Gènere': gender,
-                'Valor': subset['PMAT'].mean()
-            })
-
-# Afegir les mitjanes "Tots" als dataframes
-df_pling_nat = pd.concat([df_pling_nat, pd.DataFrame(pling_tots_data)], ignore_index=True)
-df_pmat_nat = pd.concat([df_pmat_nat, pd.DataFrame(pmat_tots_data)], ignore_index=True)
-
-# Crear subplot amb 2 heatmaps
-fig3 = make_subplots(
-    rows=1, cols=2,
-    subplot_titles=('Puntuació en Llengües', 'Puntuació en Matemàtiques'),
-    horizontal_spacing=0.15
-)
-
-# Crear un heatmap per cada territori amb dropdown
-# Opció "Tots" per defecte
-default_territory = 'Tots'
-
-# PLING Heatmap
-df_pling_pivot = df_pling_nat[df_pling_nat['AREA_TERRITORIAL'] == default_territory].pivot(
-    index='Categoria', columns='Gènere', values='Valor'
-).reindex(['Públic', 'Privat'])
-
-# PMAT Heatmap
-df_pmat_pivot = df_pmat_nat[df_pmat_nat['AREA_TERRITORIAL'] == default_territory].pivot(
-    index='Categoria', columns='Gènere', values='Valor'
-).reindex(['Públic', 'Privat'])
-
-# Crear text per mostrar a les caselles i hover text per PLING
-text_display_pling = []
-for i, cat in enumerate(df_pling_pivot.index):
-    text_row = []
-    hover_row = []
-    for j, gen in enumerate(df_pling_pivot.columns):
-        val = df_pling_pivot.iloc[i, j]
-        text_row.append(f'{val:.1f}')
-    text_display_pling.append(text_row)
-
-# Crear text per mostrar a les caselles i hover text per PMAT
-text_display_pmat = []
-for i, cat in enumerate(df_pmat_pivot.index):
-    text_row = []
-    hover_row = []
-    for j, gen in enumerate(df_pmat_pivot.columns):
-        val = df_pmat_pivot.iloc[i, j]
-        text_row.append(f'{val:.1f}')
-    text_display_pmat.append(text_row)
-
-fig3.add_trace(
-    go.Heatmap(
-        z=df_pling_pivot.values,
-        x=df_pling_pivot.columns,
-        y=df_pling_pivot.index,
-        colorscale='RdYlGn',
-        text=text_display_pling,
-        texttemplate='%{text}',
-        textfont={"size": 16, "color": "black"},
-        showscale=False,
-        zmin=min_val,
-        zmax=max_val,
-        name='PLING'
-    ),
-    row=1, col=1
-)
-
-fig3.add_trace(
-    go.Heatmap(
-        z=df_pmat_pivot.values,
-        x=df_pmat_pivot.columns,
-        y=df_pmat_pivot.index,
-        colorscale='RdYlGn',
-        text=text_display_pmat,
-        texttemplate='%{text}',
-        textfont={"size": 16, "color": "black"},
-        colorbar=dict(title='Puntuació', x=1.05),
-        zmin=min_val,
-        zmax=max_val,
-        name='PMAT'
-    ),
-    row=1, col=2
-)
-
-# Crear els botons del dropdown per canviar de territori
-buttons = []
-for territory in ['Tots'] + list(territories):
-    # Pivot per aquest territori
-    df_pling_t = df_pling_nat[df_pling_nat['AREA_TERRITORIAL'] == territory].pivot(
-        index='Categoria', columns='Gènere', values='Valor'
-    ).reindex(['Públic', 'Privat'])
-    
-    df_pmat_t = df_pmat_nat[df_pmat_nat['AREA_TERRITORIAL'] == territory].pivot(
-        index='Categoria', columns='Gènere', values='Valor'
-    ).reindex(['Públic', 'Privat'])
-    
-    # Text per mostrar i hover text per aquest territori
-    text_pling_t = []
-    hover_pling_t = []
-    for i, cat in enumerate(df_pling_t.index):
-        text_row = []
-        hover_row = []
-        for j, gen in enumerate(df_pling_t.columns):
-            val = df_pling_t.iloc[i, j]
-            text_row.append(f'{val:.1f}')
-        text_pling_t.append(text_row)
-    
-    text_pmat_t = []
-    hover_pmat_t = []
-    for i, cat in enumerate(df_pmat_t.index):
-        text_row = []
-        hover_row = []
-        for j, gen in enumerate(df_pmat_t.columns):
-            val = df_pmat_t.iloc[i, j]
-            text_row.append(f'{val:.1f}')
-        text_pmat_t.append(text_row)
-    
-    button = dict(
-        label=territory,
-        method='update',
-        args=[
-            {
-                'z': [df_pling_t.values, df_pmat_t.values],
-                'text': [text_pling_t, text_pmat_t],
-            },
-            {
-                'title': f'Comparativa Llengües vs Matemàtiques - {territory}'
-            }
-        ]
-    )
-    buttons.append(button)
-
-fig3.update_layout(
-    updatemenus=[
-        dict(
-            buttons=buttons,
-            direction="down",
-            pad={"r": 10, "t": 10},
-            showactive=True,
-            x=0.5,
-            xanchor="center",
-            y=1.20,
-            yanchor="top",
-            bgcolor="white",
-            bordercolor="gray",
-            borderwidth=2
-        )
-    ],
-    title=f'Comparativa Llengües vs Matemàtiques - {default_territory}',
-    height=500,
-    margin=dict(l=100, r=150, t=120, b=80),
-    paper_bgcolor='rgba(0,0,0,0)',
-    plot_bgcolor='rgba(0, 0, 0, 0)'
-)
-
-fig3.update_xaxes(title_text='Gènere', row=1, col=1)
-fig3.update_yaxes(title_text='Naturalesa Centre', row=1, col=1)
-fig3.update_xaxes(title_text='Gènere', row=1, col=2)
-
-chart3_json = json.dumps(fig3.to_plotly_json(), cls=PlotlyJSONEncoder)
-
-# ==============================================================================
-# Visualització 4: Distribució per Nivell d'Assoliment
-# ==============================================================================
-print("Visualització 4: Distribució per Nivell d'Assoliment")
-
-# Preparar dades per territori amb opció "Tots"
-def get_nivell_data(territory=None):
-    if territory == 'Tots' or territory is None:
-        subset = df_clean
-    else:
-        subset = df_clean[df_clean['AREA_TERRITORIAL'] == territory]
-    
-    nivell_data = subset.groupby(['ANY', 'Nivell_Assoliment']).size().reset_index(name='count')
-    nivell_pivot = nivell_data.pivot(index='ANY', columns='Nivell_Assoliment', values='count').fillna(0)
-    nivell_pivot_pct = nivell_pivot.div(nivell_pivot.sum(axis=1), axis=0) * 100
-    return nivell_pivot_pct
-
-# Dades per defecte: "Tots"
-default_territory_chart4 = 'Tots'
-nivell_pivot_pct = get_nivell_data(default_territory_chart4)
-
-fig4 = go.Figure()
-
-colors_nivell = {'Alt': '#2ecc71', 'Mitja': '#f39c12', 'Baix': '#e74c3c'}
-
-for nivell in ['Alt', 'Mitja', 'Baix']:
-    if nivell in nivell_pivot_pct.columns:
-        fig4.add_trace(go.Bar(
-            x=nivell_pivot_pct.index,
-            y=nivell_pivot_pct[nivell],
-            name=nivell,
-            marker_color=colors_nivell[nivell],
-            hovertemplate='<b>Any: %{x}</b><br>' +
-                          f'{nivell}: %{{y:.1f}}%<br>' +
-                          '<extra></extra>'
-        ))
-
-# Crear botons per al dropdown de Chart 4
-buttons_chart4 = []
-for territory in ['Tots'] + list(territories):
-    nivell_pct_t = get_nivell_data(territory)
-    
-    y_data = []
-    for nivell in ['Alt', 'Mitja', 'Baix']:
-        if nivell in nivell_pct_t.columns:
-            y_data.append(nivell_pct_t[nivell].tolist())
+
+import configuracio
+from instrumentacio import perfil
+
+# Claus dels filtres de les especificacions del mode lot i dimensió del cub que filtren
+FILTRES_LOT = {'territoris': 'AREA_TERRITORIAL', 'anys': 'ANY', 'naturalesa': 'NATURALESA'}
+
+TITOLS_VISUALITZACIONS = [
+    "Visualització 1: Evolució LING_MAT per anys i gènere",
+    "Visualització 2: Mitjana Global per territori i edat relativa",
+    "Visualització 3: Heatmaps interactius per territori",
+    "Visualització 4: Distribució per Nivell d'Assoliment",
+    "Visualització 5: Densitat conjunta de PLING i PMAT",
+]
+
+
+class Informe:
+    """Pipeline de l'informe: càrrega i agregació → estadístiques → figures → HTML.
+
+    Cada etapa es calcula la primera vegada que es necessita i es reutilitza
+    després. pandas, NumPy i Plotly només s'importen quan una etapa els fa
+    servir, de manera que importar aquest mòdul és immediat.
+
+    `filtres` restringeix l'informe a un subconjunt del dataset (dimensió del
+    cub → valor o llista de valors); el filtre s'aplica sobre el cub, de manera
+    que diverses variants poden compartir una sola càrrega (vegeu variant()).
+
+    `mostra` activa la previsualització: els gràfics es calculen sobre una
+    mostra estratificada del dataset, donada com a fracció (< 1) o com a
+    nombre de files (>= 1); només s'aplica a la càrrega en memòria.
+
+    La densitat PLING × PMAT del gràfic 5 es calcula en la mateixa lectura
+    que el cub; `punts_densitat` és la mida de la mostra d'alumnes que s'hi
+    dibuixa a sobre (0: cap).
+
+    Els punts de canvi de les sèries anuals (canvis.SERIES_CANVIS) es busquen
+    sobre el cub de l'informe, repartint les sèries entre `processos_canvis`
+    processos (0: tots els nuclis) quan n'hi ha prou per compensar el pool.
+
+    Amb `magatzem` (la ruta d'un fitxer SQLite), el dataset net es carrega una
+    sola vegada al magatzem i el cub i la densitat surten de consultes GROUP BY;
+    un informe filtrat (o una variant) només en llegeix les files del filtre.
+
+    Amb `cau_etapes` (un directori), html() recorre el graf d'etapes de
+    _graf_etapes(), que desa cada resultat a disc i només refà les etapes amb
+    alguna entrada canviada.
+
+    `cau_dades` és el directori de la còpia binària del dataset net que fa
+    servir la càrrega en memòria (per defecte, dades.DIRECTORI_CACHE).
+    """
+
+    def __init__(self, ruta=None, motor='bincount', streaming=False, memoria_max_mb=512, processos=1,
+                 processos_figures=1, binari=False, plotly_local=None, filtres=None, mostra=None, punts_densitat=0,
+                 processos_canvis=0, magatzem=None, cau_etapes=None, cau_dades=None, verbos=False):
+        self.ruta = ruta
+        self.motor = motor
+        self.streaming = streaming
+        self.memoria_max_mb = memoria_max_mb
+        self.processos = processos
+        self.processos_figures = processos_figures
+        self.binari = binari
+        self.plotly_local = plotly_local
+        self.filtres = filtres or {}
+        self.mostra = mostra
+        self.info_mostra = None
+        self.punts_densitat = punts_densitat
+        self.processos_canvis = processos_canvis
+        self.magatzem = magatzem
+        self._magatzem_preparat = False
+        self.cau_etapes = cau_etapes
+        self.cau_dades = cau_dades
+        self._origen_cub = None
+        self.verbos = verbos
+        self._cub_complet = None
+        self._cub = None
+        self._densitat_completa = None
+        self._densitat = None
+        self._canvis = None
+        self._estadistiques = None
+        self._figures = None
+        self._charts_json = None
+
+    @classmethod
+    def des_de_cub(cls, cub, densitat=None, **opcions):
+        """Crea un informe a partir d'un cub (i una densitat) ja calculats, per exemple d'un estat desat."""
+        informe = cls(**opcions)
+        informe._cub_complet = cub
+        informe._densitat_completa = densitat
+        return informe
+
+    def variant(self, filtres, **opcions):
+        """Informe amb uns altres filtres (i opcions) que reaprofita el cub complet d'aquest."""
+        informe = copy.copy(self)
+        informe.filtres = filtres
+        for opcio, valor in opcions.items():
+            setattr(informe, opcio, valor)
+        if self.magatzem:
+            # Cada variant consulta al magatzem només les files dels seus filtres
+            self._preparar_magatzem()
+            informe._magatzem_preparat = True
+            informe._cub_complet = self._cub_complet
+        else:
+            informe._cub_complet = self.cub_complet
+        informe._densitat_completa = self._densitat_completa
+        informe._cub = informe._densitat = informe._canvis = informe._estadistiques = None
+        informe._figures = informe._charts_json = None
+        return informe
+
+    def _print(self, *args):
+        if self.verbos:
+            print(*args)
+
+    @property
+    def cub_complet(self):
+        """Cub d'agregats de tot el dataset net."""
+        if self._cub_complet is None:
+            self._cub_complet = self._construir_cub()
+        return self._cub_complet
+
+    @property
+    def cub(self):
+        """Cub d'agregats de l'informe, amb els filtres aplicats."""
+        if self._cub is None:
+            if self.filtres and self.magatzem and self._cub_complet is None:
+                import dades
+
+                # Amb el magatzem, un informe filtrat no necessita el cub de tot el dataset
+                densitat = dades.AcumuladorDensitat(punts=self.punts_densitat)
+                self._cub = self._consultar_magatzem(densitat, self.filtres)
+                self._densitat = densitat.resultat()
+            elif self.filtres:
+                import dades
+
+                self._cub = dades.filtrar_cub(self.cub_complet, **self.filtres)
+            else:
+                self._cub = self.cub_complet
+        return self._cub
+
+    @property
+    def densitat(self):
+        """Densitat PLING × PMAT de l'informe, amb els filtres aplicats (None si el cub no prové del CSV)."""
+        if self._densitat is None:
+            import dades
+
+            # La densitat es calcula en la mateixa lectura (o consulta) que el cub
+            self.cub
+            if self._densitat is None:
+                self._densitat = dades.filtrar_densitat(self._densitat_completa, **self.filtres)
+        return self._densitat
+
+    @property
+    def canvis(self):
+        """Punts de canvi de les sèries anuals del cub de l'informe: (sèrie, grup) → llista de canvis."""
+        if self._canvis is None:
+            import canvis
+
+            cub = self.cub
+            with perfil.etapa('canvis') as etapa:
+                series = canvis.series_anuals(cub)
+                self._canvis = canvis.detectar_canvis(series, processos=self.processos_canvis)
+                detectats = sum(len(canvis_serie) for canvis_serie in self._canvis.values())
+                etapa['series'] = len(series)
+                etapa['canvis'] = detectats
+            self._print(f"Punts de canvi detectats: {detectats} en {len(series)} sèries anuals")
+        return self._canvis
+
+    def descripcio_filtres(self):
+        """Text breu dels filtres aplicats (buit si l'informe és de tot el dataset)."""
+        parts = []
+        for dimensio, valors in self.filtres.items():
+            if not isinstance(valors, (list, tuple, set)):
+                valors = [valors]
+            valors = sorted(valors)
+            if dimensio == 'ANY' and len(valors) > 1 and valors == list(range(valors[0], valors[-1] + 1)):
+                parts.append(f'{valors[0]}-{valors[-1]}')
+            elif dimensio == 'NATURALESA':
+                parts.append(', '.join('Públic' if valor == 'Public' else valor for valor in valors))
+            else:
+                parts.append(', '.join(str(valor) for valor in valors))
+        return ' · '.join(parts)
+
+    def _preparar_magatzem(self):
+        import dades
+
+        if not self._magatzem_preparat:
+            dades.preparar_magatzem(self.ruta or configuracio.FITXER_DADES, self.magatzem, memoria_max_mb=self.memoria_max_mb)
+            self._magatzem_preparat = True
+
+    def _consultar_magatzem(self, densitat, filtres):
+        """Cub de les files del magatzem que compleixen els filtres; alimenta també `densitat`."""
+        import dades
+
+        self._preparar_magatzem()
+        with perfil.etapa('consulta_magatzem') as etapa:
+            cub = dades.construir_cub_magatzem(self.magatzem, densitat=densitat, **filtres)
+            etapa['grups'] = len(cub)
+        return cub
+
+    def _construir_cub(self):
+        import dades
+
+        ruta = self.ruta or configuracio.FITXER_DADES
+        densitat = dades.AcumuladorDensitat(punts=self.punts_densitat)
+        self._print("Carregant dataset...")
+        if self.magatzem:
+            cub = self._consultar_magatzem(densitat, {})
+        elif self.processos != 1:
+            with perfil.etapa('carrega_neteja_cub') as etapa:
+                cub = dades.construir_cub_en_paralel(ruta, processos=self.processos or None, motor=self.motor,
+                                                     densitat=densitat)
+                etapa['grups'] = len(cub)
+        elif self.streaming:
+            with perfil.etapa('carrega_neteja_cub') as etapa:
+                cub = dades.construir_cub_per_blocs(ruta, memoria_max_mb=self.memoria_max_mb, motor=self.motor,
+                                                    densitat=densitat)
+                etapa['grups'] = len(cub)
         else:
-            y_data.append([0] * len(nivell_pct_t.index))
-    
-    button = dict(
-        label=territory,
-        method='update',
-        args=[
-            {'y': y_data},
-            {'title': f'Distribució per Nivell d\'Assoliment - {territory}'}
-        ]
-    )
-    buttons_chart4.append(button)
-
-fig4.update_layout(
-    updatemenus=[
-        dict(
-            buttons=buttons_chart4,
-            direction="down",
-            pad={"r": 10, "t": 10},
-            showactive=True,
-            x=0.5,
-            xanchor="center",
-            y=1.20,
-            yanchor="top",
-            bgcolor="white",
-            bordercolor="gray",
-            borderwidth=2
-        )
-    ],
-    title=f'Distribució per Nivell d\'Assoliment - {default_territory_chart4}',
-    barmode='stack',
-    xaxis_title='Any',
-    yaxis_title='Percentatge d\'alumnes (%)',
-    height=500,
-    margin=dict(l=80, r=50, t=120, b=80),
-    legend=dict(
-        title='Nivell Assoliment',
-        orientation="v",
-        yanchor="top",
-        y=0.99,
-        xanchor="right",
-        x=0.99,
-        bgcolor="rgba(255, 255, 255, 0.9)",
-        bordercolor="gray",
-        borderwidth=1
-    ),
-    paper_bgcolor='rgba(0,0,0,0)',
-    plot_bgcolor='rgba(0,0,0,0)',
-    yaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', range=[0, 100]),
-    xaxis=dict(dtick=1)
-)
-
-chart4_json = json.dumps(fig4.to_plotly_json(), cls=PlotlyJSONEncoder)
-
-# ==============================================================================
-# Generació HTML
-# ==============================================================================
-print("Generating HTML file...")
-
-html_template = f"""<!DOCTYPE html>
-<html lang="ca">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Com influeixen el gènere, el territori i l'entorn en els resultats escolars?</title>
-    <script src="https://cdn.plot.ly/plotly-2.27.0.min.js"></script>
-    <style>
-        body {{
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            margin: 0;
-            padding: 20px;
-            background: #667eea;
-            min-height: 100vh;
-        }}
-        .container {{
-            max-width: 1400px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 15px;
-            padding: 40px;
-            box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-        }}
-        h1 {{
-            text-align: center;
-            color: #2c3e50;
-            font-size: 2.5em;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.1);
-        }}
-        .subtitle {{
-            text-align: center;
-            color: #7f8c8d;
-            font-size: 1.2em;
-            margin-bottom: 40px;
-        }}
-        .chart-container {{
-            margin: 40px 0;
-            padding: 20px;
-            background: #f8f9fa;
-            border-radius: 10px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        }}
-        .chart-title {{
-            font-size: 1.5em;
-            color: #34495e;
-            margin-bottom: 15px;
-            font-weight: 600;
-        }}
-        .chart-description {{
-            color: #7f8c8d;
-            margin-bottom: 20px;
-            font-size: 0.95em;
-            line-height: 1.6;
-        }}
-        .stats {{
-            display: flex;
-            justify-content: space-around;
-            margin: 30px 0;
-            flex-wrap: wrap;
-        }}
-        .stat-box {{
-            background: #667eea;
-            color: white;
-            padding: 20px 30px;
-            border-radius: 10px;
-            text-align: center;
-            min-width: 180px;
-            margin: 10px;
-            transition: transform 0.3s ease;
-        }}
-        .stat-box:hover {{
-            transform: translateY(-5px);
-            box-shadow: 0 10px 20px rgba(0, 0, 0, 0.2);
-        }}
-        .stat-number {{
-            font-size: 2.5em;
-            font-weight: bold;
-        }}
-        .stat-label {{
-            font-size: 1em;
-            opacity: 0.9;
-        }}
-        .stat-box.positive {{
-            background: #2ecc71;
-        }}
-        .stat-box.negative {{
-            background: #e74c3c;
-        }}
-        footer {{
-            margin-top: 60px;
-            padding-top: 30px;
-            border-top: 2px solid #e0e0e0;
-            text-align: center;
-            color: #7f8c8d;
-            font-size: 0.9em;
-        }}
-        .interpretation {{
-            background: #e8f4f8;
-            border-left: 4px solid #3498db;
-            padding: 15px;
-            margin: 20px 0;
-            border-radius: 5px;
-        }}
-        .interpretation h3 {{
-            color: #2c3e50;
-            margin-top: 0;
-            font-size: 1.1em;
-        }}
-        .interpretation p {{
-            color: #555;
-            line-height: 1.6;
-            margin: 10px 0;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Com influeixen el gènere, el territori i l'entorn <br> en els resultats escolars?</h1>
-        <div class="subtitle">Anàlisi de les Competències Bàsiques de Sisè de Primària a Catalunya (2009-2023)<br>
-        <small>Font: Portal de dades obertes de la Generalitat de Catalunya (Dades proveïdes pel Departament d'Educació)</small></div>
-
-        <div class="stats">
-            <div class="stat-box">
-                <div class="stat-number">{total_students:,}</div>
-                <div class="stat-label">Alumnes Analitzats</div>
-            </div>
-            <div class="stat-box">
-                <div class="stat-number">{num_territories}</div>
-                <div class="stat-label">Àrees Territorials</div>
-            </div>
-            <div class="stat-box">
-                <div class="stat-number">{mitjana_global:.1f}</div>
-                <div class="stat-label">Mitjana Global</div>
-            </div>
-            <div class="stat-box {'positive' if creixement_percentual > 0 else 'negative'}">
-                <div class="stat-number">{creixement_percentual:+.2f}%</div>
-                <div class="stat-label">Creixement vs Any Anterior</div>
-            </div>
-        </div>
-
-        <!-- Visualització 1: Evolució LING_MAT -->
-        <div class="chart-container">
-            <div class="chart-title">1. Equilibri entre Competències Lingüístiques i Matemàtiques</div>
-            <div class="chart-description">
-                Aquest gràfic mostra l'evolució de la diferència entre el rendiment en llengües i matemàtiques al llarg dels anys.
-                <br> Els valors <b>positius</b> indiquen <b>millor rendiment en llengües</b>, mentre que els 
-                valors <b>negatius</b> indiquen <b>millor rendiment en matemàtiques</b>.
-            </div>
-            <div id="chart1"></div>
-            <div class="interpretation">
-                <h3>Punts clau:</h3>
-                <p>S'observa com els <b>nois presenten major desequilibri</b> (habitualment presentant millors resultats en matemàtiques que en llengües).
-                Tot i així en els últims anys aquest desequilibri ha anat millorant.<br>
-                Les <b>noies</b> partien d'un <b>equilibri més gran</b> entre ambdues competències, encara que en els <b>últims anys</b> han mostrat <b>millors resultats en llengües que en matemàtiques</b>. 
-                </p>
-            </div>
-        </div>
-
-        <!-- Visualització 2: Mitjana Global per territori -->
-        <div class="chart-container">
-            <div class="chart-title">2. Rendiment per Àrea Territorial segons l'Edat Relativa</div>
-            <div class="chart-description">
-                Gràfic de línies que mostra com <b>evoluciona la mitjana global</b> de cada àrea territorial en <b>funció de 
-                l'edat relativa</b> dels alumnes.<br>
-                L'edat relativa indica els mesos de diferència respecte l'edat mínima per cursar sisè.
-            </div>
-            <div id="chart2"></div>
-            <div class="interpretation">
-                <h3>Punts clau:</h3>
-                <p><b>L'edat relativa</b> té un lleuger <b>impacte en el rendiment acadèmic</b>. Els alumnes més grans dins del 
-                mateix curs tendeixen a obtenir millors resultats.<br>
-                Les <b>diferències</b> gairebé constants <b>entre territoris</b> poden reflectir factors socioeconòmics, 
-                recursos educatius i polítiques locals.</p>
-            </div>
-        </div>
-
-        <!-- Visualització 3: Heatmaps comparatius -->
-        <div class="chart-container">
-            <div class="chart-title">3. Comparativa entre Llengües i Matemàtiques en funció del Centre i Gènere</div>
-            <div class="chart-description">
-                Mapes de calor interactius que permeten <b>comparar el rendiment</b> en llengües i matemàtiques 
-                segons la naturalesa del centre (públic/privat) i el gènere. 
-                <br>Utilitzeu el selector superior per filtrar per àrea territorial.
-            </div>
-            <div id="chart3"></div>
-            <div class="interpretation">
-                <h3>Punts clau:</h3>
-                <p>La visualització mostra que, en mitjana, els <b>nois obtenen puntuacions més altes en matemàtiques que en llengües</b>, 
-                mentre que les <b>noies</b> presenten valors <b>més equilibrats</b> entre ambdues competències.<br>
-                <b>En llengües, les noies superen els nois, i en matemàtiques passa a l'inrevés.</b><br>
-                També s'observa que els <b>centres privats</b> tenen <b>mitjanes més altes que els públics</b> en totes les competències 
-                (les diferències en funció del centre podríen estar relacionades amb factors socioeconòmics).</p>
-            </div>
-        </div>
-
-        <!-- Visualització 4: Nivell d'Assoliment -->
-        <div class="chart-container">
-            <div class="chart-title">4. Evolució dels Nivells d'Assoliment</div>
-            <div class="chart-description">
-                Gràfic de barres apilades que mostra el percentatge d'alumnes en cada nivell d'assoliment 
-                (Alt, Mitja, Baix) al llarg dels anys. Permet avaluar l'evolució global de la qualitat educativa.
-            </div>
-            <div id="chart4"></div>
-            <div class="interpretation">
-                <h3>Punts clau:</h3>
-                <p>S'observa com es manté una <b>distribució bastant estable</b> al llarg dels anys.<br>
-                En els <b>dos últims anys</b> es veu, però, un <b>increment del 3% en el nivell baix</b>, cosa preocupant si es manté
-                o segueix creixent</p>
-            </div>
-        </div>
-
-        <footer>
-            <p><strong>Font:</strong> Portal de dades obertes de la Generalitat de Catalunya (Dades proveïdes pel Departament d'Educació).</p>
-            <p><strong>Metodologia:</strong> Anàlisi amb {total_students:,} observacions de {num_territories} àrees territorials.</p>
-            <p>Visualització creada amb Plotly i Python per a l'assignatura de Visualització de Dades - UOC</p>
-            <p><strong>Autora:</strong> Rita Roca Taxonera</p>
-        </footer>
-    </div>
-
-    <script>
-        // Renderitzem totes les visualitzacions per JavaScript
-        var chart1Data = {chart1_json};
-        var chart2Data = {chart2_json};
-        var chart3Data = {chart3_json};
-        var chart4Data = {chart4_json};
-
-        console.log('Chart 1 traces:', chart1Data.data ? chart1Data.data.length : 'NO DATA');
-        console.log('Chart 2 traces:', chart2Data.data ? chart2Data.data.length : 'NO DATA');
-
-        Plotly.newPlot('chart1', chart1Data.data, chart1Data.layout, {{responsive: true}});
-        Plotly.newPlot('chart2', chart2Data.data, chart2Data.layout, {{responsive: true}});
-        Plotly.newPlot('chart3', chart3Data.data, chart3Data.layout, {{responsive: true}});
-        Plotly.newPlot('chart4', chart4Data.data, chart4Data.layout, {{responsive: true}});
-    </script>
-</body>
-</html>"""
-
-# Write HTML file
-with open('RitaRocaTaxonera_PRAC2_Storytelling.html', 'w', encoding='utf-8') as f:
-    f.write(html_template)
-
-print("==========================================================")
-print("Fitxer desat com: RitaRocaTaxonera_PRAC2_Storytelling.html")
-print("==========================================================")
\ No newline at end of file
+            df_clean = dades.carregar_dataset_amb_cache(ruta, self.cau_dades or dades.DIRECTORI_CACHE)
+            if self.mostra:
+                files_totals = len(df_clean)
+                with perfil.etapa('mostra') as etapa:
+                    if self.mostra < 1:
+                        df_clean = dades.mostra_estratificada(df_clean, fraccio=self.mostra)
+                    else:
+                        df_clean = dades.mostra_estratificada(df_clean, max_files=int(self.mostra))
+                    etapa['files'] = len(df_clean)
+                self.info_mostra = {'files': len(df_clean), 'files_totals': files_totals}
+                self._print(f"Previsualització amb una mostra estratificada de {len(df_clean):,} "
+                            f"de {files_totals:,} files")
+            with perfil.etapa('cub') as etapa:
+                cub = dades.construir_cub(df_clean, motor=self.motor)
+                etapa['files'] = len(df_clean)
+                etapa['grups'] = len(cub)
+            with perfil.etapa('densitat') as etapa:
+                densitat.afegir_bloc(df_clean)
+                etapa['files'] = len(df_clean)
+        self._densitat_completa = densitat.resultat()
+
+        self._print(f"Total d'alumnes: {int(cub['n'].sum()):,}")
+        self._print(f"Anys disponibles: {list(dades.agregar_cub(cub, ['ANY']).index)}")
+        return cub
+
+    @property
+    def estadistiques(self):
+        """Estadístiques clau de la capçalera de la pàgina."""
+        if self._estadistiques is None:
+            import dades
+
+            cub = self.cub
+            with perfil.etapa('estadistiques') as etapa:
+                self._estadistiques = dades.calcular_estadistiques(cub)
+                etapa['grups'] = len(cub)
+            if self.info_mostra:
+                self._estadistiques['mostra'] = self.info_mostra
+            self._print(f"Mitjana global: {self._estadistiques['mitjana_global']:.2f}")
+            self._print(f"Creixement percentual respecte any anterior: "
+                        f"{self._estadistiques['creixement_percentual']:.2f}%")
+        return self._estadistiques
+
+    @property
+    def figures(self):
+        """Les cinc figures Plotly."""
+        if self._figures is None:
+            self._figures = [None] * len(TITOLS_VISUALITZACIONS)
+        if None in self._figures:
+            import grafics
+
+            fonts = {'cub': self.cub, 'densitat': self.densitat, 'canvis': self.canvis}
+            territories = self.estadistiques['territories']
+            for numero, (titol, (agregar, crear), noms) in enumerate(
+                    zip(TITOLS_VISUALITZACIONS, grafics.VISUALITZACIONS, grafics.FONTS_VISUALITZACIONS), start=1):
+                if self._figures[numero - 1] is not None:
+                    continue
+                self._print(titol)
+                with perfil.etapa(f'agregacio_{numero}') as etapa:
+                    dades_grafic = agregar(*[fonts[nom] for nom in noms], territories)
+                    etapa['grups'] = len(self.cub)
+                with perfil.etapa(f'figura_{numero}') as etapa:
+                    self._figures[numero - 1] = crear(dades_grafic)
+                    etapa['traces'] = len(self._figures[numero - 1].data)
+        return self._figures
+
+    @property
+    def charts_json(self):
+        """JSON de cada figura, tal com s'insereix a l'HTML."""
+        if self._charts_json is None:
+            self._charts_json = [None] * len(TITOLS_VISUALITZACIONS)
+        pendents = [numero for numero, chart_json in enumerate(self._charts_json, start=1) if chart_json is None]
+        if pendents and self.processos_figures != 1 and self._figures is None:
+            import grafics
+
+            cub = self.cub
+            territories = self.estadistiques['territories']
+            self._print("Construint i serialitzant les visualitzacions en paral·lel...")
+            with perfil.etapa('figures_json_paralel') as etapa:
+                # Només els gràfics pendents (en el mode vigilància, els que s'han invalidat)
+                resultats = grafics.serialitzar_en_paralel(
+                    cub, territories, processos=self.processos_figures or None, binari=self.binari,
+                    densitat=self.densitat, canvis=self.canvis, numeros=pendents)
+                for numero, chart_json in zip(pendents, resultats):
+                    self._charts_json[numero - 1] = chart_json
+                etapa['grafics'] = len(pendents)
+                etapa['bytes'] = sum(len(chart_json) for chart_json in resultats)
+
+        if None in self._charts_json:
+            import grafics
+
+            for numero, fig in enumerate(self.figures, start=1):
+                if self._charts_json[numero - 1] is not None:
+                    continue
+                # Convertir a diccionari JSON per generar HTML
+                with perfil.etapa(f'json_{numero}') as etapa:
+                    self._charts_json[numero - 1] = grafics.serialitzar_figura(fig, binari=self.binari)
+                    etapa['bytes'] = len(self._charts_json[numero - 1])
+        return self._charts_json
+
+    def invalidar(self, dades=False, grafics=None):
+        """Descarta resultats calculats perquè es tornin a calcular quan calgui.
+
+        Amb `dades` es descarta tot, cub inclòs (per exemple, si el CSV ha
+        canviat); `grafics` és la llista de números (1-5) dels gràfics a refer.
+        """
+        if dades:
+            self._cub_complet = self._cub = self._estadistiques = self._figures = self._charts_json = None
+            self._densitat_completa = self._densitat = self._canvis = self._origen_cub = None
+            self._magatzem_preparat = False
+            return
+        for numero in grafics or []:
+            for resultats in (self._figures, self._charts_json):
+                if resultats is not None:
+                    resultats[numero - 1] = None
+
+    def _graf_etapes(self):
+        """Graf d'etapes de l'informe: cub i densitat → estadístiques i punts de canvi → agregats i JSON de cada gràfic → HTML.
+
+        El codi de cada etapa s'identifica per l'empremta del fitxer o de les
+        funcions que l'implementen, i les claus es calculen sense executar cap
+        etapa, de manera que una execució sense canvis només llegeix l'HTML desat.
+        """
+        import etapes
+
+        graf = etapes.GrafEtapes(self.cau_etapes)
+        codi_dades = etapes.empremta_fitxer(etapes.ruta_modul('dades'))
+        noms = [f'{prefix}_visualitzacio{numero}' for numero in range(1, len(TITOLS_VISUALITZACIONS) + 1)
+                for prefix in ('agregar', 'crear')]
+        funcions, comuna = etapes.fonts_modul(etapes.ruta_modul('grafics'), noms)
+
+        # L'origen del cub es conserva mentre no s'invaliden les dades, perquè les
+        # claus no canviïn quan el cub ja és a memòria (mode vigilància, variants)
+        if self._origen_cub is None:
+            if self._cub_complet is not None:
+                densitat = self._densitat_completa
+                self._origen_cub = {'cub': etapes.empremta_cub(self._cub_complet), 'mostra': self.info_mostra,
+                                    'densitat': None if densitat is None else etapes.empremta_cub(densitat['recomptes'])}
+            else:
+                self._origen_cub = {'dades': graf.empremta_entrada(self.ruta or configuracio.FITXER_DADES),
+                                    'motor': self.motor, 'mostra': self.mostra, 'punts': self.punts_densitat}
+        graf.afegir('cub_complet', lambda: (self.cub_complet, self.info_mostra, self._densitat_completa),
+                    codi=codi_dades, config=self._origen_cub)
+        graf.afegir('cub', self._filtrar_cub_etapa, ['cub_complet'], codi=codi_dades,
+                    config=self.filtres, persistent=False)
+        graf.afegir('densitat', lambda cub: self.densitat, ['cub'], codi=codi_dades, persistent=False)
+        graf.afegir('estadistiques', self._estadistiques_etapa, ['cub_complet', 'cub'], codi=codi_dades)
+        graf.afegir('canvis', lambda cub: self.canvis, ['cub'],
+                    codi=[codi_dades, etapes.empremta_fitxer(etapes.ruta_modul('canvis'))])
+
+        for numero, noms in enumerate(configuracio.FONTS_VISUALITZACIONS, start=1):
+            graf.afegir(f'agregats{numero}', lambda *entrades, numero=numero: self._agregats_etapa(
+                        numero, entrades[:-1], entrades[-1]), list(noms) + ['estadistiques'],
+                        codi=[codi_dades, comuna, funcions.get(f'agregar_visualitzacio{numero}')])
+            graf.afegir(f'grafic{numero}', lambda dades_grafic, numero=numero: self._grafic_etapa(
+                        numero, dades_grafic), [f'agregats{numero}'],
+                        codi=[comuna, funcions.get(f'crear_visualitzacio{numero}')], config={'binari': self.binari})
+
+        if self.plotly_local is True:
+            from importlib.metadata import version
+
+            script = version('plotly')
+        elif self.plotly_local:
+            script = etapes.empremta_fitxer(self.plotly_local)
+        else:
+            script = None
+        graf.afegir('html', self._html_etapa,
+                    ['estadistiques', 'canvis'] + [f'grafic{numero}' for numero in range(1, len(TITOLS_VISUALITZACIONS) + 1)],
+                    codi=etapes.empremta_fitxer(etapes.ruta_modul('pagina')),
+                    config={'plotly_local': script, 'filtre': self.descripcio_filtres()})
+        return graf
+
+    def _filtrar_cub_etapa(self, cub_complet):
+        self._cub_complet, self.info_mostra, self._densitat_completa = cub_complet
+        return self.cub
+
+    def _estadistiques_etapa(self, cub_complet, cub):
+        return self.estadistiques
+
+    def _agregats_etapa(self, numero, fonts, estadistiques):
+        import grafics
+
+        self._print(TITOLS_VISUALITZACIONS[numero - 1])
+        agregar, _ = grafics.VISUALITZACIONS[numero - 1]
+        with perfil.etapa(f'agregacio_{numero}') as etapa:
+            dades_grafic = agregar(*fonts, estadistiques['territories'])
+            etapa['grups'] = len(self.cub)
+        return dades_grafic
+
+    def _grafic_etapa(self, numero, dades_grafic):
+        import grafics
+
+        _, crear = grafics.VISUALITZACIONS[numero - 1]
+        with perfil.etapa(f'figura_{numero}') as etapa:
+            fig = crear(dades_grafic)
+            etapa['traces'] = len(fig.data)
+        with perfil.etapa(f'json_{numero}') as etapa:
+            chart_json = grafics.serialitzar_figura(fig, binari=self.binari)
+            etapa['bytes'] = len(chart_json)
+        return chart_json
+
+    def _html_etapa(self, estadistiques, canvis, *charts_json):
+        import pagina
+
+        with perfil.etapa('html') as etapa:
+            html = pagina.generar_html(estadistiques, list(charts_json), plotly_local=self.plotly_local,
+                                       filtre=self.descripcio_filtres(), canvis=canvis)
+            etapa['bytes'] = len(html)
+        return html
+
+    def html(self):
+        """Pàgina HTML completa."""
+        import pagina
+
+        if self.cau_etapes:
+            graf = self._graf_etapes()
+            html = graf.valor('html')
+            self._print(f"Etapes reutilitzades: {', '.join(graf.reutilitzades) or 'cap'}; "
+                        f"recalculades: {', '.join(graf.calculades) or 'cap'}")
+            return html
+
+        estadistiques = self.estadistiques
+        charts_json = self.charts_json
+        with perfil.etapa('html') as etapa:
+            html = pagina.generar_html(estadistiques, charts_json, plotly_local=self.plotly_local,
+                                       filtre=self.descripcio_filtres(), canvis=self.canvis)
+            etapa['bytes'] = len(html)
+        return html
+
+    def desar(self, ruta=None):
+        """Genera la pàgina i l'escriu a disc; retorna la ruta escrita."""
+        import pagina
+
+        ruta = ruta or pagina.FITXER_SORTIDA
+        html = self.html()
+        self._print("Generating HTML file...")
+        with perfil.etapa('escriptura_html'):
+            with open(ruta, 'w', encoding='utf-8') as f:
+                f.write(html)
+        return ruta
+
+
+def carregar_especificacions(ruta):
+    """Llegeix les especificacions del mode lot: una llista JSON d'objectes amb la sortida i els filtres.
+
+    Exemple: [{"sortida": "girona.html", "territoris": "Girona", "anys": [2015, 2023],
+    "naturalesa": "Public"}]. "anys" és un interval inclusiu; "territoris" i
+    "naturalesa" admeten un valor o una llista.
+    """
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            especificacions = json.load(f)
+    except (OSError, ValueError) as error:
+        raise ValueError(f"no es pot llegir {ruta}: {error}") from None
+    if not isinstance(especificacions, list):
+        raise ValueError(f"{ruta} ha de contenir una llista d'especificacions")
+
+    # Es validen totes les especificacions abans de generar cap pàgina
+    informes = []
+    errors = []
+    for posicio, especificacio in enumerate(especificacions, start=1):
+        error = _error_especificacio(especificacio)
+        if error is None and any(especificacio['sortida'] == sortida for sortida, _ in informes):
+            error = f"la sortida {especificacio['sortida']} es repeteix"
+        if error is not None:
+            errors.append(f"especificació {posicio} ({json.dumps(especificacio, ensure_ascii=False)}): {error}")
+            continue
+        filtres = {}
+        for clau, valors in especificacio.items():
+            if clau == 'anys':
+                inici, fi = valors
+                valors = list(range(inici, fi + 1))
+            if clau != 'sortida':
+                filtres[FILTRES_LOT[clau]] = valors
+        informes.append((especificacio['sortida'], filtres))
+    if errors:
+        raise ValueError(f"{ruta}: " + '; '.join(errors))
+    return informes
+
+
+def _error_especificacio(especificacio):
+    """Descripció del primer problema d'una especificació del mode lot (None si és vàlida)."""
+    if not isinstance(especificacio, dict):
+        return "cal un objecte amb 'sortida' i els filtres"
+    desconegudes = set(especificacio) - set(FILTRES_LOT) - {'sortida'}
+    if desconegudes:
+        return (f"claus desconegudes {', '.join(sorted(desconegudes))} "
+                f"(els filtres poden ser {', '.join(FILTRES_LOT)})")
+    if not isinstance(especificacio.get('sortida'), str) or not especificacio['sortida']:
+        return "cal 'sortida', el nom del fitxer HTML"
+    anys = especificacio.get('anys', [0, 0])
+    if (not isinstance(anys, list) or len(anys) != 2
+            or not all(isinstance(any_, int) and not isinstance(any_, bool) for any_ in anys)):
+        return "'anys' ha de ser un interval [inici, fi] de dos anys enters"
+    if anys[0] > anys[1]:
+        return f"l'interval d'anys {anys[0]}-{anys[1]} és buit"
+    for clau in ('territoris', 'naturalesa'):
+        valors = especificacio.get(clau, [])
+        if not isinstance(valors, (str, list)) or not all(isinstance(valor, str) for valor in
+                                                          (valors if isinstance(valors, list) else [valors])):
+            return f"'{clau}' ha de ser un text o una llista de textos"
+    return None
+
+
+def preparar_lot(informe, especificacions):
+    """Variants d'`informe` de les especificacions (sortida, filtres), comprovades contra les dades.
+
+    Cada variant ha de deixar almenys dos anys amb dades, i el primer i
+    l'últim any de l'interval demanat n'han de tenir. Es comproven totes les
+    variants abans de generar-ne cap, i els problemes es retornen junts en un
+    ValueError.
+    """
+    import dades
+
+    variants = []
+    errors = []
+    for sortida, filtres in especificacions:
+        variant = informe.variant(filtres, verbos=False)
+        anys = dades.agregar_cub(variant.cub, ['ANY']).index
+        demanats = filtres.get(FILTRES_LOT['anys'])
+        if len(anys) < 2:
+            errors.append(f"{sortida}: el filtre ha de deixar almenys dos anys amb dades (en deixa {len(anys)})")
+        elif demanats and (anys.min() != demanats[0] or anys.max() != demanats[-1]):
+            errors.append(f"{sortida}: l'interval d'anys {demanats[0]}-{demanats[-1]} no està cobert per les dades "
+                          f"del filtre, que van de {anys.min()} a {anys.max()}")
+        else:
+            variants.append((sortida, variant))
+    if errors:
+        raise ValueError('; '.join(errors))
+    return variants
+
+
+def generar_lot(variants):
+    """Genera una pàgina per variant (sortida, variant) de preparar_lot().
+
+    El dataset es carrega i s'agrega una sola vegada; cada variant només filtra
+    el cub i en deriva els gràfics i les estadístiques. Amb el magatzem SQLite,
+    cada variant en consulta només les files dels seus filtres.
+    """
+    rutes = []
+    for sortida, variant in variants:
+        with perfil.etapa('informe_lot') as etapa:
+            rutes.append(variant.desar(sortida))
+            etapa['grups'] = len(variant.cub)
+        print(f"Fitxer desat com: {sortida} ({variant.descripcio_filtres()}; "
+              f"{variant.estadistiques['total_students']:,} alumnes)")
+    return rutes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--dades', metavar='CSV',
+                        help="CSV d'entrada (el _mod.csv o l'export en brut, de què es deriven les columnes calculades), "
+                             "pla o comprimit en gzip, xz, bz2, zip o zstd (es detecta pel contingut)")
+    parser.add_argument('--motor', choices=configuracio.MOTORS_AGREGACIO, default='bincount',
+                        help="motor d'agregació per construir el cub (per defecte: bincount)")
+    parser.add_argument('--streaming', action='store_true',
+                        help='llegeix el CSV per blocs sense carregar-lo sencer a memòria')
+    parser.add_argument('--memoria-max', type=int, default=512, metavar='MB',
+                        help='pressupost aproximat de memòria per bloc en mode streaming (per defecte: 512)')
+    parser.add_argument('--processos', type=int, default=1, metavar='N',
+                        help='processos per llegir i agregar el CSV en paral·lel (0: tots els nuclis; per defecte: 1)')
+    parser.add_argument('--processos-figures', type=int, default=1, metavar='N',
+                        help='processos per construir i serialitzar els gràfics en paral·lel (0: un per gràfic; per defecte: 1)')
+    parser.add_argument('--mostra', type=float, metavar='FRACCIO|FILES',
+                        help="previsualització sobre una mostra estratificada per any, territori, gènere i naturalesa: "
+                             "fracció (< 1) o nombre de files (>= 1), amb l'error estimat a les caixes i als hovers")
+    parser.add_argument('--punts-densitat', type=int, default=0, metavar='N',
+                        help="dibuixa una mostra uniforme de fins a N alumnes per territori i gènere (també per a "
+                             "\"Tots\") sobre la densitat PLING × PMAT del gràfic 5, amb WebGL (per defecte: 0, cap)")
+    parser.add_argument('--processos-canvis', type=int, default=0, metavar='N',
+                        help='processos per detectar els punts de canvi de les sèries anuals (0: tots els nuclis, '
+                             'només si hi ha prou sèries; per defecte: 0)')
+    parser.add_argument('--binari', action='store_true',
+                        help="codifica els arrays numèrics dels gràfics com a typed arrays en base64 (HTML més lleuger)")
+    parser.add_argument('--plotly-local', nargs='?', const=True, metavar='JS',
+                        help="insereix Plotly a la pàgina en lloc de carregar-lo del CDN: el fitxer indicat "
+                             "o, sense valor, el bundle del paquet plotly instal·lat")
+    parser.add_argument('--cau-etapes', nargs='?', const='.cache_etapes', metavar='DIR',
+                        help="desa a disc el resultat de cada etapa (cub, estadístiques, gràfics, HTML) sota un hash "
+                             "de les seves entrades i només refà les que han canviat (per defecte: .cache_etapes)")
+    parser.add_argument('--lot', metavar='JSON',
+                        help="genera una pàgina per a cada especificació (sortida i filtres) del fitxer JSON "
+                             "amb una sola càrrega del dataset")
+    parser.add_argument('--vigilar', action='store_true',
+                        help="manté les dades a memòria i regenera l'HTML quan canvien el CSV, grafics.py o pagina.py")
+    parser.add_argument('--servir', nargs='?', type=int, const=8000, metavar='PORT',
+                        help="serveix consultes d'agregats i la pàgina per HTTP a 127.0.0.1 (per defecte: port 8000; "
+                             "amb 0, un port lliure)")
+    parser.add_argument('--cau-max', type=int, default=64, metavar='MB',
+                        help="mida màxima de la memòria cau de respostes del servei (per defecte: 64)")
+    parser.add_argument('--magatzem', nargs='?', const=configuracio.FITXER_MAGATZEM, metavar='SQLITE',
+                        help="carrega el dataset net en un magatzem SQLite indexat (es reutilitza mentre el CSV no "
+                             "canviï) i n'agrega les files amb consultes GROUP BY; els informes filtrats del mode lot "
+                             f"només en llegeixen les seves files (per defecte: {configuracio.FITXER_MAGATZEM})")
+    parser.add_argument('--estat', default=configuracio.FITXER_ESTAT, metavar='FITXER',
+                        help=f"fitxer amb l'estat persistent del cub (per defecte: {configuracio.FITXER_ESTAT})")
+    parser.add_argument('--desar-estat', action='store_true',
+                        help="desa el cub calculat a --estat per a futures ingestions incrementals")
+    parser.add_argument('--afegir-any', metavar='CSV',
+                        help="fusiona un CSV amb un any nou a --estat i regenera l'HTML sense rellegir l'històric")
+    parser.add_argument('--perfil', nargs='?', const='perfil.json', metavar='JSON',
+                        help="mesura cada etapa, n'imprimeix un resum i el desa en JSON (per defecte: perfil.json)")
+    args = parser.parse_args()
+    if args.mostra is not None and (args.mostra <= 0 or args.streaming or args.processos != 1 or args.afegir_any):
+        parser.error("--mostra ha de ser positiu i només es pot fer servir amb la càrrega en memòria")
+    if args.mostra is not None and args.desar_estat:
+        parser.error("--mostra no es pot combinar amb --desar-estat: l'estat ha de contenir totes les files")
+    if args.magatzem and (args.streaming or args.processos != 1 or args.mostra is not None or args.afegir_any):
+        parser.error("--magatzem no es pot combinar amb --streaming, --processos, --mostra ni --afegir-any")
+
+    if args.perfil:
+        perfil.activar()
+
+    opcions = dict(ruta=args.dades, motor=args.motor, streaming=args.streaming, memoria_max_mb=args.memoria_max,
+                   processos=args.processos, processos_figures=args.processos_figures, binari=args.binari,
+                   plotly_local=args.plotly_local, mostra=args.mostra, punts_densitat=args.punts_densitat,
+                   processos_canvis=args.processos_canvis, magatzem=args.magatzem, cau_etapes=args.cau_etapes,
+                   verbos=True)
+    if args.afegir_any:
+        import dades
+
+        print("Carregant dataset...")
+        with perfil.etapa('afegir_any') as etapa:
+            try:
+                cub, densitat = dades.afegir_any(args.afegir_any, args.estat, motor=args.motor)
+            except ValueError as error:
+                parser.error(f"--afegir-any: {error}")
+            etapa['grups'] = len(cub)
+        informe = Informe.des_de_cub(cub, densitat, **opcions)
+    else:
+        informe = Informe(**opcions)
+
+    if args.desar_estat:
+        import dades
+
+        acumulador = dades.AcumuladorCub()
+        acumulador.afegir_cub(informe.cub)
+        if informe.densitat is not None:
+            acumulador.afegir_densitat(informe.densitat['recomptes'], informe.densitat['caselles'])
+        acumulador.desar(args.estat)
+
+    if args.servir is not None:
+        import servei
+
+        try:
+            servei.servir(informe, port=args.servir, cau_max_mb=args.cau_max)
+        except KeyboardInterrupt:
+            print("Servei aturat")
+        return
+    if args.vigilar:
+        import vigilancia
+
+        try:
+            vigilancia.vigilar(informe)
+        except KeyboardInterrupt:
+            print("Vigilància aturada")
+        return
+    if args.lot:
+        try:
+            variants = preparar_lot(informe, carregar_especificacions(args.lot))
+        except ValueError as error:
+            parser.error(f"--lot: {error}")
+        rutes = generar_lot(variants)
+        print("==========================================================")
+        print(f"Informes generats: {len(rutes)}")
+        print("==========================================================")
+    else:
+        ruta = informe.desar()
+
+        print("==========================================================")
+        print(f"Fitxer desat com: {ruta}")
+        print("==========================================================")
+
+    if args.perfil:
+        perfil.resum()
+        perfil.desar(args.perfil)
+        print(f"Informe de perfil desat com: {args.perfil}")
+
+
+if __name__ == '__main__':
+    main()
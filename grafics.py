@@ -0,0 +1,825 @@
+"""
+Agregació i figures Plotly de les cinc visualitzacions
+"""
+
+import base64
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from plotly.utils import PlotlyJSONEncoder
+
+from configuracio import FONTS_VISUALITZACIONS
+from dades import CASELLES_DENSITAT, NIVELL_CONFIANCA, agregar_cub, interval_cub, valor_critic
+
+# Paleta qualitativa Set3 de Plotly (els deu primers colors), un per territori
+COLORS_TERRITORIS = [
+    'rgb(141,211,199)', 'rgb(255,255,179)', 'rgb(190,186,218)', 'rgb(251,128,114)', 'rgb(128,177,211)',
+    'rgb(253,180,98)', 'rgb(179,222,105)', 'rgb(252,205,229)', 'rgb(217,217,217)', 'rgb(188,128,189)',
+]
+
+# Etiqueta dels intervals de confiança als hovers
+ETIQUETA_INTERVAL = f'IC {NIVELL_CONFIANCA:.0%}'
+
+
+# ==============================================================================
+# Desplegables per territori (gràfics 3, 4 i 5)
+# ==============================================================================
+def botons_territori(valors):
+    """Botons del desplegable, un per territori.
+
+    Els botons no porten dades (method='skip'): la pàgina escolta el clic i
+    aplica els valors del territori des de la taula de selector_territori.
+    """
+    return [dict(label=territory, method='skip') for territory in valors]
+
+
+def selector_territori(titol, valors):
+    """Metadades de la figura amb els valors de cada territori i el títol a mostrar.
+
+    `valors` associa cada territori als atributs de les traces que canvien
+    (per exemple {'z': [z_traça1, z_traça2]}); `titol` porta el marcador
+    {territori}.
+    """
+    return {'selector': {'titol': titol, 'valors': valors}}
+
+
+# ==============================================================================
+# Punts de canvi de les sèries anuals (gràfics 1 i 4)
+# ==============================================================================
+# Marcador dels punts de canvi detectats per canvis.detectar_canvis
+MARCADOR_CANVI = dict(symbol='diamond', size=11, color='#2c3e50', line=dict(color='white', width=1.5))
+
+
+def text_canvi(nom, canvi, format_valor):
+    """Text del hover d'un punt de canvi: el primer any del tram nou i les mitjanes dels dos trams."""
+    return (f"<b>{nom}: canvi a partir de {canvi['any']}</b><br>"
+            f"Mitjana del tram anterior: {format_valor.format(canvi['abans'])}<br>"
+            f"Mitjana del tram nou: {format_valor.format(canvi['despres'])}")
+
+
+def traca_canvis(x, y, textos):
+    """Traça de marcadors amb els punts de canvi d'un gràfic (el text de cada punt va a customdata)."""
+    return go.Scatter(
+        x=x,
+        y=y,
+        mode='markers',
+        name='Punts de canvi',
+        marker=MARCADOR_CANVI,
+        customdata=textos,
+        hovertemplate='%{customdata}<extra></extra>'
+    )
+
+
+# ==============================================================================
+# Visualització 1: Gràfic de barres - Evolució de LING_MAT al llarg dels anys per gènere
+# ==============================================================================
+def agregar_visualitzacio1(cub, canvis, territories):
+    """Mitjana de LING_MAT per any i gènere, amb el seu interval de confiança i els punts de canvi de cada gènere."""
+    # Calcular mitjana de LING_MAT per any i gènere
+    ling_mat_gender = interval_cub(cub, ['ANY', 'GENERE'], 'LING_MAT').rename(columns={'mitjana': 'LING_MAT'})
+    ling_mat_gender = ling_mat_gender.reset_index()
+    ling_mat_gender = ling_mat_gender.sort_values('ANY')
+
+    # Separar dades per gènere
+    return {
+        'dones': ling_mat_gender[ling_mat_gender['GENERE'] == 'Dona'].sort_values('ANY'),
+        'homes': ling_mat_gender[ling_mat_gender['GENERE'] == 'Home'].sort_values('ANY'),
+        'canvis': {genere: canvis.get(('LING_MAT', genere), []) for genere in ('Dona', 'Home')},
+    }
+
+
+def crear_visualitzacio1(dades):
+    """Gràfic de barres de LING_MAT per any i gènere."""
+    ling_mat_dones = dades['dones']
+    ling_mat_homes = dades['homes']
+
+    # Colors per gènere i valor positiu/negatiu
+    colors_dones = ['#C8A2E0' if x >= 0 else '#8B5CF6' for x in ling_mat_dones['LING_MAT']]
+    colors_homes = ['#A8E6A3' if x >= 0 else '#4CAF50' for x in ling_mat_homes['LING_MAT']]
+
+    fig1 = go.Figure()
+
+    # Barres per Dones
+    fig1.add_trace(go.Bar(
+        x=ling_mat_dones['ANY'],
+        y=ling_mat_dones['LING_MAT'],
+        name='Dones',
+        marker_color=colors_dones,
+        error_y=dict(type='data', array=ling_mat_dones['error'], color='#555', thickness=1.2, width=3),
+        customdata=ling_mat_dones[['inferior', 'superior']].values,
+        hovertemplate='<b>Any: %{x}</b><br>' +
+                      'Dones<br>' +
+                      'LING_MAT: %{y:.2f}<br>' +
+                      ETIQUETA_INTERVAL + ': [%{customdata[0]:.2f}, %{customdata[1]:.2f}]<br>' +
+                      '<extra></extra>'
+    ))
+
+    # Barres per Homes
+    fig1.add_trace(go.Bar(
+        x=ling_mat_homes['ANY'],
+        y=ling_mat_homes['LING_MAT'],
+        name='Homes',
+        marker_color=colors_homes,
+        error_y=dict(type='data', array=ling_mat_homes['error'], color='#555', thickness=1.2, width=3),
+        customdata=ling_mat_homes[['inferior', 'superior']].values,
+        hovertemplate='<b>Any: %{x}</b><br>' +
+                      'Homes<br>' +
+                      'LING_MAT: %{y:.2f}<br>' +
+                      ETIQUETA_INTERVAL + ': [%{customdata[0]:.2f}, %{customdata[1]:.2f}]<br>' +
+                      '<extra></extra>'
+    ))
+
+    # Punts de canvi sobre la barra del primer any de cada tram nou; amb barres
+    # agrupades, la de dones queda 0.2 a l'esquerra de l'any i la d'homes 0.2 a la dreta
+    x_canvis, y_canvis, text_canvis = [], [], []
+    for genere, nom, dades_genere, desplacament in (('Dona', 'Dones', ling_mat_dones, -0.2),
+                                                    ('Home', 'Homes', ling_mat_homes, 0.2)):
+        valors_any = dict(zip(dades_genere['ANY'], dades_genere['LING_MAT']))
+        for canvi in dades['canvis'][genere]:
+            x_canvis.append(canvi['any'] + desplacament)
+            y_canvis.append(valors_any[canvi['any']])
+            text_canvis.append(text_canvi(nom, canvi, '{:.2f}'))
+    if x_canvis:
+        fig1.add_trace(traca_canvis(x_canvis, y_canvis, text_canvis))
+
+    # Anotació per zona positiva (millor en llengües) - dalt del gràfic
+    fig1.add_annotation(
+        xref="paper",
+        yref="paper",
+        x=0.5,
+        y=0.98,
+        text="Millor en llengües",
+        showarrow=False,
+        bgcolor="#4A4949",
+        font=dict(color="white", size=11, family="Arial"),
+        bordercolor="#4A4949",
+        borderwidth=2,
+        borderpad=6,
+        opacity=0.9
+    )
+
+    # Anotació per zona negativa (millor en matemàtiques) - baix del gràfic
+    fig1.add_annotation(
+        xref="paper",
+        yref="paper",
+        x=0.5,
+        y=0.02,
+        text="Millor en matemàtiques",
+        showarrow=False,
+        bgcolor="#4A4949",
+        font=dict(color="white", size=11, family="Arial"),
+        bordercolor="#4A4949",
+        borderwidth=2,
+        borderpad=6,
+        opacity=0.9
+    )
+
+    # Afegir línia de referència en y=0
+    fig1.add_hline(y=0, line_dash="dash", line_color="gray", 
+                   annotation_text="Equilibri", annotation_position="right")
+
+    fig1.update_layout(
+        xaxis_title='Any',
+        yaxis_title='Diferència Llengües - Matemàtiques',
+        height=550,
+        margin=dict(l=80, r=50, t=80, b=80),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0, 0, 0, 0)',
+        yaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', zeroline=True, zerolinecolor='gray'),
+        xaxis=dict(dtick=1),
+        barmode='group',  # Barres agrupades per any
+        legend=dict(
+            orientation='h',
+            yanchor='bottom',
+            y=1.02,
+            xanchor='right',
+            x=1,
+            bgcolor='rgba(255, 255, 255, 0.9)',
+            bordercolor='gray',
+            borderwidth=1
+        )
+    )
+
+    return fig1
+
+
+# ==============================================================================
+# Visualització 2: Gràfic de línies - Mitjana Global per territori en funció de l'edat relativa
+# ==============================================================================
+def agregar_visualitzacio2(cub, territories):
+    """Mitjana global per territori i edat relativa, amb el seu interval de confiança."""
+    # Calcular mitjana per territori i edat relativa
+    territory_age_data = interval_cub(
+        cub, ['AREA_TERRITORIAL', 'Edat_Relativa'], 'Mitjana_Global'
+    ).rename(columns={'mitjana': 'Mitjana_Global'}).reset_index()
+    return {'territory_age_data': territory_age_data, 'territories': territories}
+
+
+def crear_visualitzacio2(dades):
+    """Gràfic de línies de la mitjana global per territori i edat relativa."""
+    territory_age_data = dades['territory_age_data']
+    territories = dades['territories']
+
+    fig2 = go.Figure()
+
+    colors_territories = COLORS_TERRITORIS
+
+    for i, territory in enumerate(territories):
+        territory_data = territory_age_data[territory_age_data['AREA_TERRITORIAL'] == territory]
+        territory_data = territory_data.sort_values('Edat_Relativa')
+
+        fig2.add_trace(go.Scatter(
+            x=territory_data['Edat_Relativa'],
+            y=territory_data['Mitjana_Global'],
+            name=territory,
+            mode='lines+markers',
+            line=dict(width=2.5, color=colors_territories[i]),
+            marker=dict(size=6),
+            error_y=dict(type='data', array=territory_data['error'], color=colors_territories[i],
+                         thickness=1, width=2),
+            customdata=territory_data[['inferior', 'superior']].values,
+            hovertemplate='<b>%{fullData.name}</b><br>' +
+                          'Edat Relativa: %{x}<br>' +
+                          'Mitjana Global: %{y:.2f}<br>' +
+                          ETIQUETA_INTERVAL + ': [%{customdata[0]:.2f}, %{customdata[1]:.2f}]<br>' +
+                          '<extra></extra>'
+        ))
+
+    fig2.update_layout(
+        xaxis_title='Edat Relativa',
+        yaxis_title='Mitjana Global',
+        height=550,
+        margin=dict(l=80, r=50, t=30, b=80),
+        legend=dict(
+            orientation="v",
+            yanchor="middle",
+            y=0.5,
+            xanchor="left",
+            x=1.02,
+            bgcolor="rgba(255, 255, 255, 0.9)",
+            bordercolor="gray",
+            borderwidth=1
+        ),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0, 0, 0, 0)',
+        yaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', range=[65, 85]),
+        xaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', dtick=1)
+    )
+
+    return fig2
+
+
+# ==============================================================================
+# Visualització 3: Heatmap doble amb dropdown per territori - PLING
+# ==============================================================================
+def agregar_visualitzacio3(cub, territories):
+    """Mitjanes de PLING i PMAT, amb interval de confiança, per territori (i "Tots"), naturalesa i gènere."""
+    def taula_naturalesa(mesura, dimensions):
+        """Files (territori, categoria, gènere, valor, error) en el format que consumeixen els heatmaps."""
+        taula = interval_cub(cub, dimensions, mesura).reset_index()
+        if 'AREA_TERRITORIAL' in taula:
+            taula = taula[taula['AREA_TERRITORIAL'].isin(territories)]
+        taula = taula[taula['NATURALESA'].isin(['Public', 'Privat']) & taula['GENERE'].isin(['Home', 'Dona'])]
+        return pd.DataFrame({
+            'AREA_TERRITORIAL': taula['AREA_TERRITORIAL'] if 'AREA_TERRITORIAL' in taula else 'Tots',
+            'Categoria': taula['NATURALESA'].map({'Public': 'Públic', 'Privat': 'Privat'}),
+            'Gènere': taula['GENERE'],
+            'Valor': taula['mitjana'],
+            'Error': taula['error'],
+        })
+
+
+    # Preparar dades per Llengües (PLING) i Matemàtiques (PMAT), per territori, naturalesa i gènere
+    df_pling_nat = taula_naturalesa('PLING', ['AREA_TERRITORIAL', 'NATURALESA', 'GENERE'])
+    df_pmat_nat = taula_naturalesa('PMAT', ['AREA_TERRITORIAL', 'NATURALESA', 'GENERE'])
+
+    # Calcular escala comuna per als dos heatmaps
+    min_val = min(df_pling_nat['Valor'].min(), df_pmat_nat['Valor'].min())
+    max_val = max(df_pling_nat['Valor'].max(), df_pmat_nat['Valor'].max())
+    # Arrodonim valors de l'escala (múltiples de 5)
+    min_val = np.floor(min_val / 5) * 5
+    max_val = np.ceil(max_val / 5) * 5
+
+    # Afegir les mitjanes de tots els territoris per a l'opció "Tots"
+    df_pling_nat = pd.concat([df_pling_nat, taula_naturalesa('PLING', ['NATURALESA', 'GENERE'])], ignore_index=True)
+    df_pmat_nat = pd.concat([df_pmat_nat, taula_naturalesa('PMAT', ['NATURALESA', 'GENERE'])], ignore_index=True)
+    return {
+        'df_pling_nat': df_pling_nat,
+        'df_pmat_nat': df_pmat_nat,
+        'min_val': min_val,
+        'max_val': max_val,
+        'territories': territories,
+    }
+
+
+def crear_visualitzacio3(dades):
+    """Heatmaps de PLING i PMAT per naturalesa i gènere, amb desplegable per territori."""
+    df_pling_nat = dades['df_pling_nat']
+    df_pmat_nat = dades['df_pmat_nat']
+    min_val = dades['min_val']
+    max_val = dades['max_val']
+    territories = dades['territories']
+
+    def matriu(df, territory, valors='Valor'):
+        """Matriu naturalesa × gènere d'un territori."""
+        return df[df['AREA_TERRITORIAL'] == territory].pivot(
+            index='Categoria', columns='Gènere', values=valors
+        ).reindex(['Públic', 'Privat'])
+
+    def interval(df, territory):
+        """Extrems de l'interval de confiança de cada casella (files × columnes × [inferior, superior])."""
+        valor = matriu(df, territory).values
+        error = matriu(df, territory, 'Error').values
+        return np.stack([valor - error, valor + error], axis=-1)
+
+    hovertemplate = ('<b>%{fullData.name}</b><br>%{y} · %{x}<br>Puntuació: %{z:.1f}<br>' +
+                     ETIQUETA_INTERVAL + ': [%{customdata[0]:.1f}, %{customdata[1]:.1f}]<extra></extra>')
+
+    # Crear subplot amb 2 heatmaps
+    fig3 = make_subplots(
+        rows=1, cols=2,
+        subplot_titles=('Puntuació en Llengües', 'Puntuació en Matemàtiques'),
+        horizontal_spacing=0.15
+    )
+
+    # Crear un heatmap per cada territori amb dropdown
+    # Opció "Tots" per defecte
+    default_territory = 'Tots'
+    df_pling_pivot = matriu(df_pling_nat, default_territory)
+    df_pmat_pivot = matriu(df_pmat_nat, default_territory)
+
+    # El text de les caselles el formata Plotly a partir de z
+    fig3.add_trace(
+        go.Heatmap(
+            z=df_pling_pivot.values,
+            x=df_pling_pivot.columns,
+            y=df_pling_pivot.index,
+            colorscale='RdYlGn',
+            texttemplate='%{z:.1f}',
+            textfont={"size": 16, "color": "black"},
+            customdata=interval(df_pling_nat, default_territory),
+            hovertemplate=hovertemplate,
+            showscale=False,
+            zmin=min_val,
+            zmax=max_val,
+            name='PLING'
+        ),
+        row=1, col=1
+    )
+
+    fig3.add_trace(
+        go.Heatmap(
+            z=df_pmat_pivot.values,
+            x=df_pmat_pivot.columns,
+            y=df_pmat_pivot.index,
+            colorscale='RdYlGn',
+            texttemplate='%{z:.1f}',
+            textfont={"size": 16, "color": "black"},
+            customdata=interval(df_pmat_nat, default_territory),
+            hovertemplate=hovertemplate,
+            colorbar=dict(title='Puntuació', x=1.05),
+            zmin=min_val,
+            zmax=max_val,
+            name='PMAT'
+        ),
+        row=1, col=2
+    )
+
+    # Valors de cada territori, una sola vegada; el desplegable els aplica des de la pàgina
+    valors = {
+        territory: {
+            'z': [matriu(df_pling_nat, territory).values, matriu(df_pmat_nat, territory).values],
+            'customdata': [interval(df_pling_nat, territory), interval(df_pmat_nat, territory)],
+        }
+        for territory in ['Tots'] + list(territories)
+    }
+
+    fig3.update_layout(
+        updatemenus=[
+            dict(
+                buttons=botons_territori(valors),
+                direction="down",
+                pad={"r": 10, "t": 10},
+                showactive=True,
+                x=0.5,
+                xanchor="center",
+                y=1.20,
+                yanchor="top",
+                bgcolor="white",
+                bordercolor="gray",
+                borderwidth=2
+            )
+        ],
+        title=f'Comparativa Llengües vs Matemàtiques - {default_territory}',
+        meta=selector_territori('Comparativa Llengües vs Matemàtiques - {territori}', valors),
+        height=500,
+        margin=dict(l=100, r=150, t=120, b=80),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0, 0, 0, 0)'
+    )
+
+    fig3.update_xaxes(title_text='Gènere', row=1, col=1)
+    fig3.update_yaxes(title_text='Naturalesa Centre', row=1, col=1)
+    fig3.update_xaxes(title_text='Gènere', row=1, col=2)
+
+    return fig3
+
+
+# ==============================================================================
+# Visualització 4: Distribució per Nivell d'Assoliment
+# ==============================================================================
+def agregar_visualitzacio4(cub, canvis, territories):
+    """Percentatge d'alumnes per any i nivell d'assoliment, per a "Tots" i per a cada territori.
+
+    Per a cada percentatge es calcula també la semiamplada del seu interval de
+    confiança (aproximació normal de la binomial), i s'hi afegeixen els punts de
+    canvi de cada nivell.
+    """
+    # Preparar dades per territori amb opció "Tots"
+    def get_nivell_data(territory=None):
+        if territory == 'Tots' or territory is None:
+            recompte = agregar_cub(cub, ['ANY', 'Nivell_Assoliment'])['n']
+        else:
+            recompte = agregar_cub(cub, ['ANY', 'Nivell_Assoliment'], AREA_TERRITORIAL=territory)['n']
+
+        nivell_data = recompte[recompte > 0].reset_index(name='count')
+        nivell_pivot = nivell_data.pivot(index='ANY', columns='Nivell_Assoliment', values='count').fillna(0)
+        nivell_pivot_pct = nivell_pivot.div(nivell_pivot.sum(axis=1), axis=0) * 100
+        proporcio = nivell_pivot_pct / 100
+        nivell_pivot_error = valor_critic() * np.sqrt(
+            proporcio * (1 - proporcio) / nivell_pivot.sum(axis=1).to_numpy()[:, None]) * 100
+        return nivell_pivot_pct, nivell_pivot_error
+
+    nivells = {territory: get_nivell_data(territory) for territory in ['Tots'] + list(territories)}
+    return {
+        'nivells': {territory: pct for territory, (pct, _) in nivells.items()},
+        'errors': {territory: error for territory, (_, error) in nivells.items()},
+        'canvis': {territory: {nivell: canvis.get((nivell, territory), []) for nivell in ['Alt', 'Mitja', 'Baix']}
+                   for territory in nivells},
+        'territories': territories,
+    }
+
+
+def punts_canvi_nivells(nivell_pct, canvis):
+    """Posició (x, y) i text dels punts de canvi de cada nivell, al mig del seu tram de la barra apilada."""
+    nivells = [nivell for nivell in ['Alt', 'Mitja', 'Baix'] if nivell in nivell_pct.columns]
+    mig = nivell_pct[nivells].cumsum(axis=1) - nivell_pct[nivells] / 2
+    x, y, textos = [], [], []
+    for nivell in nivells:
+        # Al servei, la barra de "Tots" és la del territori consultat i pot no tenir tots els anys
+        for canvi in (canvi for canvi in canvis[nivell] if canvi['any'] in mig.index):
+            x.append(canvi['any'])
+            y.append(mig.loc[canvi['any'], nivell])
+            textos.append(text_canvi(nivell, canvi, '{:.1f}%'))
+    return x, y, textos
+
+
+def crear_visualitzacio4(dades):
+    """Barres apilades dels nivells d'assoliment per any, amb desplegable per territori."""
+    territories = dades['territories']
+
+    # Dades per defecte: "Tots"
+    default_territory_chart4 = 'Tots'
+    nivell_pivot_pct = dades['nivells'][default_territory_chart4]
+    nivell_pivot_error = dades['errors'][default_territory_chart4]
+
+    fig4 = go.Figure()
+
+    colors_nivell = {'Alt': '#2ecc71', 'Mitja': '#f39c12', 'Baix': '#e74c3c'}
+
+    for nivell in ['Alt', 'Mitja', 'Baix']:
+        if nivell in nivell_pivot_pct.columns:
+            fig4.add_trace(go.Bar(
+                x=nivell_pivot_pct.index,
+                y=nivell_pivot_pct[nivell],
+                name=nivell,
+                marker_color=colors_nivell[nivell],
+                customdata=nivell_pivot_error[nivell],
+                hovertemplate='<b>Any: %{x}</b><br>' +
+                              f'{nivell}: %{{y:.1f}}% ± %{{customdata:.1f}} ({ETIQUETA_INTERVAL})<br>' +
+                              '<extra></extra>'
+            ))
+    fig4.add_trace(traca_canvis(*punts_canvi_nivells(nivell_pivot_pct, dades['canvis'][default_territory_chart4])))
+
+    # Valors de cada territori per al dropdown de Chart 4, una sola vegada
+    valors = {}
+    for territory in ['Tots'] + list(territories):
+        nivell_pct_t = dades['nivells'][territory]
+        nivell_error_t = dades['errors'][territory]
+
+        x_data = []
+        y_data = []
+        error_data = []
+        for nivell in ['Alt', 'Mitja', 'Baix']:
+            x_data.append(nivell_pct_t.index.values)
+            if nivell in nivell_pct_t.columns:
+                y_data.append(nivell_pct_t[nivell].values)
+                error_data.append(nivell_error_t[nivell].values)
+            else:
+                y_data.append(np.zeros(len(nivell_pct_t.index)))
+                error_data.append(np.zeros(len(nivell_pct_t.index)))
+        # La traça dels punts de canvi va després de les barres
+        x_canvis, y_canvis, text_canvis = punts_canvi_nivells(nivell_pct_t, dades['canvis'][territory])
+        valors[territory] = {'x': x_data + [x_canvis], 'y': y_data + [y_canvis],
+                             'customdata': error_data + [text_canvis]}
+
+    fig4.update_layout(
+        updatemenus=[
+            dict(
+                buttons=botons_territori(valors),
+                direction="down",
+                pad={"r": 10, "t": 10},
+                showactive=True,
+                x=0.5,
+                xanchor="center",
+                y=1.20,
+                yanchor="top",
+                bgcolor="white",
+                bordercolor="gray",
+                borderwidth=2
+            )
+        ],
+        title=f'Distribució per Nivell d\'Assoliment - {default_territory_chart4}',
+        meta=selector_territori('Distribució per Nivell d\'Assoliment - {territori}', valors),
+        barmode='stack',
+        xaxis_title='Any',
+        yaxis_title='Percentatge d\'alumnes (%)',
+        height=500,
+        margin=dict(l=80, r=50, t=120, b=80),
+        legend=dict(
+            title='Nivell Assoliment',
+            orientation="v",
+            yanchor="top",
+            y=0.99,
+            xanchor="right",
+            x=0.99,
+            bgcolor="rgba(255, 255, 255, 0.9)",
+            bordercolor="gray",
+            borderwidth=1
+        ),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        yaxis=dict(gridcolor='rgba(200, 200, 200, 0.3)', range=[0, 100]),
+        xaxis=dict(dtick=1)
+    )
+
+    return fig4
+
+
+# ==============================================================================
+# Visualització 5: Densitat conjunta de PLING i PMAT
+# ==============================================================================
+# Opcions dels botons de gènere ('Tots' inclou també els alumnes sense gènere informat)
+GENERES_DENSITAT = ['Tots', 'Dona', 'Home']
+
+
+def agregar_visualitzacio5(densitat, territories):
+    """Graelles de recomptes PLING × PMAT i punts de la mostra per territori (i "Tots") i gènere.
+
+    `densitat` és el resultat de dades.AcumuladorDensitat (None si l'informe
+    prové d'un estat desat que no inclou la densitat).
+    """
+    if densitat is None:
+        return {'graelles': None, 'punts': None, 'caselles': CASELLES_DENSITAT, 'territories': territories}
+
+    # Graella territori × gènere × PMAT × PLING; l'última posició dels dos primers
+    # eixos recull els valors que no hi són (nuls o no llistats) i només compta als totals
+    recomptes = densitat['recomptes']
+    caselles = densitat['caselles']
+    index = recomptes.index
+    graella = np.zeros((len(territories) + 1, len(GENERES_DENSITAT), caselles, caselles), dtype=np.int64)
+    np.add.at(graella, (pd.Index(territories).get_indexer(index.get_level_values('AREA_TERRITORIAL')),
+                        pd.Index(GENERES_DENSITAT[1:]).get_indexer(index.get_level_values('GENERE')),
+                        index.get_level_values('casella_PMAT'), index.get_level_values('casella_PLING')),
+              recomptes['n'].to_numpy())
+    per_territori = {'Tots': graella.sum(axis=0)}
+    per_territori.update(zip(territories, graella))
+    graelles = {territory: {'Tots': graella_t.sum(axis=0), 'Dona': graella_t[0], 'Home': graella_t[1]}
+                for territory, graella_t in per_territori.items()}
+
+    mostres = None
+    if densitat['punts'] is not None:
+        punts = densitat['punts']
+        territori_punt = punts.index.get_level_values('AREA_TERRITORIAL')
+        genere_punt = punts.index.get_level_values('GENERE')
+        pling = punts['PLING'].to_numpy(dtype=np.float64).round(2)
+        pmat = punts['PMAT'].to_numpy(dtype=np.float64).round(2)
+        # Els punts van ordenats pel hash: els primers de cada combinació (també
+        # les que inclouen "Tots") en són una mostra uniforme de fins a punts_per_grup alumnes
+        limit = densitat['punts_per_grup']
+        mostres = {}
+        for territory in ['Tots'] + list(territories):
+            del_territori = np.ones(len(punts), dtype=bool) if territory == 'Tots' else territori_punt == territory
+            mostres[territory] = {}
+            for genere, seleccio in [('Tots', del_territori),
+                                     ('Dona', del_territori & (genere_punt == 'Dona')),
+                                     ('Home', del_territori & (genere_punt == 'Home'))]:
+                seleccio = np.flatnonzero(seleccio)[:limit]
+                mostres[territory][genere] = (pling[seleccio], pmat[seleccio])
+    return {'graelles': graelles, 'punts': mostres, 'caselles': caselles, 'territories': territories}
+
+
+def crear_visualitzacio5(dades):
+    """Heatmap de densitat PLING × PMAT amb desplegable per territori, botons per gènere i mostra de punts opcional."""
+    fig5 = go.Figure()
+    if dades['graelles'] is None:
+        fig5.add_annotation(text="La densitat necessita les dades per alumne i no està disponible<br>"
+                                 "a l'estat desat del cub: cal tornar-lo a desar amb --desar-estat",
+                            x=0.5, y=0.5, xref='paper', yref='paper', showarrow=False, font=dict(size=14))
+        fig5.update_layout(height=300, xaxis=dict(visible=False), yaxis=dict(visible=False),
+                           paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+        return fig5
+
+    graelles = dades['graelles']
+    mostres = dades['punts']
+    territories = dades['territories']
+    amplada = 100 / dades['caselles']
+    default_territory = 'Tots'
+
+    # Una traça per gènere; els botons en canvien la visibilitat
+    for genere in GENERES_DENSITAT:
+        fig5.add_trace(go.Heatmap(
+            z=graelles[default_territory][genere],
+            x0=amplada / 2, dx=amplada,
+            y0=amplada / 2, dy=amplada,
+            colorscale='Blues',
+            zmin=0,
+            colorbar=dict(title='Alumnes'),
+            visible=genere == 'Tots',
+            name=genere,
+            hovertemplate=(f'Llengües: %{{x:.1f}} ± {amplada / 2:g}<br>Matemàtiques: %{{y:.1f}} ± {amplada / 2:g}<br>'
+                           'Alumnes: %{z:,}<extra>%{fullData.name}</extra>')
+        ))
+    if mostres is not None:
+        # Mostra acotada d'alumnes per sobre de la densitat, dibuixada amb WebGL
+        for genere in GENERES_DENSITAT:
+            pling, pmat = mostres[default_territory][genere]
+            fig5.add_trace(go.Scattergl(
+                x=pling,
+                y=pmat,
+                mode='markers',
+                marker=dict(size=3, color='rgba(44, 62, 80, 0.45)'),
+                visible=genere == 'Tots',
+                name=genere,
+                showlegend=False,
+                hovertemplate='Llengües: %{x:.2f}<br>Matemàtiques: %{y:.2f}<extra>Mostra</extra>'
+            ))
+
+    # Diagonal: per sobre, millor en matemàtiques; per sota, millor en llengües
+    fig5.add_shape(type='line', x0=0, y0=0, x1=100, y1=100,
+                   line=dict(color='rgba(231, 76, 60, 0.8)', width=1.5, dash='dash'))
+
+    # Valors de cada territori per al desplegable; les traces de punts no tenen z
+    # i les de densitat no tenen x/y (es posicionen amb x0/dx i y0/dy)
+    valors = {}
+    for territory in ['Tots'] + list(territories):
+        valors[territory] = {'z': [graelles[territory][genere] for genere in GENERES_DENSITAT]}
+        if mostres is not None:
+            valors[territory]['z'] += [None] * len(GENERES_DENSITAT)
+            valors[territory]['x'] = [None] * len(GENERES_DENSITAT) + [
+                mostres[territory][genere][0] for genere in GENERES_DENSITAT]
+            valors[territory]['y'] = [None] * len(GENERES_DENSITAT) + [
+                mostres[territory][genere][1] for genere in GENERES_DENSITAT]
+
+    traces_per_genere = 2 if mostres is not None else 1
+    botons_genere = [
+        dict(label=genere, method='restyle',
+             args=[{'visible': [opcio == genere for opcio in GENERES_DENSITAT] * traces_per_genere}])
+        for genere in GENERES_DENSITAT
+    ]
+
+    fig5.update_layout(
+        updatemenus=[
+            dict(
+                buttons=botons_territori(valors),
+                direction="down",
+                pad={"r": 10, "t": 10},
+                showactive=True,
+                x=0.35,
+                xanchor="center",
+                y=1.20,
+                yanchor="top",
+                bgcolor="white",
+                bordercolor="gray",
+                borderwidth=2
+            ),
+            dict(
+                type='buttons',
+                buttons=botons_genere,
+                direction="right",
+                pad={"r": 10, "t": 10},
+                showactive=True,
+                x=0.65,
+                xanchor="center",
+                y=1.20,
+                yanchor="top",
+                bgcolor="white",
+                bordercolor="gray",
+                borderwidth=1
+            )
+        ],
+        title=f'Densitat de Llengües vs Matemàtiques - {default_territory}',
+        meta=selector_territori('Densitat de Llengües vs Matemàtiques - {territori}', valors),
+        xaxis=dict(title='Puntuació en Llengües (PLING)', range=[0, 100], gridcolor='rgba(200, 200, 200, 0.3)'),
+        yaxis=dict(title='Puntuació en Matemàtiques (PMAT)', range=[0, 100], gridcolor='rgba(200, 200, 200, 0.3)'),
+        height=600,
+        margin=dict(l=80, r=50, t=120, b=80),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+
+    return fig5
+
+
+# Etapes (agregació, construcció de la figura) de cadascun dels cinc gràfics
+VISUALITZACIONS = [
+    (agregar_visualitzacio1, crear_visualitzacio1),
+    (agregar_visualitzacio2, crear_visualitzacio2),
+    (agregar_visualitzacio3, crear_visualitzacio3),
+    (agregar_visualitzacio4, crear_visualitzacio4),
+    (agregar_visualitzacio5, crear_visualitzacio5),
+]
+
+
+# Llistes numèriques més curtes que això (rangs, dominis d'eixos) es deixen com a text
+MIDA_MINIMA_BINARI = 8
+
+
+def _array_binari(array):
+    """Codifica un array numèric com a typed array en base64 ({dtype, bdata, shape}).
+
+    És el mateix format que fa servir plotly.py; la pàgina el descodifica abans
+    de dibuixar. Els enters que hi caben es desen com a int16 i els reals com a
+    float32, que conserva prou xifres per als percentatges i mitjanes dels gràfics.
+    """
+    if array.dtype.kind in 'iu':
+        if array.size == 0 or (array.min() >= -(1 << 15) and array.max() < (1 << 15)):
+            dtype = 'i2'
+        else:
+            dtype = 'i4'
+    else:
+        dtype = 'f4'
+    bdata = base64.b64encode(np.ascontiguousarray(array, dtype='<' + dtype)).decode('ascii')
+    codificat = {'dtype': dtype, 'bdata': bdata}
+    if array.ndim > 1:
+        codificat['shape'] = ', '.join(str(mida) for mida in array.shape)
+    return codificat
+
+
+def codificar_arrays(valor):
+    """Substitueix recursivament els arrays i llistes numèriques per typed arrays en base64."""
+    if isinstance(valor, dict):
+        return {clau: codificar_arrays(v) for clau, v in valor.items()}
+    if isinstance(valor, np.ndarray):
+        if valor.dtype.kind in 'iuf':
+            return _array_binari(valor)
+        return valor
+    if isinstance(valor, (list, tuple)):
+        if len(valor) >= MIDA_MINIMA_BINARI and all(
+                isinstance(v, (int, float, np.number)) and not isinstance(v, bool) for v in valor):
+            return _array_binari(np.asarray(valor, dtype=float))
+        return [codificar_arrays(v) for v in valor]
+    return valor
+
+
+def serialitzar(valor, binari=False):
+    """Converteix dades de gràfics (una figura o una part) en JSON per a la pàgina.
+
+    Amb `binari`, els arrays numèrics s'hi escriuen com a typed arrays en base64
+    en lloc de nombres en text.
+    """
+    if binari:
+        valor = codificar_arrays(valor)
+    return json.dumps(valor, cls=PlotlyJSONEncoder)
+
+
+def serialitzar_figura(fig, binari=False):
+    """Converteix una figura en el JSON que s'insereix a l'HTML."""
+    return serialitzar(fig.to_plotly_json(), binari=binari)
+
+
+def _figura_serialitzada(numero, fonts, territories, binari):
+    """Agrega, construeix i serialitza un sol gràfic (execució dins d'un procés del pool)."""
+    agregar, crear = VISUALITZACIONS[numero]
+    return serialitzar_figura(crear(agregar(*fonts, territories)), binari=binari)
+
+
+def serialitzar_en_paralel(cub, territories, processos=None, binari=False, densitat=None, canvis=None, numeros=None):
+    """Construeix i serialitza els gràfics en paral·lel i en retorna el JSON en ordre.
+
+    Cada procés rep només les dades del seu gràfic (el cub d'agregats, els
+    punts de canvi o la densitat, que són petits) i executa el mateix codi que el camí
+    seqüencial, de manera que el resultat és idèntic. `numeros` limita la
+    feina a aquests gràfics (1-N); per defecte es fan tots.
+    """
+    fonts = {'cub': cub, 'densitat': densitat, 'canvis': canvis or {}}
+    numeros = numeros or range(1, len(VISUALITZACIONS) + 1)
+    with ProcessPoolExecutor(max_workers=processos or len(numeros)) as executor:
+        resultats = [executor.submit(_figura_serialitzada, numero - 1,
+                                     [fonts[nom] for nom in FONTS_VISUALITZACIONS[numero - 1]], territories, binari)
+                     for numero in numeros]
+        return [resultat.result() for resultat in resultats]
@@ -0,0 +1,99 @@
+"""
+Instrumentació per etapes del pipeline de la visualització
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+
+def pic_memoria_bytes():
+    """Pic de memòria resident del procés fins ara, o None si el sistema no el proporciona."""
+    try:
+        import resource
+    except ImportError:
+        # Windows: el pic del working set el dona psutil
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux el dona en KB i macOS en bytes
+    return pic if sys.platform == 'darwin' else pic * 1024
+
+
+class Perfilador:
+    """Registra temps de rellotge, temps de CPU, increment del pic de memòria i recomptes de cada etapa.
+
+    Mentre no s'activa, etapa() no mesura res i el cost és negligible. La
+    memòria és l'increment del pic de memòria resident del procés durant
+    l'etapa, de manera que una etapa que no supera el pic anterior hi suma zero.
+    Les etapes poden anar niades: cada registre porta el seu 'nivell' (0 per a
+    les de primer nivell) i es desa abans que les etapes que conté.
+    """
+
+    def __init__(self):
+        self.actiu = False
+        self.etapes = []
+        # Profunditat de l'etapa en curs de cada fil (el servei atén peticions en paral·lel)
+        self._fil = threading.local()
+
+    def activar(self):
+        self.actiu = True
+
+    @contextlib.contextmanager
+    def etapa(self, nom):
+        """Mesura el bloc; el diccionari retornat admet recomptes com 'files' o 'grups'."""
+        registre = {'etapa': nom}
+        if not self.actiu:
+            yield registre
+            return
+
+        registre['nivell'] = nivell = getattr(self._fil, 'nivell', 0)
+        self.etapes.append(registre)
+        self._fil.nivell = nivell + 1
+        pic = pic_memoria_bytes()
+        temps_cpu = time.process_time()
+        # Inclou els processos fills acabats (per exemple, el pool del mode paral·lel)
+        fills = os.times()
+        inici = time.perf_counter()
+        try:
+            yield registre
+        finally:
+            self._fil.nivell = nivell
+            registre['segons'] = round(time.perf_counter() - inici, 4)
+            fills_despres = os.times()
+            registre['cpu_segons'] = round(
+                time.process_time() - temps_cpu
+                + (fills_despres.children_user - fills.children_user)
+                + (fills_despres.children_system - fills.children_system), 4)
+            if pic is not None:
+                registre['pic_memoria_mb'] = round((pic_memoria_bytes() - pic) / (1 << 20), 2)
+
+    def resum(self):
+        """Imprimeix una taula amb les etapes registrades (les niades, sagnades i sense sumar-les al total)."""
+        print(f"{'Etapa':<24}{'Temps (s)':>11}{'CPU (s)':>10}{'Memòria (MB)':>14}  Recomptes")
+        for registre in self.etapes:
+            recomptes = ', '.join(f'{k}={v:,}' for k, v in registre.items()
+                                  if k not in ('etapa', 'nivell', 'segons', 'cpu_segons', 'pic_memoria_mb'))
+            memoria = registre.get('pic_memoria_mb')
+            etapa = '  ' * registre['nivell'] + registre['etapa']
+            print(f"{etapa:<24}{registre['segons']:>11.3f}{registre['cpu_segons']:>10.3f}"
+                  f"{'-' if memoria is None else f'{memoria:.1f}':>14}  {recomptes}")
+        total = sum(r['segons'] for r in self.etapes if r['nivell'] == 0)
+        print(f"{'Total':<24}{total:>11.3f}")
+
+    def desar(self, ruta):
+        """Desa les etapes registrades com a informe JSON."""
+        pic = pic_memoria_bytes()
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump({'etapes': self.etapes, 'pic_memoria_mb': None if pic is None else round(pic / (1 << 20), 2)},
+                      f, ensure_ascii=False, indent=2)
+
+
+# Perfilador del procés; main() l'activa amb --perfil
+perfil = Perfilador()
@@ -0,0 +1,461 @@
+"""
+Plantilla i generació de la pàgina HTML de storytelling
+"""
+
+import html
+
+FITXER_SORTIDA = 'RitaRocaTaxonera_PRAC2_Storytelling.html'
+URL_PLOTLY = 'https://cdn.plot.ly/plotly-2.27.0.min.js'
+
+PLANTILLA_HTML = """<!DOCTYPE html>
+<html lang="ca">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Com influeixen el gènere, el territori i l'entorn en els resultats escolars?</title>
+    <style>
+        body {{
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background: #667eea;
+            min-height: 100vh;
+        }}
+        .container {{
+            max-width: 1400px;
+            margin: 0 auto;
+            background: white;
+            border-radius: 15px;
+            padding: 40px;
+            box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
+        }}
+        h1 {{
+            text-align: center;
+            color: #2c3e50;
+            font-size: 2.5em;
+            margin-bottom: 10px;
+            text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.1);
+        }}
+        .subtitle {{
+            text-align: center;
+            color: #7f8c8d;
+            font-size: 1.2em;
+            margin-bottom: 40px;
+        }}
+        .chart-container {{
+            margin: 40px 0;
+            padding: 20px;
+            background: #f8f9fa;
+            border-radius: 10px;
+            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+        }}
+        .chart-title {{
+            font-size: 1.5em;
+            color: #34495e;
+            margin-bottom: 15px;
+            font-weight: 600;
+        }}
+        .chart-container > div[id^="chart"] {{
+            min-height: 500px;
+        }}
+        .chart-description {{
+            color: #7f8c8d;
+            margin-bottom: 20px;
+            font-size: 0.95em;
+            line-height: 1.6;
+        }}
+        .stats {{
+            display: flex;
+            justify-content: space-around;
+            margin: 30px 0;
+            flex-wrap: wrap;
+        }}
+        .stat-box {{
+            background: #667eea;
+            color: white;
+            padding: 20px 30px;
+            border-radius: 10px;
+            text-align: center;
+            min-width: 180px;
+            margin: 10px;
+            transition: transform 0.3s ease;
+        }}
+        .stat-box:hover {{
+            transform: translateY(-5px);
+            box-shadow: 0 10px 20px rgba(0, 0, 0, 0.2);
+        }}
+        .stat-number {{
+            font-size: 2.5em;
+            font-weight: bold;
+        }}
+        .stat-label {{
+            font-size: 1em;
+            opacity: 0.9;
+        }}
+        .stat-note {{
+            font-size: 0.8em;
+            opacity: 0.85;
+            margin-top: 4px;
+        }}
+        .stat-box.positive {{
+            background: #2ecc71;
+        }}
+        .stat-box.negative {{
+            background: #e74c3c;
+        }}
+        footer {{
+            margin-top: 60px;
+            padding-top: 30px;
+            border-top: 2px solid #e0e0e0;
+            text-align: center;
+            color: #7f8c8d;
+            font-size: 0.9em;
+        }}
+        .interpretation {{
+            background: #e8f4f8;
+            border-left: 4px solid #3498db;
+            padding: 15px;
+            margin: 20px 0;
+            border-radius: 5px;
+        }}
+        .interpretation h3 {{
+            color: #2c3e50;
+            margin-top: 0;
+            font-size: 1.1em;
+        }}
+        .interpretation p {{
+            color: #555;
+            line-height: 1.6;
+            margin: 10px 0;
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>Com influeixen el gènere, el territori i l'entorn <br> en els resultats escolars?</h1>
+        <div class="subtitle">Anàlisi de les Competències Bàsiques de Sisè de Primària a Catalunya ({primer_any}-{darrer_any}){filtre}<br>
+        <small>Font: Portal de dades obertes de la Generalitat de Catalunya (Dades proveïdes pel Departament d'Educació)</small></div>
+
+        <div class="stats">
+            <div class="stat-box">
+                <div class="stat-number">{total_students:,}</div>
+                <div class="stat-label">Alumnes Analitzats</div>{nota_alumnes}
+            </div>
+            <div class="stat-box">
+                <div class="stat-number">{num_territories}</div>
+                <div class="stat-label">Àrees Territorials</div>
+            </div>
+            <div class="stat-box">
+                <div class="stat-number">{mitjana_global:.1f}</div>
+                <div class="stat-label">Mitjana Global</div>{nota_mitjana}
+            </div>
+            <div class="stat-box {classe_creixement}">
+                <div class="stat-number">{creixement_percentual:+.2f}%</div>
+                <div class="stat-label">Creixement vs Any Anterior</div>{nota_creixement}
+            </div>
+        </div>
+
+        <!-- Visualització 1: Evolució LING_MAT -->
+        <div class="chart-container">
+            <div class="chart-title">1. Equilibri entre Competències Lingüístiques i Matemàtiques</div>
+            <div class="chart-description">
+                Aquest gràfic mostra l'evolució de la diferència entre el rendiment en llengües i matemàtiques al llarg dels anys.
+                <br> Els valors <b>positius</b> indiquen <b>millor rendiment en llengües</b>, mentre que els 
+                valors <b>negatius</b> indiquen <b>millor rendiment en matemàtiques</b>.
+            </div>
+            <div id="chart1"></div>
+            <div class="interpretation">
+                <h3>Punts clau:</h3>
+                <p>S'observa com els <b>nois presenten major desequilibri</b> (habitualment presentant millors resultats en matemàtiques que en llengües).
+                Tot i així en els últims anys aquest desequilibri ha anat millorant.<br>
+                Les <b>noies</b> partien d'un <b>equilibri més gran</b> entre ambdues competències, encara que en els <b>últims anys</b> han mostrat <b>millors resultats en llengües que en matemàtiques</b>. 
+                </p>{canvis1}
+            </div>
+        </div>
+
+        <!-- Visualització 2: Mitjana Global per territori -->
+        <div class="chart-container">
+            <div class="chart-title">2. Rendiment per Àrea Territorial segons l'Edat Relativa</div>
+            <div class="chart-description">
+                Gràfic de línies que mostra com <b>evoluciona la mitjana global</b> de cada àrea territorial en <b>funció de 
+                l'edat relativa</b> dels alumnes.<br>
+                L'edat relativa indica els mesos de diferència respecte l'edat mínima per cursar sisè.
+            </div>
+            <div id="chart2"></div>
+            <div class="interpretation">
+                <h3>Punts clau:</h3>
+                <p><b>L'edat relativa</b> té un lleuger <b>impacte en el rendiment acadèmic</b>. Els alumnes més grans dins del 
+                mateix curs tendeixen a obtenir millors resultats.<br>
+                Les <b>diferències</b> gairebé constants <b>entre territoris</b> poden reflectir factors socioeconòmics, 
+                recursos educatius i polítiques locals.</p>{canvis2}
+            </div>
+        </div>
+
+        <!-- Visualització 3: Heatmaps comparatius -->
+        <div class="chart-container">
+            <div class="chart-title">3. Comparativa entre Llengües i Matemàtiques en funció del Centre i Gènere</div>
+            <div class="chart-description">
+                Mapes de calor interactius que permeten <b>comparar el rendiment</b> en llengües i matemàtiques 
+                segons la naturalesa del centre (públic/privat) i el gènere. 
+                <br>Utilitzeu el selector superior per filtrar per àrea territorial.
+            </div>
+            <div id="chart3"></div>
+            <div class="interpretation">
+                <h3>Punts clau:</h3>
+                <p>La visualització mostra que, en mitjana, els <b>nois obtenen puntuacions més altes en matemàtiques que en llengües</b>, 
+                mentre que les <b>noies</b> presenten valors <b>més equilibrats</b> entre ambdues competències.<br>
+                <b>En llengües, les noies superen els nois, i en matemàtiques passa a l'inrevés.</b><br>
+                També s'observa que els <b>centres privats</b> tenen <b>mitjanes més altes que els públics</b> en totes les competències 
+                (les diferències en funció del centre podríen estar relacionades amb factors socioeconòmics).</p>
+            </div>
+        </div>
+
+        <!-- Visualització 4: Nivell d'Assoliment -->
+        <div class="chart-container">
+            <div class="chart-title">4. Evolució dels Nivells d'Assoliment</div>
+            <div class="chart-description">
+                Gràfic de barres apilades que mostra el percentatge d'alumnes en cada nivell d'assoliment 
+                (Alt, Mitja, Baix) al llarg dels anys. Permet avaluar l'evolució global de la qualitat educativa.
+            </div>
+            <div id="chart4"></div>
+            <div class="interpretation">
+                <h3>Punts clau:</h3>
+                <p>S'observa com es manté una <b>distribució bastant estable</b> al llarg dels anys.<br>
+                En els <b>dos últims anys</b> es veu, però, un <b>increment del 3% en el nivell baix</b>, cosa preocupant si es manté
+                o segueix creixent</p>{canvis4}
+            </div>
+        </div>
+
+        <!-- Visualització 5: Densitat conjunta PLING × PMAT -->
+        <div class="chart-container">
+            <div class="chart-title">5. Distribució Conjunta de Llengües i Matemàtiques</div>
+            <div class="chart-description">
+                Mapa de densitat amb el <b>nombre d'alumnes</b> per a cada combinació de puntuació en llengües i en
+                matemàtiques, calculat per caselles a partir de totes les respostes.
+                <br>Utilitzeu el selector superior per filtrar per àrea territorial i els botons per gènere.
+            </div>
+            <div id="chart5"></div>
+            <div class="interpretation">
+                <h3>Punts clau:</h3>
+                <p>La major part dels alumnes es concentra <b>a prop de la diagonal</b>: qui té bons resultats en una
+                competència acostuma a tenir-los també en l'altra.<br>
+                Els alumnes <b>per sota de la diagonal</b> rendeixen més en llengües que en matemàtiques, i els
+                <b>de sobre</b>, a l'inrevés; comparant els botons de gènere es veu com les noies es desplacen cap a
+                les llengües i els nois cap a les matemàtiques.</p>
+            </div>
+        </div>
+
+        <footer>
+            <p><strong>Font:</strong> Portal de dades obertes de la Generalitat de Catalunya (Dades proveïdes pel Departament d'Educació).</p>
+            <p><strong>Metodologia:</strong> Anàlisi amb {total_students:,} observacions de {num_territories} àrees territorials.</p>
+            <p>Visualització creada amb Plotly i Python per a l'assignatura de Visualització de Dades - UOC</p>
+            <p><strong>Autora:</strong> Rita Roca Taxonera</p>
+        </footer>
+    </div>
+
+    <!-- Dades de cada gràfic; només es llegeixen quan el gràfic s'ha de dibuixar -->
+    <script type="application/json" id="chart1-data">{chart1_json}</script>
+    <script type="application/json" id="chart2-data">{chart2_json}</script>
+    <script type="application/json" id="chart3-data">{chart3_json}</script>
+    <script type="application/json" id="chart4-data">{chart4_json}</script>
+    <script type="application/json" id="chart5-data">{chart5_json}</script>
+
+    {script_plotly}
+    <script>
+
+        // Descodifica els arrays numèrics desats com a typed arrays en base64 ({{dtype, bdata, shape}})
+        var TIPUS_ARRAYS = {{i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+                            i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array}};
+        // Els arrays de més d'una dimensió (z dels heatmaps, customdata) es tornen com a llistes niades
+        function formar(array, forma) {{
+            var mida = forma.slice(1).reduce(function (a, b) {{ return a * b; }}, 1);
+            var files = [];
+            for (var f = 0; f < forma[0]; f++) {{
+                var fila = array.subarray(f * mida, (f + 1) * mida);
+                files.push(forma.length > 2 ? formar(fila, forma.slice(1)) : Array.from(fila));
+            }}
+            return files;
+        }}
+        function descodificar(valor) {{
+            if (Array.isArray(valor)) return valor.map(descodificar);
+            if (valor === null || typeof valor !== 'object') return valor;
+            if (typeof valor.bdata === 'string' && TIPUS_ARRAYS[valor.dtype]) {{
+                var text = atob(valor.bdata);
+                var bytes = new Uint8Array(text.length);
+                for (var i = 0; i < text.length; i++) bytes[i] = text.charCodeAt(i);
+                var array = new TIPUS_ARRAYS[valor.dtype](bytes.buffer);
+                var forma = valor.shape ? String(valor.shape).split(',').map(Number) : [array.length];
+                return forma.length < 2 ? array : formar(array, forma);
+            }}
+            var resultat = {{}};
+            for (var clau in valor) resultat[clau] = descodificar(valor[clau]);
+            return resultat;
+        }}
+        // Desplegables per territori: apliquen els valors de la taula desada a layout.meta.selector
+        function connectarSelector(id, dades) {{
+            var selector = dades.layout.meta && dades.layout.meta.selector;
+            if (!selector) return;
+            var grafic = document.getElementById(id);
+            grafic.on('plotly_buttonclicked', function (event) {{
+                // Els altres menús (per exemple, els botons de gènere) actuen pel seu compte
+                if (event.button.method !== 'skip') return;
+                var territori = event.button.label;
+                var titol = {{title: selector.titol.replace('{{territori}}', territori)}};
+                if (selector.valors[territori] || !selector.url) {{
+                    Plotly.update(grafic, selector.valors[territori], titol);
+                    return;
+                }}
+                // Pàgina servida pel servei d'agregats: els valors es demanen al servidor i es guarden
+                fetch(selector.url + '?territori=' + encodeURIComponent(territori))
+                    .then(function (resposta) {{ return resposta.json(); }})
+                    .then(function (valors) {{
+                        selector.valors[territori] = descodificar(valors);
+                        Plotly.update(grafic, selector.valors[territori], titol);
+                    }});
+            }});
+        }}
+
+        // Cada gràfic es llegeix, es descodifica i es dibuixa quan s'acosta a la pantalla
+        function dibuixar(id) {{
+            var dades = descodificar(JSON.parse(document.getElementById(id + '-data').textContent));
+            Plotly.newPlot(id, dades.data, dades.layout, {{responsive: true}});
+            connectarSelector(id, dades);
+        }}
+        var grafics = ['chart1', 'chart2', 'chart3', 'chart4', 'chart5'];
+        if ('IntersectionObserver' in window) {{
+            var observador = new IntersectionObserver(function (entrades) {{
+                entrades.forEach(function (entrada) {{
+                    if (!entrada.isIntersecting) return;
+                    observador.unobserve(entrada.target);
+                    dibuixar(entrada.target.id);
+                }});
+            }}, {{rootMargin: '200px 0px'}});
+            grafics.forEach(function (id) {{ observador.observe(document.getElementById(id)); }});
+        }} else {{
+            grafics.forEach(dibuixar);
+        }}
+    </script>
+</body>
+</html>"""
+
+
+def script_plotly(plotly_local=None):
+    """Etiqueta <script> de Plotly: el CDN o, amb `plotly_local`, el bundle inserit a la pàgina.
+
+    `plotly_local` pot ser la ruta d'un plotly.min.js desat prèviament o True per
+    fer servir el bundle que porta el paquet plotly instal·lat.
+    """
+    if not plotly_local:
+        return f'<script src="{URL_PLOTLY}"></script>'
+    if plotly_local is True:
+        from plotly.offline import get_plotlyjs
+
+        bundle = get_plotlyjs()
+    else:
+        with open(plotly_local, encoding='utf-8') as f:
+            bundle = f.read()
+    return f'<script>{bundle}</script>'
+
+
+def _json_script(chart_json):
+    """Evita que un "</" dins del JSON tanqui l'etiqueta <script> que el conté."""
+    return chart_json.replace('</', '<\\/')
+
+
+def _trams(canvis_serie, format_valor):
+    """Text dels canvis d'una sèrie: 'a partir de 2014 (1.23 → 0.74) i de 2018 (0.74 → 1.14)'."""
+    return 'a partir de ' + ' i de '.join(
+        f"{canvi['any']} ({format_valor.format(canvi['abans'])} → {format_valor.format(canvi['despres'])})"
+        for canvi in canvis_serie)
+
+
+def text_canvis(canvis, series, format_valor, buit):
+    """Punts de canvi de les sèries indicades, com a llista de (nom, clau).
+
+    Només s'hi citen les sèries amb algun canvi; `buit` és el text quan no n'hi ha cap.
+    """
+    parts = [f'{html.escape(nom)} {_trams(canvis[clau], format_valor)}'
+             for nom, clau in series if canvis.get(clau)]
+    return '; '.join(parts) if parts else buit
+
+
+def _paragraf_canvis(titol, text):
+    return f'\n                <p><b>{titol}:</b> {text}.</p>'
+
+
+def textos_canvis(canvis, territories):
+    """Textos dels punts de canvi de la pàgina (gràfics 1, 2 i 4) a partir de canvis.detectar_canvis."""
+    if canvis is None:
+        return {'canvis1': '', 'canvis2': '', 'canvis4': ''}
+
+    baix = canvis.get(('Baix', 'Tots'), [])
+    if baix:
+        darrer = baix[-1]
+        canvi_nivell_baix = (f"a partir de <b>{darrer['any']}</b> passa d'un {darrer['abans']:.1f}% a un "
+                             f"{darrer['despres']:.1f}% dels alumnes de mitjana")
+        if darrer['despres'] > darrer['abans']:
+            canvi_nivell_baix += ', cosa preocupant si es manté o segueix creixent'
+    else:
+        canvi_nivell_baix = "no s'hi detecta cap canvi significatiu en el percentatge d'alumnes"
+
+    nivells = ('Alt', 'Mitja', 'Baix')
+    canvis4 = text_canvis(canvis, [(f'nivell {nivell.lower()}', (nivell, 'Tots')) for nivell in nivells],
+                          '{:.1f}%', 'cap en el conjunt de territoris')
+    canvis_territoris = sum(len(canvis.get((nivell, territori), [])) for territori in territories for nivell in nivells)
+    if canvis_territoris:
+        canvis4 += (f"; als territoris n'hi ha {canvis_territoris}, que es veuen triant-los al desplegable"
+                    if canvis_territoris > 1 else "; als territoris n'hi ha 1, que es veu triant-lo al desplegable")
+    return {
+        'canvis1': _paragraf_canvis('Punts de canvi detectats (◆)', text_canvis(
+            canvis, [('dones', ('LING_MAT', 'Dona')), ('homes', ('LING_MAT', 'Home'))],
+            '{:.2f}', 'cap, ni en les noies ni en els nois')),
+        'canvis2': _paragraf_canvis('Canvis de la mitjana global al llarg dels anys', text_canvis(
+            canvis, [('Catalunya', ('Mitjana_Global', 'Tots'))]
+            + [(territori, ('Mitjana_Global', territori)) for territori in territories],
+            '{:.2f}', 'cap territori no en presenta')),
+        'canvis4': (_paragraf_canvis('Nivell baix segons la detecció de canvis', canvi_nivell_baix)
+                    + _paragraf_canvis('Punts de canvi detectats (◆)', canvis4)),
+    }
+
+
+def generar_html(estadistiques, charts_json, plotly_local=None, filtre='', canvis=None):
+    """Omple la plantilla HTML amb les estadístiques clau i el JSON dels cinc gràfics.
+
+    `filtre` és la descripció del subconjunt de dades de l'informe, si n'hi ha.
+    `canvis` són els punts de canvi de les sèries anuals (canvis.detectar_canvis),
+    que es resumeixen a les interpretacions dels gràfics 1, 2 i 4.
+    Si les estadístiques provenen d'una mostra ('mostra'), les caixes indiquen
+    la mida de la mostra i l'error estimat.
+    """
+    creixement_percentual = estadistiques['creixement_percentual']
+    notes = {'nota_alumnes': '', 'nota_mitjana': '', 'nota_creixement': ''}
+    mostra = estadistiques.get('mostra')
+    if mostra:
+        fraccio = mostra['files'] / mostra['files_totals']
+        notes = {
+            'nota_alumnes': f'<div class="stat-note">mostra del {fraccio:.1%} de {mostra["files_totals"]:,}</div>',
+            'nota_mitjana': f'<div class="stat-note">± {estadistiques["error_mitjana_global"]:.2f}</div>',
+            'nota_creixement': f'<div class="stat-note">± {estadistiques["error_creixement"]:.2f}%</div>',
+        }
+        avis = 'Previsualització sobre una mostra estratificada'
+        filtre = f'{filtre} · {avis}' if filtre else avis
+    chart1_json, chart2_json, chart3_json, chart4_json, chart5_json = (
+        _json_script(chart_json) for chart_json in charts_json)
+    return PLANTILLA_HTML.format(
+        total_students=estadistiques['total_students'],
+        num_territories=estadistiques['num_territories'],
+        primer_any=estadistiques['primer_any'],
+        darrer_any=estadistiques['darrer_any'],
+        mitjana_global=estadistiques['mitjana_global'],
+        creixement_percentual=creixement_percentual,
+        classe_creixement='positive' if creixement_percentual > 0 else 'negative',
+        chart1_json=chart1_json,
+        chart2_json=chart2_json,
+        chart3_json=chart3_json,
+        chart4_json=chart4_json,
+        chart5_json=chart5_json,
+        script_plotly=script_plotly(plotly_local),
+        filtre=f'<br><b>{html.escape(filtre)}</b>' if filtre else '',
+        **notes,
+        **textos_canvis(canvis, estadistiques['territories']),
+    )
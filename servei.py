@@ -0,0 +1,182 @@
+"""
+Servei HTTP local de consultes d'agregats sobre el cub, amb memòria cau LRU de resultats
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PORT_SERVEI = 8000
+
+# Pressupost per defecte de la memòria cau de respostes (MB)
+CAU_MAX_MB = 64
+
+
+class CauLRU:
+    """Memòria cau LRU de respostes acotada pel total de bytes, segura entre fils."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entrades = OrderedDict()
+        self._bloqueig = threading.Lock()
+
+    def obtenir(self, clau):
+        with self._bloqueig:
+            valor = self._entrades.get(clau)
+            if valor is not None:
+                self._entrades.move_to_end(clau)
+            return valor
+
+    def desar(self, clau, valor):
+        # Una resposta més gran que tot el pressupost no es desa
+        if len(valor) > self.max_bytes:
+            return
+        with self._bloqueig:
+            anterior = self._entrades.pop(clau, None)
+            if anterior is not None:
+                self.bytes -= len(anterior)
+            self._entrades[clau] = valor
+            self.bytes += len(valor)
+            while self.bytes > self.max_bytes:
+                _, descartat = self._entrades.popitem(last=False)
+                self.bytes -= len(descartat)
+
+
+class ServeiAgregats:
+    """Respon consultes sobre el cub d'un informe; el dataset es carrega una sola vegada."""
+
+    def __init__(self, informe, cau_max_mb=CAU_MAX_MB):
+        self.informe = informe
+        self.cub = informe.cub
+        self.densitat = informe.densitat
+        self.canvis = informe.canvis
+        self.cau = CauLRU(cau_max_mb << 20)
+        self._pagina = None
+
+    def _valor(self, dimensio, text):
+        """Converteix un valor de la consulta al tipus de la dimensió del cub."""
+        tipus = self.cub.index.levels[self.cub.index.names.index(dimensio)].dtype
+        if tipus.kind in 'iu':
+            return int(text)
+        if tipus.kind == 'f':
+            return float(text)
+        return text
+
+    def agregat(self, parametres):
+        """JSON de /agregat?per=DIM&per=DIM&mesura=MESURA&DIM=VALOR...
+
+        `per` (repetible) són les dimensions d'agrupació, `mesura` la competència
+        de la qual es vol la mitjana (opcional) i la resta de paràmetres són
+        filtres (repetir-los selecciona diversos valors).
+        """
+        import dades
+
+        dimensions = parametres.pop('per', [])
+        mesura = parametres.pop('mesura', [None])[-1]
+        desconegudes = [dimensio for dimensio in parametres if dimensio not in dades.DIMENSIONS_CUB]
+        if desconegudes:
+            raise ValueError(f"Filtres desconeguts: {', '.join(desconegudes)}")
+        filtres = {dimensio: [self._valor(dimensio, valor) for valor in valors]
+                   for dimensio, valors in parametres.items()}
+        resultat = dades.consultar_cub(self.cub, dimensions, mesura, **filtres).reset_index()
+        columnes = list(dimensions) + [columna for columna in ('n', 'mitjana') if columna in resultat]
+        files = [dict(zip(columnes, fila)) for fila in zip(*(resultat[columna].tolist() for columna in columnes))]
+        return json.dumps({'per': dimensions, 'mesura': mesura, 'filtres': filtres, 'files': files},
+                          ensure_ascii=False)
+
+    def selector(self, numero, parametres):
+        """JSON de /selector/N?territori=T: els valors que el desplegable del gràfic N aplica per a T."""
+        import dades
+        import grafics
+
+        territori = parametres.get('territori', [None])[-1]
+        if territori not in set(self.cub.index.get_level_values('AREA_TERRITORIAL')):
+            raise ValueError(f"Territori desconegut: {territori}")
+        if not 1 <= numero <= len(grafics.VISUALITZACIONS):
+            raise ValueError(f"Gràfic desconegut: {numero}")
+        agregar, crear = grafics.VISUALITZACIONS[numero - 1]
+        fonts = {
+            'cub': lambda: dades.filtrar_cub(self.cub, AREA_TERRITORIAL=territori),
+            'densitat': lambda: dades.filtrar_densitat(self.densitat, AREA_TERRITORIAL=territori),
+            'canvis': lambda: self.canvis,
+        }
+        figura = crear(agregar(*[fonts[nom]() for nom in grafics.FONTS_VISUALITZACIONS[numero - 1]], [territori]))
+        if not figura.layout.meta or 'selector' not in figura.layout.meta:
+            raise ValueError(f"El gràfic {numero} no té desplegable per territori")
+        valors = figura.layout.meta['selector']['valors'][territori]
+        return grafics.serialitzar(valors, binari=self.informe.binari)
+
+    def pagina(self):
+        """Pàgina de storytelling amb els desplegables connectats a /selector en lloc de la taula inserida."""
+        if self._pagina is None:
+            import pagina
+
+            charts_json = []
+            for numero, chart_json in enumerate(self.informe.charts_json, start=1):
+                figura = json.loads(chart_json)
+                selector = (figura['layout'].get('meta') or {}).get('selector')
+                if selector:
+                    selector['valors'] = {'Tots': selector['valors']['Tots']}
+                    selector['url'] = f'/selector/{numero}'
+                    chart_json = json.dumps(figura)
+                charts_json.append(chart_json)
+            self._pagina = pagina.generar_html(self.informe.estadistiques, charts_json,
+                                               plotly_local=self.informe.plotly_local,
+                                               filtre=self.informe.descripcio_filtres(), canvis=self.canvis)
+        return self._pagina
+
+    def respondre(self, url):
+        """Resposta (codi, tipus, cos) d'una petició GET, passant per la memòria cau."""
+        parts = urlsplit(url)
+        parametres = parse_qs(parts.query)
+        tipus = 'text/html' if parts.path == '/' else 'application/json'
+        clau = (parts.path, tuple(sorted((nom, tuple(valors)) for nom, valors in parametres.items())))
+        cos = self.cau.obtenir(clau)
+        if cos is not None:
+            return 200, tipus, cos
+
+        if parts.path == '/':
+            cos = self.pagina()
+        elif parts.path == '/agregat':
+            cos = self.agregat(parametres)
+        elif parts.path.startswith('/selector/') and parts.path[len('/selector/'):].isdigit():
+            cos = self.selector(int(parts.path[len('/selector/'):]), parametres)
+        else:
+            return 404, tipus, json.dumps({'error': f"Ruta desconeguda: {parts.path}"}, ensure_ascii=False)
+        cos = cos.encode('utf-8')
+        self.cau.desar(clau, cos)
+        return 200, tipus, cos
+
+
+class GestorPeticions(BaseHTTPRequestHandler):
+    servei = None
+
+    def do_GET(self):
+        try:
+            codi, tipus, cos = self.servei.respondre(self.path)
+        except (ValueError, IndexError, KeyError) as error:
+            codi, tipus, cos = 400, 'application/json', json.dumps({'error': str(error)}, ensure_ascii=False)
+        if isinstance(cos, str):
+            cos = cos.encode('utf-8')
+        self.send_response(codi)
+        self.send_header('Content-Type', f'{tipus}; charset=utf-8')
+        self.send_header('Content-Length', str(len(cos)))
+        self.end_headers()
+        self.wfile.write(cos)
+
+
+def servir(informe, port=PORT_SERVEI, cau_max_mb=CAU_MAX_MB):
+    """Carrega el dataset una vegada i atén peticions a http://127.0.0.1:port/ fins a Ctrl+C.
+
+    Amb el port 0, el sistema operatiu en tria un de lliure, que s'indica en arrencar.
+    """
+    servei = ServeiAgregats(informe, cau_max_mb)
+    servei.pagina()
+    gestor = type('Gestor', (GestorPeticions,), {'servei': servei})
+    with ThreadingHTTPServer(('127.0.0.1', port), gestor) as servidor:
+        servidor.daemon_threads = True
+        print(f"Servei d'agregats a http://127.0.0.1:{servidor.server_address[1]}/ (Ctrl+C per aturar)")
+        servidor.serve_forever()
@@ -0,0 +1,96 @@
+"""
+Mode vigilància: manté les dades carregades i regenera l'HTML quan canvien el CSV, els gràfics o la plantilla
+"""
+
+import importlib
+import os
+import time
+
+import etapes
+from instrumentacio import perfil
+
+# Freqüència amb què es comproven els fitxers vigilats (segons)
+INTERVAL_VIGILANCIA = 0.5
+
+
+def _marca(ruta):
+    """Data de modificació i mida d'un fitxer (None si no existeix)."""
+    try:
+        estat = os.stat(ruta)
+    except FileNotFoundError:
+        return None
+    return estat.st_mtime_ns, estat.st_size
+
+
+def empremtes_grafics(ruta, nombre):
+    """Empremta del codi de cada un dels `nombre` gràfics i de la resta del mòdul de gràfics.
+
+    El codi d'un gràfic són les seves funcions agregar_visualitzacioN i
+    crear_visualitzacioN; la resta (imports, colors, serialització...) és
+    comuna a tots. Les fonts surten de etapes.fonts_modul, igual que les claus
+    del graf d'etapes.
+    """
+    noms = [[f'agregar_visualitzacio{numero}', f'crear_visualitzacio{numero}'] for numero in range(1, nombre + 1)]
+    funcions, comuna = etapes.fonts_modul(ruta, [nom for noms_grafic in noms for nom in noms_grafic])
+    return etapes.empremta(comuna), [etapes.empremta([funcions.get(nom) for nom in noms_grafic])
+                                     for noms_grafic in noms]
+
+
+def grafics_canviats(abans, despres):
+    """Números (1-N) dels gràfics que cal refer entre dues empremtes de empremtes_grafics()."""
+    comuna_abans, per_grafic_abans = abans
+    comuna_despres, per_grafic_despres = despres
+    if comuna_abans != comuna_despres or len(per_grafic_abans) != len(per_grafic_despres):
+        return list(range(1, len(per_grafic_despres) + 1))
+    return [numero for numero, (a, b) in enumerate(zip(per_grafic_abans, per_grafic_despres), start=1) if a != b]
+
+
+def vigilar(informe, ruta_html=None, interval=INTERVAL_VIGILANCIA):
+    """Genera l'informe i el torna a generar cada vegada que canvia algun fitxer vigilat.
+
+    El procés es manté viu amb els mòduls importats i el cub a memòria:
+    - si canvia el CSV, es recarrega el dataset i es refà tot;
+    - si canvia grafics.py, es recarrega el mòdul i només es refan els gràfics
+      amb codi modificat;
+    - si canvia pagina.py (la plantilla), només es torna a omplir l'HTML.
+    No retorna mai; s'atura amb Ctrl+C.
+    """
+    import dades
+    import grafics
+    import pagina
+
+    fitxers = {
+        'dades': informe.ruta or dades.FITXER_DADES,
+        'grafics': grafics.__file__,
+        'pagina': pagina.__file__,
+    }
+    ruta_html = informe.desar(ruta_html)
+    marques = {clau: _marca(ruta) for clau, ruta in fitxers.items()}
+    empremtes = empremtes_grafics(fitxers['grafics'], len(grafics.VISUALITZACIONS))
+    print(f"Vigilant {', '.join(fitxers.values())} (Ctrl+C per aturar)...")
+
+    while True:
+        time.sleep(interval)
+        canviats = [clau for clau, ruta in fitxers.items() if _marca(ruta) != marques[clau]]
+        if not canviats:
+            continue
+        marques = {clau: _marca(ruta) for clau, ruta in fitxers.items()}
+
+        inici = time.perf_counter()
+        try:
+            if 'dades' in canviats:
+                informe.invalidar(dades=True)
+            if 'grafics' in canviats:
+                importlib.reload(grafics)
+                noves = empremtes_grafics(fitxers['grafics'], len(grafics.VISUALITZACIONS))
+                informe.invalidar(grafics=grafics_canviats(empremtes, noves))
+                empremtes = noves
+            if 'pagina' in canviats:
+                importlib.reload(pagina)
+            with perfil.etapa('regeneracio'):
+                informe.desar(ruta_html)
+        except Exception as error:
+            # Un error d'edició (sintaxi, columna inexistent...) no atura la vigilància
+            print(f"Error en regenerar ({', '.join(canviats)}): {type(error).__name__}: {error}")
+            continue
+        print(f"{ruta_html} regenerat ({', '.join(canviats)}) en {time.perf_counter() - inici:.2f} s")